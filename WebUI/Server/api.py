@@ -1,5 +1,6 @@
 import sys
 import os
+import threading
 import argparse
 import uvicorn
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -11,12 +12,13 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import RedirectResponse
 from WebUI.Server.chat.chat import chat
 from WebUI.Server.chat.feedback import chat_feedback
-from WebUI.Server.embeddings_api import embed_texts_endpoint
+from WebUI.Server.embeddings_api import embed_texts_endpoint, embedding_cache_stats, embeddings_pool_stats, reranker_stats
 from WebUI.Server.chat.openai_chat import openai_chat
+from WebUI.Server.funcall.tool_executor import tool_stats, tool_cache_stats
 from WebUI.Server.chat.search_engine_chat import search_engine_chat
 from WebUI.Server.llm_api import (get_running_models, change_llm_model, stop_llm_model, chat_llm_model, download_llm_model,
                             get_model_config, save_chat_config, save_model_config, get_webui_configs, get_current_running_config, save_current_running_config, get_aigenerator_configs,
-                            get_vtot_model, get_vtot_data, stop_vtot_model, change_vtot_model, save_voice_model_config,
+                            get_vtot_model, get_vtot_data, get_vtot_stream, stop_vtot_model, change_vtot_model, save_voice_model_config,
                             get_speech_model, get_speech_data, save_speech_model_config, stop_speech_model, change_speech_model,
                             get_image_recognition_model, save_image_recognition_model_config, eject_image_recognition_model, change_image_recognition_model, get_image_recognition_data,
                             get_image_generation_model, save_image_generation_model_config, eject_image_generation_model, change_image_generation_model, get_image_generation_data,
@@ -45,6 +47,22 @@ def create_app(run_mode: str = None):
             allow_headers=["*"],
         )
     mount_app_routes(app, run_mode=run_mode)
+
+    @app.on_event("startup")
+    async def preload_embeddings():
+        from WebUI.Server.knowledge_base.kb_cache.base import embeddings_pool
+        threading.Thread(target=embeddings_pool.preload, daemon=True).start()
+
+    @app.on_event("shutdown")
+    async def flush_vector_stores():
+        from WebUI.Server.knowledge_base.kb_cache.faiss_cache import kb_faiss_pool
+        kb_faiss_pool.flush()
+
+    @app.on_event("shutdown")
+    async def flush_chat_history():
+        from WebUI.Server.db.repository import flush_chat_history
+        flush_chat_history()
+
     return app
 
 def mount_app_routes(app: FastAPI, run_mode: str = None):
@@ -151,6 +169,11 @@ def mount_app_routes(app: FastAPI, run_mode: str = None):
              summary="Translate voice to text",
              )(get_vtot_data)
     
+    app.post("/voice_model/get_vtot_stream",
+             tags=["Voice Model Management"],
+             summary="Translate a chunk of streaming voice to text",
+             )(get_vtot_stream)
+    
     app.post("/voice_model/save_voice_model_config",
              tags=["Voice Model Management"],
              summary="Save Voice Model configuration information",
@@ -310,15 +333,40 @@ def mount_app_routes(app: FastAPI, run_mode: str = None):
             tags=["Other"],
             summary="Vectorize text, supporting both local and online models.",
             )(embed_texts_endpoint)
+
+    app.post("/other/embedding_cache_stats",
+            tags=["Other"],
+            summary="Get hit/miss counters and size of the embedding cache.",
+            )(embedding_cache_stats)
+
+    app.post("/other/embeddings_pool_stats",
+            tags=["Other"],
+            summary="Get loaded embedding models, memory usage and hit/eviction counters.",
+            )(embeddings_pool_stats)
+
+    app.post("/other/reranker_stats",
+            tags=["Other"],
+            summary="Get loaded reranker models and rerank score cache counters.",
+            )(reranker_stats)
+
+    app.post("/other/tool_stats",
+            tags=["Other"],
+            summary="Get call count, errors, timeouts and latency of each tool.",
+            )(tool_stats)
+
+    app.post("/other/tool_cache_stats",
+            tags=["Other"],
+            summary="Get entries, hit/miss counters and ttls of the tool result cache.",
+            )(tool_cache_stats)
     
 def mount_knowledge_routes(app: FastAPI):
     from WebUI.Server.chat.knowledge_base_chat import knowledge_base_chat
     from WebUI.Server.chat.file_chat import upload_temp_docs, file_chat
     from WebUI.Server.chat.agent_chat import agent_chat
-    from WebUI.Server.knowledge_base.kb_api import list_kbs, create_kb, delete_kb
+    from WebUI.Server.knowledge_base.kb_api import list_kbs, create_kb, delete_kb, vector_store_cache_stats
     from WebUI.Server.knowledge_base.kb_doc_api import (list_files, upload_docs, delete_docs,
-                                                update_docs, download_doc, recreate_vector_store,
-                                                search_docs, DocumentWithVSId, update_info,
+                                                update_docs, download_doc, recreate_vector_store, sync_knowledge_base,
+                                                search_docs, search_docs_batch, DocumentWithVSId, update_info,
                                                 update_docs_by_id,)
     app.post("/chat/knowledge_base_chat",
             tags=["Chat"],
@@ -355,6 +403,12 @@ def mount_knowledge_routes(app: FastAPI):
             summary="delete knowledge base"
             )(delete_kb)
 
+    app.post("/knowledge_base/vector_store_cache_stats",
+            tags=["Knowledge Base Management"],
+            response_model=BaseResponse,
+            summary="get size, load latency and hit rate of cached vector stores"
+            )(vector_store_cache_stats)
+
     app.get("/knowledge_base/list_files",
             tags=["Knowledge Base Management"],
             response_model=ListResponse,
@@ -367,6 +421,12 @@ def mount_knowledge_routes(app: FastAPI):
             summary="search from knowledge base"
             )(search_docs)
 
+    app.post("/knowledge_base/search_docs_batch",
+            tags=["Knowledge Base Management"],
+            response_model=List[List[DocumentWithVSId]],
+            summary="search many queries from knowledge base at once"
+            )(search_docs_batch)
+
     app.post("/knowledge_base/update_docs_by_id",
             tags=["Knowledge Base Management"],
             response_model=BaseResponse,
@@ -405,6 +465,11 @@ def mount_knowledge_routes(app: FastAPI):
             summary="recreate vector store"
             )(recreate_vector_store)
 
+    app.post("/knowledge_base/sync_knowledge_base",
+            tags=["Knowledge Base Management"],
+            summary="re-ingest only added or changed files and delete vanished ones"
+            )(sync_knowledge_base)
+
     app.post("/knowledge_base/upload_temp_docs",
             tags=["Knowledge Base Management"],
             summary="upload docs to temp folder for chat"
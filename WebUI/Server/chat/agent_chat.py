@@ -4,6 +4,7 @@ from fastapi import Body
 from fastapi.responses import StreamingResponse
 from WebUI.configs.basicconfig import (ModelType, ModelSize, ModelSubType, GetModelInfoByName)
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
+from WebUI.Server.utils import ndjson_stream, NDJSON_MEDIA_TYPE
 from typing import AsyncIterable, Dict
 
 async def agent_chat(query: str = Body(..., description="User input: ", examples=["chat"]),
@@ -87,7 +88,7 @@ async def agent_chat(query: str = Body(..., description="User input: ", examples
                     ensure_ascii=False)
                 await asyncio.sleep(0.1)
 
-    return StreamingResponse(agent_chat_iterator(
+    return StreamingResponse(ndjson_stream(agent_chat_iterator(
                     query=query,
                     stream=stream,
                     interpreter_id=interpreter_id,
@@ -95,5 +96,5 @@ async def agent_chat(query: str = Body(..., description="User input: ", examples
                     temperature=temperature,
                     offline=offline,
                     auto_run=auto_run,
-                    safe_mode=safe_mode),
-            media_type="text/event-stream")
\ No newline at end of file
+                    safe_mode=safe_mode)),
+            media_type=NDJSON_MEDIA_TYPE)
\ No newline at end of file
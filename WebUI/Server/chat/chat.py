@@ -3,21 +3,20 @@ import json
 from fastapi import Body
 from fastapi.responses import StreamingResponse
 from WebUI.configs import DEF_TOKENS, SAVE_CHAT_HISTORY
-from WebUI.Server.utils import wrap_done, get_ChatOpenAI
+from WebUI.Server.utils import wrap_done, get_ChatOpenAI, ndjson_stream, NDJSON_MEDIA_TYPE
 from langchain.chains import LLMChain
 from langchain.callbacks import AsyncIteratorCallbackHandler
 from typing import AsyncIterable
 from WebUI.configs import (GetProviderByName, generate_new_query, ModelType, ModelSize, ModelSubType, ToolsType,
                             use_new_search_engine, use_knowledge_base, use_new_function_calling, use_new_toolboxes_calling, use_code_interpreter,
                             GetUserAnswerForCurConfig, GetCurrentRunningCfg, ExtractJsonStrings, GetModelInfoByName, GetModelConfig, GetSystemPromptForCurrentRunningConfig,
-                            GetSystemPromptForSupportTools, CallingExternalToolsForCurConfig, GetNewAnswerForCurConfig,)
-from langchain.prompts.chat import ChatPromptTemplate
+                            GetSystemPromptForSupportTools, CallingExternalToolsForCurConfig, ToolCallDetector, GetNewAnswerForCurConfig,)
 from typing import List, Optional, Union, Any, Dict
 from WebUI.configs import USE_RERANKER, GetRerankerModelPath
-from WebUI.Server.chat.utils import History
+from WebUI.Server.chat.utils import History, ChatPromptBuilder
 from WebUI.Server.chat.StreamHandler import StreamSpeakHandler
 from WebUI.Server.utils import get_prompt_template, detect_device
-from WebUI.Server.db.repository import add_chat_history_to_db, update_chat_history
+from WebUI.Server.db.repository import queue_chat_history, queue_chat_history_update
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
 
 async def CreateChatHistoryFromCallCalling(query: str = "", new_answer: str = "", history: list[dict] = []) ->list[dict]:
@@ -68,12 +67,12 @@ async def GetChatPromptFromKnowledgeBase(json_lists: list = [], kb_name: str = "
     from urllib.parse import urlencode
     from fastapi.concurrency import run_in_threadpool
     from WebUI.Server.reranker.reranker import LangchainReranker
-    from WebUI.Server.knowledge_base.kb_doc_api import search_docs
+    from WebUI.Server.knowledge_base.kb_doc_api import search_docs_batch
     from WebUI.Server.knowledge_base.kb_service.base import KBServiceFactory
     from WebUI.Server.knowledge_base.utils import VECTOR_SEARCH_TOP_K, SCORE_THRESHOLD
     if not json_lists or not kb_name or not query:
         return None, "", []
-    kb_query = query
+    kb_queries = []
     try:
         for item in json_lists:
             item_json = json.loads(item)
@@ -81,19 +80,29 @@ async def GetChatPromptFromKnowledgeBase(json_lists: list = [], kb_name: str = "
             if arguments:
                 first_key = next(iter(arguments))
                 first_value = arguments[first_key]
-                if isinstance(first_value, str):
-                    kb_query = first_value
-                    break
+                if isinstance(first_value, str) and first_value not in kb_queries:
+                    kb_queries.append(first_value)
     except Exception as _:
         pass
+    if not kb_queries:
+        kb_queries = [query]
+    kb_query = kb_queries[0]
     kb = KBServiceFactory.get_service_by_name(kb_name)
     if kb is None:
         return None, "", []
-    docs = await run_in_threadpool(search_docs,
-            query=kb_query,
+    # all tool call queries are searched in one batch, hits found by several queries are kept once.
+    results = await run_in_threadpool(search_docs_batch,
+            queries=kb_queries,
             knowledge_base_name=kb_name,
             top_k=VECTOR_SEARCH_TOP_K,
             score_threshold=SCORE_THRESHOLD)
+    docs = []
+    doc_ids = set()
+    for query_docs in results:
+        for doc in query_docs:
+            if doc.id not in doc_ids:
+                doc_ids.add(doc.id)
+                docs.append(doc)
     if USE_RERANKER:
             reranker_model_path = GetRerankerModelPath()
             print("-----------------model path------------------")
@@ -126,12 +135,13 @@ async def GetChatPromptFromKnowledgeBase(json_lists: list = [], kb_name: str = "
 
 async def GetChatPromptFromFunctionCalling(json_lists: list = []) ->Union[str, Any, Any]:
     from WebUI.Server.funcall.funcall import RunNormalFunctionCalling
+    from WebUI.Server.funcall.tool_executor import get_tool_executor
     if not json_lists:
         return None, "", []
     result_list = []
     func_name = []
-    for item in json_lists:
-        name, result = RunNormalFunctionCalling(item)
+    results = await get_tool_executor().run_all(RunNormalFunctionCalling, json_lists, default=("", ""))
+    for name, result in results:
         if result:
             func_name.append(name)
             result_list.append(result)
@@ -149,12 +159,14 @@ async def GetChatPromptFromFunctionCalling(json_lists: list = []) ->Union[str, A
 
 async def GetChatPromptFromCodeInterpreter(json_lists: list = []) ->Union[str, Any, Any]:
     from WebUI.Server.funcall.funcall import RunCodeInterpreter
+    from WebUI.Server.funcall.tool_executor import get_tool_executor
     if not json_lists:
         return None, "", []
     result_list = []
     func_name = []
-    for item in json_lists:
-        name, result = RunCodeInterpreter(item)
+    # code blocks of one turn share the interpreter session, run them in order
+    results = await get_tool_executor().run_all(RunCodeInterpreter, json_lists, default=("", ""), concurrent=False)
+    for name, result in results:
         if result:
             func_name.append(name)
             result_list.append(result)
@@ -172,13 +184,14 @@ async def GetChatPromptFromCodeInterpreter(json_lists: list = []) ->Union[str, A
 
 async def GetChatPromptFromToolBoxes(json_lists: list = []) ->Union[str, Any, Any]:
     from WebUI.Server.funcall.google_toolboxes.credential import RunFunctionCallingInToolBoxes
+    from WebUI.Server.funcall.tool_executor import get_tool_executor
     if not json_lists:
         return None, "", []
     result_list = []
     func_name = []
     result_dict = []
-    for item in json_lists:
-        name, result, r_dict = RunFunctionCallingInToolBoxes(item)
+    results = await get_tool_executor().run_all(RunFunctionCallingInToolBoxes, json_lists, default=("", "", {}))
+    for name, result, r_dict in results:
         if result:
             func_name.append(name)
             result_list.append(result)
@@ -279,6 +292,8 @@ async def chat(query: str = Body(..., description="User input: ", examples=["cha
                 history[0].content = history[0].content + "\n\n" + tools_system_prompt
             else:
                 history = [system_msg] + history
+        # history turns become messages once, tool-calling iterations only add their new turns
+        prompt_builder = ChatPromptBuilder(history)
         docs = []
         btalk = True
         while btalk:
@@ -332,8 +347,7 @@ async def chat(query: str = Body(..., description="User input: ", examples=["cha
                     query = generate_new_query(query, imagesprompt)
 
                 prompt_template = get_prompt_template("llm_chat", prompt_name)
-                input_msg = History(role="user", content=prompt_template).to_msg_template(False)
-                chat_prompt = ChatPromptTemplate.from_messages([i.to_msg_template() for i in history] + [input_msg])
+                chat_prompt = prompt_builder.build(prompt_template)
                 #print("chat_prompt: ", chat_prompt)
                 chain = LLMChain(prompt=chat_prompt, llm=model)
                 # Begin a task that runs in the background.
@@ -343,12 +357,13 @@ async def chat(query: str = Body(..., description="User input: ", examples=["cha
                 )
 
             answer = ""
-            chat_history_id = add_chat_history_to_db(chat_type="llm_chat", query=query)
+            chat_history_id = queue_chat_history(chat_type="llm_chat", query=query)
             if stream:
+                tool_detector = ToolCallDetector()
                 async for token in async_callback.aiter():
                     answer += token
                     if not btalk:
-                        btalk, new_answer = CallingExternalToolsForCurConfig(answer)
+                        btalk, new_answer = tool_detector.detect(answer)
                         if btalk:
                             new_query, tool_name, docs, tool_dict, tooltype = await GetQueryFromExternalToolsForCurConfig(answer=answer, query=query)
                             if not new_query:
@@ -356,8 +371,8 @@ async def chat(query: str = Body(..., description="User input: ", examples=["cha
                             else:
                                 btalk = True
                                 new_answer = GetNewAnswerForCurConfig(new_answer, tool_name, tooltype)
-                                history.append(History(role="user", content=query))
-                                history.append(History(role="assistant", content=new_answer))
+                                prompt_builder.add("user", query)
+                                prompt_builder.add("assistant", new_answer)
                                 yield json.dumps(
                                     {"clear": new_answer, "tool_dict": tool_dict},
                                     ensure_ascii=False)
@@ -383,8 +398,8 @@ async def chat(query: str = Body(..., description="User input: ", examples=["cha
                         else:
                             btalk = True
                             new_answer = GetNewAnswerForCurConfig(new_answer, tool_name, tooltype)
-                            history.append({'role': "user",'content': query})
-                            history.append({'role': "assistant", 'content': new_answer})
+                            prompt_builder.add("user", query)
+                            prompt_builder.add("assistant", new_answer)
                             yield json.dumps(
                                 {"clear": new_answer, "tool_dict": tool_dict},
                                 ensure_ascii=False)
@@ -403,10 +418,10 @@ async def chat(query: str = Body(..., description="User input: ", examples=["cha
                 tooltype = ToolsType.Unknown
 
             if SAVE_CHAT_HISTORY and len(chat_history_id) > 0:
-                update_chat_history(chat_history_id, response=answer)
+                queue_chat_history_update(chat_history_id, response=answer)
         await task
 
-    return StreamingResponse(chat_iterator(query=query,
+    return StreamingResponse(ndjson_stream(chat_iterator(query=query,
                                            imagesdata=imagesdata,
                                            audiosdata=audiosdata,
                                            videosdata=videosdata,
@@ -417,5 +432,5 @@ async def chat(query: str = Body(..., description="User input: ", examples=["cha
                                            speechmodel=speechmodel,
                                            temperature=temperature,
                                            max_tokens=max_tokens,
-                                           prompt_name=prompt_name),
-                             media_type="text/event-stream")
\ No newline at end of file
+                                           prompt_name=prompt_name)),
+                             media_type=NDJSON_MEDIA_TYPE)
\ No newline at end of file
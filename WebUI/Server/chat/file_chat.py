@@ -3,9 +3,9 @@ import json
 import asyncio
 from fastapi.responses import StreamingResponse
 from fastapi import Body, File, Form, UploadFile
-from WebUI.Server.chat.utils import History
+from WebUI.Server.chat.utils import History, ChatPromptBuilder
 from WebUI.configs import (DEF_TOKENS, GetProviderByName)
-from WebUI.Server.utils import BaseResponse, GetModelApiBaseAddress, run_in_thread_pool, wrap_done, get_ChatOpenAI, get_prompt_template
+from WebUI.Server.utils import BaseResponse, GetModelApiBaseAddress, run_in_thread_pool, wrap_done, get_ChatOpenAI, get_prompt_template, ndjson_stream, NDJSON_MEDIA_TYPE
 from WebUI.Server.knowledge_base.utils import KnowledgeFile
 from WebUI.configs.basicconfig import GetKbTempFolder, ModelType, ModelSize, ModelSubType, GetModelInfoByName
 from WebUI.Server.knowledge_base.kb_cache.faiss_cache import memo_faiss_pool
@@ -18,7 +18,6 @@ from WebUI.Server.knowledge_base.kb_service.base import EmbeddingsFunAdapter
 from WebUI.Server.chat.StreamHandler import StreamSpeakHandler
 from langchain.callbacks import AsyncIteratorCallbackHandler
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
-from langchain.prompts.chat import ChatPromptTemplate
 from typing import AsyncIterable, Dict
 
 def _parse_files_in_thread(
@@ -182,7 +181,7 @@ async def file_chat(query: str = Body(..., description="User input: ", examples=
             )
         embed_func = EmbeddingsFunAdapter()
         embeddings = await embed_func.aembed_query(query)
-        with memo_faiss_pool.acquire(knowledge_id) as vs:
+        with memo_faiss_pool.acquire_read(knowledge_id) as vs:
             docs = vs.similarity_search_with_score_by_vector(embeddings, k=top_k, score_threshold=score_threshold)
             docs = [x[0] for x in docs]
 
@@ -191,9 +190,7 @@ async def file_chat(query: str = Body(..., description="User input: ", examples=
             prompt_template = get_prompt_template("knowledge_base_chat", "Empty")
         else:
             prompt_template = get_prompt_template("knowledge_base_chat", prompt_name)
-        input_msg = History(role="user", content=prompt_template).to_msg_template(False)
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [i.to_msg_template() for i in history] + [input_msg])
+        chat_prompt = ChatPromptBuilder(history).build(prompt_template)
 
         chain = LLMChain(prompt=chat_prompt, llm=model)
 
@@ -226,7 +223,7 @@ async def file_chat(query: str = Body(..., description="User input: ", examples=
                              ensure_ascii=False)
         await task
 
-    return StreamingResponse(file_chat_iterator(query=query, 
+    return StreamingResponse(ndjson_stream(file_chat_iterator(query=query, 
                                                 knowledge_id=knowledge_id, 
                                                 top_k=top_k,
                                                 score_threshold=score_threshold,
@@ -238,4 +235,5 @@ async def file_chat(query: str = Body(..., description="User input: ", examples=
                                                 temperature=temperature,
                                                 max_tokens=max_tokens,
                                                 prompt_name=prompt_name,
-                                                request=request))
\ No newline at end of file
+                                                request=request)),
+                             media_type=NDJSON_MEDIA_TYPE)
\ No newline at end of file
@@ -0,0 +1,206 @@
+import time
+import queue
+import asyncio
+import threading
+from typing import AsyncIterable, Callable, Dict, List
+
+_END = object()
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class GenerationRequest:
+    '''
+    One prompt queued for or under generation. The worker thread pushes text with put(),
+    the chat iterator reads it with stream() on its own event loop.
+    '''
+    def __init__(self, prompt: str, loop: asyncio.AbstractEventLoop):
+        self.prompt = prompt
+        self.loop = loop
+        self.cancelled = threading.Event()
+        self._chunks = asyncio.Queue()
+
+    def _push(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self._chunks.put_nowait, item)
+        except RuntimeError:
+            # the event loop of the request is gone
+            self.cancelled.set()
+
+    def put(self, text: str):
+        if text:
+            self._push(text)
+
+    def finish(self):
+        self._push(_END)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    async def stream(self) -> AsyncIterable[str]:
+        try:
+            while True:
+                chunk = await self._chunks.get()
+                if chunk is _END:
+                    break
+                yield chunk
+        finally:
+            # a reader that stops early does not need the rest of the generation
+            self.cancel()
+
+
+class GenerationScheduler:
+    '''
+    Request queue in front of a local model. max_concurrency worker threads take requests from the
+    queue, each worker waits up to max_wait_ms to put up to max_batch_size prompts into one
+    generate(requests) call. Every request streams into its own GenerationRequest.
+    '''
+    def __init__(self, generate: Callable[[List[GenerationRequest]], None], max_concurrency: int = 1,
+                 max_batch_size: int = 1, max_wait_ms: float = 10, name: str = "generation"):
+        self.generate = generate
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000)
+        self.name = name
+        self.completed = 0
+        self.batches = 0
+        self.running = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        for i in range(self.max_concurrency):
+            threading.Thread(target=self._worker, name=f"{name}-scheduler-{i}", daemon=True).start()
+
+    def submit(self, prompt: str) -> GenerationRequest:
+        '''
+        queue a prompt, must be called from the event loop that reads the request.
+        '''
+        request = GenerationRequest(prompt, asyncio.get_running_loop())
+        self._queue.put(request)
+        return request
+
+    def _collect(self) -> List[GenerationRequest]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = []
+            for request in self._collect():
+                if request.cancelled.is_set():
+                    request.finish()
+                else:
+                    batch.append(request)
+            if not batch:
+                continue
+            with self._lock:
+                self.running += len(batch)
+            try:
+                self.generate(batch)
+            except GenerationCancelled:
+                pass
+            except Exception as e:
+                print(f"{self.name} scheduler: generation failed: {e}")
+            finally:
+                for request in batch:
+                    request.finish()
+                with self._lock:
+                    self.running -= len(batch)
+                    self.completed += len(batch)
+                    self.batches += 1
+            if len(batch) > 1:
+                print(f"{self.name} scheduler: {len(batch)} prompts generated in one batch")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "running": self.running,
+                "completed": self.completed,
+                "batches": self.batches,
+                "max_concurrency": self.max_concurrency,
+                "max_batch_size": self.max_batch_size,
+            }
+
+
+def pipeline_generate_fn(hf_model, tokenizer, **generate_kwargs) -> Callable[[List[GenerationRequest]], None]:
+    '''
+    generate() for a HuggingFace causal LM: the prompts of a batch are left padded into one
+    model.generate call and every row is decoded into its own request.
+    '''
+    from transformers import TextStreamer, StoppingCriteria, StoppingCriteriaList
+
+    class RequestStreamer(TextStreamer):
+        def __init__(self, request: GenerationRequest):
+            super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+            self.request = request
+
+        def on_finalized_text(self, text: str, stream_end: bool = False):
+            self.request.put(text)
+
+    class BatchStreamer:
+        def __init__(self, requests: List[GenerationRequest]):
+            self.streamers = [RequestStreamer(request) for request in requests]
+
+        def put(self, value):
+            for i, streamer in enumerate(self.streamers):
+                streamer.put(value[i:i + 1])
+
+        def end(self):
+            for streamer in self.streamers:
+                streamer.end()
+
+    class AllCancelled(StoppingCriteria):
+        def __init__(self, requests: List[GenerationRequest]):
+            self.requests = requests
+
+        def __call__(self, input_ids, scores, **kwargs) -> bool:
+            return all(request.cancelled.is_set() for request in self.requests)
+
+    def generate(requests: List[GenerationRequest]):
+        inputs = tokenizer([request.prompt for request in requests], return_tensors="pt",
+                           padding=True, add_special_tokens=False).to(hf_model.device)
+        hf_model.generate(**inputs,
+                          streamer=BatchStreamer(requests),
+                          stopping_criteria=StoppingCriteriaList([AllCancelled(requests)]),
+                          **generate_kwargs)
+    return generate
+
+
+def llamacpp_generate_fn(llm) -> Callable[[List[GenerationRequest]], None]:
+    '''
+    generate() for a langchain LlamaCpp model, prompts are generated one after another.
+    '''
+    from langchain.callbacks.base import BaseCallbackHandler
+
+    class RequestCallbackHandler(BaseCallbackHandler):
+        # let GenerationCancelled abort the token loop of llama.cpp
+        raise_error = True
+
+        def __init__(self, request: GenerationRequest):
+            self.request = request
+
+        def on_llm_new_token(self, token: str, **kwargs):
+            if self.request.cancelled.is_set():
+                raise GenerationCancelled()
+            self.request.put(token)
+
+    def generate(requests: List[GenerationRequest]):
+        for request in requests:
+            try:
+                llm.invoke(request.prompt, config={"callbacks": [RequestCallbackHandler(request)]})
+            except GenerationCancelled:
+                pass
+            finally:
+                request.finish()
+    return generate
@@ -2,7 +2,7 @@ from fastapi import Body, Request
 from fastapi.responses import StreamingResponse
 from WebUI.configs import (DEF_TOKENS, USE_RERANKER, GetProviderByName, GetRerankerModelPath)
 from WebUI.Server.knowledge_base.utils import SCORE_THRESHOLD
-from WebUI.Server.utils import wrap_done, get_ChatOpenAI
+from WebUI.Server.utils import wrap_done, get_ChatOpenAI, ndjson_stream, NDJSON_MEDIA_TYPE
 from langchain.chains import LLMChain
 from langchain.chat_models import ChatOpenAI
 import asyncio
@@ -11,7 +11,7 @@ from urllib.parse import urlencode
 #from sse_starlette.sse import EventSourceResponse
 from fastapi.concurrency import run_in_threadpool
 from WebUI.Server.utils import BaseResponse, GetModelApiBaseAddress, get_prompt_template, detect_device
-from WebUI.Server.chat.utils import History
+from WebUI.Server.chat.utils import History, ChatPromptBuilder
 from WebUI.Server.chat.StreamHandler import StreamSpeakHandler
 from langchain.callbacks import AsyncIteratorCallbackHandler
 from WebUI.Server.knowledge_base.kb_doc_api import search_docs
@@ -19,7 +19,6 @@ from WebUI.Server.knowledge_base.kb_service.base import KBServiceFactory
 from WebUI.configs.basicconfig import ModelType, ModelSize, ModelSubType, GetModelInfoByName
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
 from WebUI.Server.reranker.reranker import LangchainReranker
-from langchain.prompts.chat import ChatPromptTemplate
 from typing import AsyncIterable, List, Optional, Dict
 
 async def knowledge_base_chat(
@@ -143,9 +142,7 @@ async def knowledge_base_chat(
             prompt_template = get_prompt_template("knowledge_base_chat", "Empty")
         else:
             prompt_template = get_prompt_template("knowledge_base_chat", prompt_name)
-        input_msg = History(role="user", content=prompt_template).to_msg_template(False)
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [i.to_msg_template() for i in history] + [input_msg])
+        chat_prompt = ChatPromptBuilder(history).build(prompt_template)
 
         chain = LLMChain(prompt=chat_prompt, llm=model)
 
@@ -181,7 +178,7 @@ async def knowledge_base_chat(
                              ensure_ascii=False)
         await task
 
-    return StreamingResponse(knowledge_base_chat_iterator(query=query, 
+    return StreamingResponse(ndjson_stream(knowledge_base_chat_iterator(query=query, 
                                                             knowledge_base_name=knowledge_base_name, 
                                                             top_k=top_k,
                                                             score_threshold=score_threshold,
@@ -193,4 +190,5 @@ async def knowledge_base_chat(
                                                             temperature=temperature,
                                                             max_tokens=max_tokens,
                                                             prompt_name=prompt_name,
-                                                            request=request))
\ No newline at end of file
+                                                            request=request)),
+                             media_type=NDJSON_MEDIA_TYPE)
\ No newline at end of file
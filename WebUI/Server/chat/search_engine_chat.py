@@ -1,13 +1,13 @@
 from fastapi import Body
 from WebUI.configs import GetProviderByName
 from fastapi.responses import StreamingResponse
-from WebUI.Server.chat.utils import History
+from WebUI.Server.chat.utils import History, ChatPromptBuilder
 from langchain.docstore.document import Document
 from langchain.chains import LLMChain
 import asyncio
 import json
 import os
-from WebUI.Server.utils import wrap_done, get_ChatOpenAI
+from WebUI.Server.utils import wrap_done, get_ChatOpenAI, ndjson_stream, NDJSON_MEDIA_TYPE
 from fastapi.concurrency import run_in_threadpool
 from WebUI.Server.utils import get_prompt_template
 from langchain.callbacks import AsyncIteratorCallbackHandler
@@ -15,24 +15,28 @@ from langchain.utilities.google_search import GoogleSearchAPIWrapper
 from langchain.utilities.bing_search import BingSearchAPIWrapper
 from langchain.utilities.duckduckgo_search import DuckDuckGoSearchAPIWrapper
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
-from langchain.prompts.chat import ChatPromptTemplate
 from typing import AsyncIterable, Dict, List, Optional
+from WebUI.Server.funcall.tool_cache import cached_tool
 
+@cached_tool(ttl=600)
 def bing_search(text, search_url, api_key, result_len, **kwargs):
     search = BingSearchAPIWrapper(bing_subscription_key=api_key,
                                   bing_search_url=search_url)
     return search.results(text, result_len)
 
 
+@cached_tool(ttl=600)
 def duckduckgo_search(text, search_url, api_key, result_len, **kwargs):
     search = DuckDuckGoSearchAPIWrapper()
     return search.results(text, result_len)
 
+@cached_tool(ttl=600)
 def google_search(text, search_url, api_key, result_len, **kwargs):
     search = GoogleSearchAPIWrapper(google_api_key=api_key,
                                     google_cse_id=search_url)
     return search.results(text, result_len)
 
+@cached_tool(ttl=600)
 def metaphor_search(
         text: str,
         search_url: str,
@@ -161,9 +165,7 @@ async def search_engine_chat(
         context = "\n".join([doc.page_content for doc in docs])
 
         prompt_template = get_prompt_template("search_engine_chat", prompt_name)
-        input_msg = History(role="user", content=prompt_template).to_msg_template(False)
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [i.to_msg_template() for i in history] + [input_msg])
+        chat_prompt = ChatPromptBuilder(history).build(prompt_template)
 
         chain = LLMChain(prompt=chat_prompt, llm=model)
 
@@ -194,7 +196,7 @@ async def search_engine_chat(
                              ensure_ascii=False)
         await task
 
-    return StreamingResponse(search_engine_chat_iterator(query=query,
+    return StreamingResponse(ndjson_stream(search_engine_chat_iterator(query=query,
                                                            search_engine_name=search_engine_name,
                                                            top_k=top_k,
                                                            history=history,
@@ -202,5 +204,5 @@ async def search_engine_chat(
                                                            model_name=model_name,
                                                            temperature=temperature,
                                                            max_tokens=max_tokens,
-                                                           prompt_name=prompt_name),
-                               )
\ No newline at end of file
+                                                           prompt_name=prompt_name)),
+                             media_type=NDJSON_MEDIA_TYPE)
\ No newline at end of file
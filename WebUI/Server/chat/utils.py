@@ -1,7 +1,25 @@
 from pydantic import BaseModel, Field
-from langchain.prompts.chat import ChatMessagePromptTemplate
+from functools import lru_cache
+from langchain.prompts.chat import ChatMessagePromptTemplate, ChatPromptTemplate
+from langchain.schema import BaseMessage, ChatMessage
 from typing import List, Tuple, Dict, Union
 
+ROLE_MAPS = {
+    "ai": "assistant",
+    "human": "user",
+}
+
+@lru_cache(maxsize=256)
+def compile_msg_template(content: str, role: str = "user") -> ChatMessagePromptTemplate:
+    '''
+    jinja2 message template, compiled once per (content, role). meant for the static prompt templates.
+    '''
+    return ChatMessagePromptTemplate.from_template(
+        content,
+        "jinja2",
+        role=role,
+    )
+
 
 class History(BaseModel):
     role: str = Field(...)
@@ -11,15 +29,10 @@ class History(BaseModel):
         return "ai" if self.role=="assistant" else "human", self.content
 
     def to_msg_template(self, is_raw=True) -> ChatMessagePromptTemplate:
-        role_maps = {
-            "ai": "assistant",
-            "human": "user",
-        }
-        role = role_maps.get(self.role, self.role)
-        if is_raw:
-            content = "{% raw %}" + self.content + "{% endraw %}"
-        else:
-            content = self.content
+        role = ROLE_MAPS.get(self.role, self.role)
+        if not is_raw:
+            return compile_msg_template(self.content, role)
+        content = "{% raw %}" + self.content + "{% endraw %}"
 
         return ChatMessagePromptTemplate.from_template(
             content,
@@ -27,6 +40,12 @@ class History(BaseModel):
             role=role,
         )
 
+    def to_message(self) -> ChatMessage:
+        '''
+        the same message to_msg_template() renders, without going through jinja2.
+        '''
+        return ChatMessage(role=ROLE_MAPS.get(self.role, self.role), content=self.content)
+
     @classmethod
     def from_data(cls, h: Union[List, Tuple, Dict]) -> "History":
         if isinstance(h, (list,tuple)) and len(h) >= 2:
@@ -34,4 +53,22 @@ class History(BaseModel):
         elif isinstance(h, dict):
             h = cls(**h)
 
-        return h
\ No newline at end of file
+        return h
+
+
+class ChatPromptBuilder:
+    '''
+    Builds chat prompts from history. History turns are turned into messages once and never parsed
+    as templates, only the input template is jinja2 and it is compiled once per template text.
+    The tool-calling loop adds turns with add(), the messages already built are reused.
+    '''
+    def __init__(self, history: List[Union[History, List, Tuple, Dict]] = []):
+        self.messages: List[BaseMessage] = []
+        for h in history:
+            self.messages.append(History.from_data(h).to_message())
+
+    def add(self, role: str, content: str):
+        self.messages.append(History(role=role, content=content).to_message())
+
+    def build(self, prompt_template: str) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages(self.messages + [compile_msg_template(prompt_template)])
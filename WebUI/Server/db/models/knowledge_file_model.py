@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, JSON, func
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, JSON, func, inspect, text
 
 from WebUI.Server.db.base import Base, engine
 
@@ -17,6 +17,7 @@ class KnowledgeFileModel(Base):
     file_version = Column(Integer, default=1, comment='File Version')
     file_mtime = Column(Float, default=0.0, comment="Modify Time")
     file_size = Column(Integer, default=0, comment="File Size")
+    file_hash = Column(String(64), default="", comment="sha256 of the file content")
     custom_docs = Column(Boolean, default=False, comment="custom docs")
     docs_count = Column(Integer, default=0, comment="Documents count")
     create_time = Column(DateTime, default=func.now(), comment='Create Time')
@@ -39,3 +40,8 @@ class FileDocModel(Base):
         return f"<FileDoc(id='{self.id}', kb_name='{self.kb_name}', file_name='{self.file_name}', doc_id='{self.doc_id}', metadata='{self.meta_data}')>"
     
 Base.metadata.create_all(bind=engine)
+
+# databases created before file_hash existed get the column added in place.
+if "file_hash" not in [c["name"] for c in inspect(engine).get_columns(KnowledgeFileModel.__tablename__)]:
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE knowledge_file ADD COLUMN file_hash VARCHAR(64) DEFAULT ''"))
@@ -1,8 +1,12 @@
-from WebUI.Server.db.session import with_session
+from WebUI.Server.db.session import with_session, session_scope
 from WebUI.Server.db.models.chat_history_model import ChatHistoryModel
+from WebUI.configs.basicconfig import GetChatHistoryConfig
 import re
+import time
 import uuid
-from typing import Dict, List
+import atexit
+import threading
+from typing import Dict, List, Optional
 
 
 def _convert_query(query: str) -> str:
@@ -18,7 +22,7 @@ def add_chat_history_to_db(session, chat_type, query, response="", chat_history_
     if not chat_history_id:
         chat_history_id = uuid.uuid4().hex
     ch = ChatHistoryModel(id=chat_history_id, chat_type=chat_type, query=query, response=response,
-                        metadata=metadata)
+                        meta_data=metadata)
     session.add(ch)
     session.commit()
     return ch.id
@@ -29,7 +33,7 @@ def update_chat_history(session, chat_history_id, response: str = None, metadata
     """
     update chat history
     """
-    ch = get_chat_history_by_id(chat_history_id)
+    ch = session.query(ChatHistoryModel).filter_by(id=chat_history_id).first()
     if ch is not None:
         if response is not None:
             ch.response = response
@@ -44,6 +48,7 @@ def feedback_chat_history_to_db(session, chat_history_id, feedback_score, feedba
     """
     feedback chat history
     """
+    chat_history_writer.flush()
     ch = session.query(ChatHistoryModel).filter_by(id=chat_history_id).first()
     if ch:
         ch.feedback_score = feedback_score
@@ -73,3 +78,132 @@ def filter_chat_history(session, query=None, response=None, score=None, reason=N
         ch = ch.filter(ChatHistoryModel.feedback_reason.ilike(_convert_query(reason)))
 
     return ch
+
+
+class ChatHistoryWriter:
+    '''
+    Write-behind queue for chat history. Chat handlers only record the change in memory, a daemon
+    thread writes everything pending in one transaction every flush_interval_ms. An update of a
+    record whose insert is still pending is merged into that insert. When max_pending records are
+    waiting, callers block until the next flush.
+    '''
+    def __init__(self, flush_interval_ms: float = 200, max_pending: int = 1000):
+        self.flush_interval = max(0.0, flush_interval_ms / 1000)
+        self.max_pending = max(1, int(max_pending))
+        self._pending: Dict[str, Dict] = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, name="chat-history-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _wait_for_room(self):
+        while len(self._pending) >= self.max_pending:
+            self._cond.notify_all()
+            self._cond.wait()
+
+    def add(self, chat_type, query, response="", chat_history_id=None, metadata: Dict = {}) -> str:
+        if not chat_history_id:
+            chat_history_id = uuid.uuid4().hex
+        with self._cond:
+            self._start()
+            self._wait_for_room()
+            self._pending[chat_history_id] = {"insert": True,
+                                              "values": {"chat_type": chat_type, "query": query,
+                                                         "response": response, "meta_data": metadata}}
+            self._cond.notify_all()
+        return chat_history_id
+
+    def update(self, chat_history_id, response: str = None, metadata: Dict = None):
+        values = {}
+        if response is not None:
+            values["response"] = response
+        if isinstance(metadata, dict):
+            values["meta_data"] = metadata
+        if not chat_history_id or not values:
+            return
+        with self._cond:
+            self._start()
+            entry = self._pending.get(chat_history_id)
+            if entry is not None:
+                entry["values"].update(values)
+                return
+            self._wait_for_room()
+            self._pending[chat_history_id] = {"insert": False, "values": values}
+            self._cond.notify_all()
+
+    @staticmethod
+    def _write(session, chat_history_id, entry):
+        if entry["insert"]:
+            session.add(ChatHistoryModel(id=chat_history_id, **entry["values"]))
+        else:
+            session.query(ChatHistoryModel).filter_by(id=chat_history_id).update(
+                entry["values"], synchronize_session=False)
+
+    def flush(self) -> int:
+        '''
+        write all pending records now, returns how many were written.
+        '''
+        with self._flush_lock:
+            with self._cond:
+                batch = self._pending
+                self._pending = {}
+                self._cond.notify_all()
+            if not batch:
+                return 0
+            try:
+                with session_scope() as session:
+                    for chat_history_id, entry in batch.items():
+                        self._write(session, chat_history_id, entry)
+            except Exception as e:
+                # one bad record must not lose the rest of the batch
+                print(f"chat history: batch write failed, retry one by one. {e}")
+                for chat_history_id, entry in batch.items():
+                    try:
+                        with session_scope() as session:
+                            self._write(session, chat_history_id, entry)
+                    except Exception as e:
+                        print(f"chat history: failed to save '{chat_history_id}': {e}")
+            return len(batch)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # gather more records until the interval ends or the buffer is full
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.max_pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+
+
+_config = GetChatHistoryConfig()
+chat_history_writer = ChatHistoryWriter(flush_interval_ms=_config.get("flush_interval_ms", 200),
+                                        max_pending=_config.get("max_pending", 1000))
+
+
+def queue_chat_history(chat_type, query, response="", chat_history_id=None, metadata: Dict = {}) -> str:
+    """
+    add chat history without waiting for the database, returns the new id
+    """
+    return chat_history_writer.add(chat_type, query, response=response,
+                                   chat_history_id=chat_history_id, metadata=metadata)
+
+
+def queue_chat_history_update(chat_history_id, response: str = None, metadata: Dict = None):
+    """
+    update chat history without waiting for the database
+    """
+    chat_history_writer.update(chat_history_id, response=response, metadata=metadata)
+
+
+def flush_chat_history() -> int:
+    return chat_history_writer.flush()
@@ -2,7 +2,7 @@ from WebUI.Server.db.models.knowledge_base_model import KnowledgeBaseModel
 from WebUI.Server.db.models.knowledge_file_model import KnowledgeFileModel, FileDocModel
 from WebUI.Server.db.session import with_session
 from WebUI.Server.knowledge_base.utils import KnowledgeFile
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 
 @with_session
@@ -92,10 +92,12 @@ def add_file_to_db(session,
                                             .first())
         mtime = kb_file.get_mtime()
         size = kb_file.get_size()
+        file_hash = kb_file.get_hash()
 
         if existing_file:
             existing_file.file_mtime = mtime
             existing_file.file_size = size
+            existing_file.file_hash = file_hash
             existing_file.docs_count = docs_count
             existing_file.custom_docs = custom_docs
             existing_file.file_version += 1
@@ -108,6 +110,7 @@ def add_file_to_db(session,
                 text_splitter_name=kb_file.text_splitter_name or "SpacyTextSplitter",
                 file_mtime=mtime,
                 file_size=size,
+                file_hash=file_hash,
                 docs_count = docs_count,
                 custom_docs=custom_docs,
             )
@@ -117,6 +120,74 @@ def add_file_to_db(session,
     return True
 
 
+@with_session
+def add_files_to_db(session,
+                    files: List[Tuple],
+                    custom_docs: bool = False,
+                    ):
+    '''
+    add or update many files and their documents in one transaction.
+    files: [(kb_file, [{"id": str, "metadata": dict}, ...]) or (kb_file, doc_infos, append[, complete]), ...]
+    with append the documents are added to those the file already has, instead of replacing them.
+    a file that is not complete yet (more parts are to come) gets an empty fingerprint, so that
+    sync_knowledge_base ingests it again if the rest never arrives. its last part records the fingerprint.
+    '''
+    if not files:
+        return True
+    kb_name = files[0][0].kb_name
+    kb = session.query(KnowledgeBaseModel).filter_by(kb_name=kb_name).first()
+    if not kb:
+        return False
+    existing_files = {f.file_name: f for f in (session.query(KnowledgeFileModel)
+                                               .filter_by(kb_name=kb_name)
+                                               .filter(KnowledgeFileModel.file_name.in_([x[0].filename for x in files]))
+                                               .all())}
+    for item in files:
+        kb_file, doc_infos = item[0], item[1]
+        append = len(item) > 2 and item[2]
+        complete = len(item) <= 3 or item[3]
+        if complete:
+            mtime, size, file_hash = kb_file.get_mtime(), kb_file.get_size(), kb_file.get_hash()
+        else:
+            mtime, size, file_hash = 0.0, -1, ""
+        existing_file = existing_files.get(kb_file.filename)
+        if existing_file and append:
+            existing_file.docs_count += len(doc_infos)
+            if complete:
+                existing_file.file_mtime = mtime
+                existing_file.file_size = size
+                existing_file.file_hash = file_hash
+        elif existing_file:
+            existing_file.file_mtime = mtime
+            existing_file.file_size = size
+            existing_file.file_hash = file_hash
+            existing_file.docs_count = len(doc_infos)
+            existing_file.custom_docs = custom_docs
+            existing_file.file_version += 1
+            session.query(FileDocModel).filter_by(kb_name=kb_name, file_name=kb_file.filename).delete()
+        else:
+            new_file = KnowledgeFileModel(
+                file_name=kb_file.filename,
+                file_ext=kb_file.ext,
+                kb_name=kb_name,
+                document_loader_name=kb_file.document_loader_name,
+                text_splitter_name=kb_file.text_splitter_name or "SpacyTextSplitter",
+                file_mtime=mtime,
+                file_size=size,
+                file_hash=file_hash,
+                docs_count=len(doc_infos),
+                custom_docs=custom_docs,
+            )
+            kb.file_count += 1
+            session.add(new_file)
+            existing_files[kb_file.filename] = new_file
+        session.add_all([FileDocModel(kb_name=kb_name,
+                                      file_name=kb_file.filename,
+                                      doc_id=d["id"],
+                                      meta_data=d["metadata"]) for d in doc_infos])
+    return True
+
+
 @with_session
 def delete_file_from_db(session, kb_file: KnowledgeFile):
     existing_file = session.query(KnowledgeFileModel).filter_by(file_name=kb_file.filename,
@@ -152,6 +223,37 @@ def file_exists_in_db(session, kb_file: KnowledgeFile):
     return True if existing_file else False
 
 
+@with_session
+def list_file_fingerprints_from_db(session, kb_name: str) -> Dict[str, Dict]:
+    '''
+    return: {file_name: {"file_mtime": float, "file_size": int, "file_hash": str, "custom_docs": bool}, ...}
+    '''
+    files = (session.query(KnowledgeFileModel.file_name, KnowledgeFileModel.file_mtime, KnowledgeFileModel.file_size,
+                           KnowledgeFileModel.file_hash, KnowledgeFileModel.custom_docs)
+             .filter_by(kb_name=kb_name).all())
+    return {f.file_name: {"file_mtime": f.file_mtime,
+                          "file_size": f.file_size,
+                          "file_hash": f.file_hash or "",
+                          "custom_docs": f.custom_docs} for f in files}
+
+
+@with_session
+def update_file_fingerprints_in_db(session, kb_name: str, fingerprints: Dict[str, Tuple[float, int]]):
+    '''
+    record the new mtime and size of files whose content did not change.
+    fingerprints: {file_name: (mtime, size), ...}
+    '''
+    if not fingerprints:
+        return True
+    files = (session.query(KnowledgeFileModel)
+             .filter_by(kb_name=kb_name)
+             .filter(KnowledgeFileModel.file_name.in_(list(fingerprints.keys())))
+             .all())
+    for f in files:
+        f.file_mtime, f.file_size = fingerprints[f.file_name]
+    return True
+
+
 @with_session
 def get_file_detail(session, kb_name: str, filename: str) -> dict:
     file: KnowledgeFileModel = (session.query(KnowledgeFileModel)
@@ -168,6 +270,7 @@ def get_file_detail(session, kb_name: str, filename: str) -> dict:
             "create_time": file.create_time,
             "file_mtime": file.file_mtime,
             "file_size": file.file_size,
+            "file_hash": file.file_hash,
             "custom_docs": file.custom_docs,
             "docs_count": file.docs_count,
         }
@@ -1,23 +1,26 @@
-from typing import List
+from typing import Iterator, List
+from langchain.docstore.document import Document
 from langchain.document_loaders.unstructured import UnstructuredFileLoader
-from WebUI.Server.document_loaders.ocr import get_ocr
+from WebUI.Server.document_loaders.ocr import ocr_image, make_ocr_cache_key
 
 
 class RapidOCRLoader(UnstructuredFileLoader):
     def _get_elements(self) -> List:
         def img2text(filepath):
-            resp = ""
-            ocr = get_ocr()
-            result, _ = ocr(filepath)
-            if result:
-                ocr_result = [line[1] for line in result]
-                resp += "\n".join(ocr_result)
-            return resp
+            with open(filepath, "rb") as f:
+                cache_key = make_ocr_cache_key(f.read())
+            return ocr_image(filepath, cache_key=cache_key)
 
         text = img2text(self.file_path)
         from unstructured.partition.text import partition_text
         return partition_text(text=text, **self.unstructured_kwargs)
 
+    def lazy_load(self) -> Iterator[Document]:
+        # an image is a single page, built here rather than through load() so the two never call each other.
+        content = "\n\n".join(str(el) for el in self._get_elements())
+        if content.strip():
+            yield Document(page_content=content, metadata={"source": self.file_path})
+
 
 if __name__ == "__main__":
     loader = RapidOCRLoader(file_path="../tests/samples/ocr_test.jpg")
@@ -1,45 +1,71 @@
 import cv2
 from PIL import Image
 import numpy as np
-from typing import List
+from typing import Iterator, List, Tuple
 from WebUI.configs.kbconfig import PDF_OCR_THRESHOLD
+from WebUI.configs.basicconfig import GetOcrConfig
+from langchain.docstore.document import Document
 from langchain.document_loaders.unstructured import UnstructuredFileLoader
-from WebUI.Server.document_loaders.ocr import get_ocr
+from WebUI.Server.document_loaders.ocr import ocr_image, make_ocr_cache_key, get_ocr_executor
+from collections import deque
 import tqdm
 
+def rotate_img(img, angle):
+    '''
+    img   --image
+    angle --rotation angle
+    return--rotated img
+    '''
+
+    h, w = img.shape[:2]
+    rotate_center = (w/2, h/2)
+    M = cv2.getRotationMatrix2D(rotate_center, angle, 1.0)
+    new_w = int(h * np.abs(M[0, 1]) + w * np.abs(M[0, 0]))
+    new_h = int(h * np.abs(M[0, 0]) + w * np.abs(M[0, 1]))
+    M[0, 2] += (new_w - w) / 2
+    M[1, 2] += (new_h - h) / 2
+
+    rotated_img = cv2.warpAffine(img, M, (new_w, new_h))
+    return rotated_img
+
+def ocr_pdf_image(samples: bytes, width: int, height: int, rotation: int) -> str:
+    cache_key = make_ocr_cache_key(samples, f"{width}x{height}:{rotation}")
+    img_array = np.frombuffer(samples, dtype=np.uint8).reshape(height, width, -1)
+    if rotation != 0:
+        tmp_img = Image.fromarray(img_array)
+        ori_img = cv2.cvtColor(np.array(tmp_img), cv2.COLOR_RGB2BGR)
+        rot_img = rotate_img(img=ori_img, angle=360 - rotation)
+        img_array = cv2.cvtColor(rot_img, cv2.COLOR_RGB2BGR)
+    return ocr_image(img_array, cache_key=cache_key)
+
 class RapidOCRPDFLoader(UnstructuredFileLoader):
-    def _get_elements(self) -> List:
-        def rotate_img(img, angle):
-            '''
-            img   --image
-            angle --rotation angle
-            return--rotated img
-            '''
-            
-            h, w = img.shape[:2]
-            rotate_center = (w/2, h/2)
-            M = cv2.getRotationMatrix2D(rotate_center, angle, 1.0)
-            new_w = int(h * np.abs(M[0, 1]) + w * np.abs(M[0, 0]))
-            new_h = int(h * np.abs(M[0, 0]) + w * np.abs(M[0, 1]))
-            M[0, 2] += (new_w - w) / 2
-            M[1, 2] += (new_h - h) / 2
+    def _iter_page_texts(self) -> Iterator[Tuple[int, str]]:
+        '''
+        yield (page number, text of the page and the OCR of its images) in page order.
+        PyMuPDF is not thread safe: pages are read here and only the OCR of their images runs in the pool,
+        a few pages ahead of the page being yielded.
+        '''
+        import fitz
+        executor = get_ocr_executor()
+        max_pending = max(1, int(GetOcrConfig().get("workers", 2))) * 2
+        doc = fitz.open(self.file_path)
+        # (page number, text parts, [(index in parts, OCR future), ...])
+        pages = deque()
+        pending = 0
 
-            rotated_img = cv2.warpAffine(img, M, (new_w, new_h))
-            return rotated_img
-        
-        def pdf2text(filepath):
-            import fitz
-            import numpy as np
-            ocr = get_ocr()
-            doc = fitz.open(filepath)
-            resp = ""
+        def finish(page) -> Tuple[int, str]:
+            number, parts, futures = page
+            for index, future in futures:
+                parts[index] = future.result()
+            return number, "".join(parts)
 
+        try:
             b_unit = tqdm.tqdm(total=doc.page_count, desc="RapidOCRPDFLoader context page index: 0")
             for i, page in enumerate(doc):
                 b_unit.set_description("RapidOCRPDFLoader context page index: {}".format(i))
                 b_unit.refresh()
-                text = page.get_text("")
-                resp += text + "\n"
+                parts = [page.get_text(""), "\n"]
+                futures = []
 
                 img_list = page.get_image_info(xrefs=True)
                 for img in img_list:
@@ -49,27 +75,37 @@ class RapidOCRPDFLoader(UnstructuredFileLoader):
                             or (bbox[3] - bbox[1]) / (page.rect.height) < PDF_OCR_THRESHOLD[1]):
                             continue
                         pix = fitz.Pixmap(doc, xref)
-                        samples = pix.samples
-                        if int(page.rotation)!=0:
-                            img_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, -1)
-                            tmp_img = Image.fromarray(img_array);
-                            ori_img = cv2.cvtColor(np.array(tmp_img),cv2.COLOR_RGB2BGR)
-                            rot_img = rotate_img(img=ori_img, angle=360-page.rotation)
-                            img_array = cv2.cvtColor(rot_img, cv2.COLOR_RGB2BGR)
-                        else:
-                            img_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, -1)
-
-                        result, _ = ocr(img_array)
-                        if result:
-                            ocr_result = [line[1] for line in result]
-                            resp += "\n".join(ocr_result)
+                        parts.append("")
+                        futures.append((len(parts) - 1, executor.submit(ocr_pdf_image, pix.samples, pix.width,
+                                                                        pix.height, int(page.rotation))))
+                pages.append((i + 1, parts, futures))
+                pending += len(futures)
                 b_unit.update(1)
-            return resp
+                while pages and (pending > max_pending or all(future.done() for _, future in pages[0][2])):
+                    page_done = pages.popleft()
+                    pending -= len(page_done[2])
+                    yield finish(page_done)
+            while pages:
+                yield finish(pages.popleft())
+        finally:
+            doc.close()
 
-        text = pdf2text(self.file_path)
+    def _get_elements(self) -> List:
+        text = "".join(text for _, text in self._iter_page_texts())
         from unstructured.partition.text import partition_text
         return partition_text(text=text, **self.unstructured_kwargs)
 
+    def lazy_load(self) -> Iterator[Document]:
+        '''
+        yield one Document per page with its page number, without holding the text of the whole file.
+        '''
+        from unstructured.partition.text import partition_text
+        for number, text in self._iter_page_texts():
+            elements = partition_text(text=text, **self.unstructured_kwargs)
+            content = "\n\n".join(str(el) for el in elements)
+            if content.strip():
+                yield Document(page_content=content, metadata={"source": self.file_path, "page": number})
+
 
 if __name__ == "__main__":
     loader = RapidOCRPDFLoader(file_path="../tests/samples/ocr_test.pdf")
@@ -1,4 +1,13 @@
-from typing import TYPE_CHECKING
+import os
+import time
+import queue
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Optional
+from WebUI.configs.basicconfig import GetOcrConfig
 
 
 if TYPE_CHECKING:
@@ -7,6 +16,11 @@ if TYPE_CHECKING:
     except ImportError:
         from rapidocr_onnxruntime import RapidOCR
 
+DEFAULT_OCR_CACHE_PATH = "./WebUI/knowledge_base/ocr_cache.db"
+DEFAULT_OCR_CACHE_SIZE_MB = 256
+# after an eviction the cache is trimmed down to this fraction of max size.
+EVICT_LOW_WATERMARK = 0.9
+
 
 def get_ocr(use_cuda: bool = True) -> "RapidOCR":
     try:
@@ -16,3 +30,216 @@ def get_ocr(use_cuda: bool = True) -> "RapidOCR":
         from rapidocr_onnxruntime import RapidOCR
         ocr = RapidOCR()
     return ocr
+
+
+class OCREnginePool:
+    '''
+    RapidOCR engines load their detection and recognition models when they are built and are not
+    safe to share between threads. The pool builds up to size engines on demand and lends each one
+    to a single caller at a time.
+    '''
+    def __init__(self, size: int = 2):
+        self.size = max(1, int(size))
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    engine = get_ocr()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                engine = self._idle.get()
+        try:
+            yield engine
+        finally:
+            self._idle.put(engine)
+
+    def warm_up(self):
+        with self.acquire():
+            pass
+
+
+class OCRResultCache:
+    '''
+    Disk-backed OCR results keyed by the hash of the image content, so a document that is ingested
+    again does not run OCR on images it has seen before. Results are evicted in least-recently-used
+    order once their total text size exceeds max_size_mb.
+    '''
+    def __init__(self, path: str = DEFAULT_OCR_CACHE_PATH, max_size_mb: int = DEFAULT_OCR_CACHE_SIZE_MB):
+        self.path = path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS ocr_results (
+                                key TEXT PRIMARY KEY,
+                                text TEXT,
+                                create_time REAL,
+                                nbytes INTEGER,
+                                last_access REAL)""")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(ocr_results)").fetchall()]
+            if "last_access" not in columns:
+                # a cache written before eviction was added.
+                conn.execute("ALTER TABLE ocr_results ADD COLUMN nbytes INTEGER")
+                conn.execute("ALTER TABLE ocr_results ADD COLUMN last_access REAL")
+                conn.execute("UPDATE ocr_results SET nbytes=LENGTH(CAST(text AS BLOB)), last_access=create_time")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_results_last_access ON ocr_results(last_access)")
+            conn.commit()
+            self._total_bytes = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM ocr_results").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT text FROM ocr_results WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE ocr_results SET last_access=? WHERE key=?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, text: str):
+        nbytes = len((text or "").encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            replaced = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM ocr_results WHERE key=?", (key,)).fetchone()[0]
+            conn.execute("INSERT OR REPLACE INTO ocr_results(key, text, create_time, nbytes, last_access) VALUES (?, ?, ?, ?, ?)",
+                         (key, text, now, nbytes, now))
+            conn.commit()
+            self._total_bytes += nbytes - replaced
+            self._evict()
+
+    def _evict(self):
+        if self.max_bytes <= 0 or self._total_bytes <= self.max_bytes:
+            return
+        conn = self._conn
+        target = int(self.max_bytes * EVICT_LOW_WATERMARK)
+        while self._total_bytes > target:
+            rows = conn.execute("SELECT key, nbytes FROM ocr_results ORDER BY last_access LIMIT 1000").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            victims = []
+            for key, nbytes in rows:
+                victims.append((key,))
+                self._total_bytes -= nbytes or 0
+                if self._total_bytes <= target:
+                    break
+            conn.executemany("DELETE FROM ocr_results WHERE key=?", victims)
+            self.evictions += len(victims)
+        conn.commit()
+        print(f"ocr cache evicted to {self._total_bytes} bytes, total evictions: {self.evictions}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM ocr_results").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def make_ocr_cache_key(data: bytes, extra: str = "") -> str:
+    h = hashlib.sha256()
+    h.update(data)
+    h.update(b"\x00")
+    h.update(extra.encode("utf-8"))
+    return h.hexdigest()
+
+
+_ocr_pool = None
+_ocr_executor = None
+_ocr_cache = None
+_ocr_lock = threading.Lock()
+
+
+def get_ocr_pool() -> OCREnginePool:
+    global _ocr_pool
+    if _ocr_pool is None:
+        with _ocr_lock:
+            if _ocr_pool is None:
+                _ocr_pool = OCREnginePool(size=GetOcrConfig().get("engines", 2))
+    return _ocr_pool
+
+
+def get_ocr_executor() -> ThreadPoolExecutor:
+    '''
+    return the thread pool that runs OCR tasks, sized by ocr.workers in kbconfig.json.
+    '''
+    global _ocr_executor
+    if _ocr_executor is None:
+        with _ocr_lock:
+            if _ocr_executor is None:
+                _ocr_executor = ThreadPoolExecutor(max_workers=max(1, int(GetOcrConfig().get("workers", 2))),
+                                                   thread_name_prefix="ocr")
+    return _ocr_executor
+
+
+def get_ocr_cache() -> Optional[OCRResultCache]:
+    '''
+    return the process-wide OCR result cache, or None if it is disabled in kbconfig.json.
+    '''
+    global _ocr_cache
+    if _ocr_cache is None:
+        with _ocr_lock:
+            if _ocr_cache is None:
+                config = GetOcrConfig()
+                if config.get("cache_enable", True):
+                    _ocr_cache = OCRResultCache(path=config.get("cache_path", DEFAULT_OCR_CACHE_PATH),
+                                                max_size_mb=config.get("cache_max_size_mb", DEFAULT_OCR_CACHE_SIZE_MB))
+                else:
+                    _ocr_cache = False
+    return _ocr_cache or None
+
+
+def ocr_image(image, cache_key: str = "") -> str:
+    '''
+    OCR one image (a file path or an image array) with a pooled engine and return its lines joined by newlines.
+    '''
+    cache = get_ocr_cache() if cache_key else None
+    if cache is not None:
+        text = cache.get(cache_key)
+        if text is not None:
+            return text
+    with get_ocr_pool().acquire() as ocr:
+        result, _ = ocr(image)
+    text = "\n".join(line[1] for line in result) if result else ""
+    if cache is not None:
+        cache.set(cache_key, text)
+    return text
@@ -0,0 +1,43 @@
+import sqlite3
+import pytest
+
+pytest.importorskip("cv2")
+
+from WebUI.Server.document_loaders.ocr import OCRResultCache
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = OCRResultCache(path=str(tmp_path / "ocr_cache.db"), max_size_mb=1000 / 1024 / 1024)
+    for i in range(4):
+        cache.set(f"image{i}", "x" * 200)
+    # image0 is read, so image1 is the least recently used one.
+    assert cache.get("image0") == "x" * 200
+    cache.set("image4", "x" * 200)
+    cache.set("image5", "x" * 200)
+    assert cache.get("image1") is None
+    assert cache.get("image0") == "x" * 200
+    assert cache.get("image5") == "x" * 200
+    stats = cache.stats()
+    assert stats["evictions"] >= 1
+    assert stats["size_bytes"] <= stats["max_bytes"]
+    assert stats["size_bytes"] == 200 * stats["entries"]
+
+
+def test_replacing_a_result_does_not_count_it_twice(tmp_path):
+    cache = OCRResultCache(path=str(tmp_path / "ocr_cache.db"))
+    cache.set("image", "old text")
+    cache.set("image", "new")
+    assert cache.stats()["size_bytes"] == 3
+    assert cache.get("image") == "new"
+
+
+def test_cache_written_before_eviction_is_upgraded(tmp_path):
+    path = str(tmp_path / "ocr_cache.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE ocr_results (key TEXT PRIMARY KEY, text TEXT, create_time REAL)")
+    conn.execute("INSERT INTO ocr_results VALUES ('image', 'text', 1.0)")
+    conn.commit()
+    conn.close()
+    cache = OCRResultCache(path=path)
+    assert cache.get("image") == "text"
+    assert cache.stats()["size_bytes"] == 4
@@ -1,7 +1,53 @@
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from langchain.docstore.document import Document
 from WebUI.Server.utils import BaseResponse, list_embed_models, load_embeddings
+from WebUI.Server.knowledge_base.kb_cache.embedding_cache import get_embedding_cache
+from WebUI.configs.basicconfig import GetEmbeddingBatcherConfig
 from fastapi import Body
-from typing import Dict, List
+from typing import Dict, List, Tuple, Callable, Awaitable, Optional
+
+def _embed_with_cache(
+    texts: List[str],
+    embed_model: str,
+    to_query: bool,
+    embed_func: Callable[[List[str]], List[List[float]]],
+) -> List[List[float]]:
+    '''
+    only the texts missing from the embedding cache are passed to embed_func.
+    '''
+    cache = get_embedding_cache()
+    if cache is None or not texts:
+        return embed_func(texts)
+    embeddings, missing = cache.get_many(embed_model, to_query, texts)
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        new_embeddings = embed_func(missing_texts)
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+        cache.set_many(embed_model, to_query, missing_texts, new_embeddings)
+    return embeddings
+
+async def _aembed_with_cache(
+    texts: List[str],
+    embed_model: str,
+    to_query: bool,
+    embed_func: Callable[[List[str]], Awaitable[List[List[float]]]],
+) -> List[List[float]]:
+    cache = get_embedding_cache()
+    if cache is None or not texts:
+        return await embed_func(texts)
+    embeddings, missing = cache.get_many(embed_model, to_query, texts)
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        new_embeddings = await embed_func(missing_texts)
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+        cache.set_many(embed_model, to_query, missing_texts, new_embeddings)
+    return embeddings
 
 def embed_texts(
     texts: List[str],
@@ -10,14 +56,14 @@ def embed_texts(
 ) -> BaseResponse:
     '''
     return: BaseResponse(data=List[List[float]])
-    TODO: Perhaps it's necessary to implement a caching mechanism to reduce token consumption.
+    embeddings are served from the persistent embedding cache when possible.
     '''
     try:
         if embed_model in list_embed_models(): # Local Embeddings Models
             embeddings = load_embeddings(model=embed_model)
             if embeddings:
                 print("load Embedding Model: ", embed_model)
-                return BaseResponse(data=embeddings.embed_documents(texts))
+                return BaseResponse(data=_embed_with_cache(texts, embed_model, to_query, embeddings.embed_documents))
 
         # if embed_model in list_online_embed_models(): # Online Embeddings Models
         #     config = get_model_worker_config(embed_model)
@@ -33,6 +79,129 @@ def embed_texts(
         print(e)
         return BaseResponse(code=500, msg=f"Embeddings error: {e}")
 
+class QueryEmbeddingBatcher:
+    '''
+    Coalesce concurrent single-query embeddings into one batched embed_texts call.
+    Each embed model gets a daemon worker thread that waits up to max_wait_ms for
+    more queries (or until max_batch_size is reached) and fans the results back out.
+    '''
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 5, timeout_s: float = 60):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000)
+        self.timeout = timeout_s if timeout_s and timeout_s > 0 else None
+        self._queues: Dict[str, queue.Queue] = {}
+        self._lock = threading.Lock()
+
+    def _get_queue(self, embed_model: str) -> queue.Queue:
+        with self._lock:
+            q = self._queues.get(embed_model)
+            if q is None:
+                q = queue.Queue()
+                self._queues[embed_model] = q
+                threading.Thread(target=self._worker,
+                                 args=(embed_model, q),
+                                 name=f"embedding-batcher-{embed_model}",
+                                 daemon=True).start()
+            return q
+
+    def submit(self, text: str, embed_model: str) -> Future:
+        future = Future()
+        self._get_queue(embed_model).put((text, future))
+        return future
+
+    def _collect(self, q: queue.Queue) -> List[Tuple[str, Future]]:
+        batch = [q.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self, embed_model: str, q: queue.Queue):
+        # the worker must outlive any single failing batch, or every later query of this model would hang.
+        while True:
+            batch = []
+            try:
+                batch = [(text, future) for text, future in self._collect(q)
+                         if future.set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                texts = list(dict.fromkeys(text for text, _ in batch))
+                try:
+                    resp = embed_texts(texts=texts, embed_model=embed_model, to_query=True)
+                except Exception as e:
+                    resp = BaseResponse(code=500, msg=f"Embeddings error: {e}")
+                if resp.code == 200 and resp.data is not None:
+                    index = {text: i for i, text in enumerate(texts)}
+                    for text, future in batch:
+                        future.set_result(BaseResponse(data=[resp.data[index[text]]]))
+                else:
+                    for _, future in batch:
+                        future.set_result(resp)
+                if len(batch) > 1:
+                    print(f"embedding batcher: {len(batch)} queries embedded in one call with {embed_model}")
+            except Exception as e:
+                print(f"embedding batcher: batch of {embed_model} failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(BaseResponse(code=500, msg=f"Embeddings error: {e}"))
+
+_query_batcher = None
+_query_batcher_lock = threading.Lock()
+
+def get_query_batcher() -> Optional[QueryEmbeddingBatcher]:
+    '''
+    return the process-wide query batcher, or None if it is disabled in kbconfig.json.
+    '''
+    global _query_batcher
+    if _query_batcher is None:
+        with _query_batcher_lock:
+            if _query_batcher is None:
+                config = GetEmbeddingBatcherConfig()
+                if config.get("enable", True):
+                    _query_batcher = QueryEmbeddingBatcher(max_batch_size=config.get("max_batch_size", 32),
+                                                           max_wait_ms=config.get("max_wait_ms", 5),
+                                                           timeout_s=config.get("timeout_s", 60))
+                else:
+                    _query_batcher = False
+    return _query_batcher or None
+
+def embed_query_batched(
+    text: str,
+    embed_model: str = "",
+) -> BaseResponse:
+    '''
+    return: BaseResponse(data=List[List[float]]) holding the single query embedding.
+    '''
+    batcher = get_query_batcher()
+    if batcher is None:
+        return embed_texts(texts=[text], embed_model=embed_model, to_query=True)
+    future = batcher.submit(text, embed_model)
+    try:
+        return future.result(timeout=batcher.timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        return BaseResponse(code=500, msg=f"Embeddings error: query embedding timed out after {batcher.timeout}s")
+
+async def aembed_query_batched(
+    text: str,
+    embed_model: str = "",
+) -> BaseResponse:
+    batcher = get_query_batcher()
+    if batcher is None:
+        return await aembed_texts(texts=[text], embed_model=embed_model, to_query=True)
+    future = batcher.submit(text, embed_model)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=batcher.timeout)
+    except asyncio.TimeoutError:
+        future.cancel()
+        return BaseResponse(code=500, msg=f"Embeddings error: query embedding timed out after {batcher.timeout}s")
+
 def embed_texts_endpoint(
     texts: List[str] = Body(..., description="Text List", examples=[["hello", "world"]]),
     embed_model: str = Body("", description=""),
@@ -43,6 +212,29 @@ def embed_texts_endpoint(
     '''
     return embed_texts(texts=texts, embed_model=embed_model, to_query=to_query)
 
+def embedding_cache_stats() -> BaseResponse:
+    '''
+    return BaseResponse(data=Dict) with entries, size, hit/miss counters and evictions of the embedding cache.
+    '''
+    cache = get_embedding_cache()
+    if cache is None:
+        return BaseResponse(code=404, msg="The embedding cache is disabled.")
+    return BaseResponse(data=cache.stats())
+
+def embeddings_pool_stats() -> BaseResponse:
+    '''
+    return BaseResponse(data=Dict) with loaded embedding models, their memory, load time, hits and evictions.
+    '''
+    from WebUI.Server.knowledge_base.kb_cache.base import embeddings_pool
+    return BaseResponse(data=embeddings_pool.stats())
+
+def reranker_stats() -> BaseResponse:
+    '''
+    return BaseResponse(data=Dict) with loaded reranker models and the hit rate of the rerank score cache.
+    '''
+    from WebUI.Server.reranker.reranker import reranker_pool, rerank_score_cache
+    return BaseResponse(data={"pool": reranker_pool.stats(), "score_cache": rerank_score_cache.stats()})
+
 async def aembed_texts(
     texts: List[str],
     embed_model: str = "",
@@ -52,7 +244,7 @@ async def aembed_texts(
         from WebUI.Server.utils import load_embeddings
 
         embeddings = load_embeddings(model=embed_model)
-        return BaseResponse(data=await embeddings.aembed_documents(texts))
+        return BaseResponse(data=await _aembed_with_cache(texts, embed_model, to_query, embeddings.aembed_documents))
     except Exception as e:
         print(e)
         return BaseResponse(code=500, msg=f"errors during text vectorization: {e}")
@@ -3,6 +3,7 @@ from dateutil.tz import gettz
 from langchain_core.tools import tool
 from googleapiclient.discovery import build
 import google.generativeai as genai
+from WebUI.Server.funcall.tool_cache import uncached_tool
 
 DEFAULT_MAX_EVENTS = 10
 
@@ -103,6 +104,7 @@ def get_event_from_gcalendar(start_time:str, end_time:str) ->str:
         print(f"get_event_from_gcalendar Error: {e}")
     return calendar_message
 
+@uncached_tool
 def create_event_to_gcalendar(summary: str, description: str, start_time: str, end_time: str) ->str:
     """create event to google calendar."""
     
@@ -47,6 +47,14 @@ def init_credential() -> bool:
     glob_credentials = creds
     return True
 
+def get_credential_account() -> str:
+    '''
+    identifies the account glob_credentials belong to, "" until they are loaded.
+    '''
+    if not glob_credentials:
+        return ""
+    return f"{glob_credentials.client_id}:{glob_credentials.refresh_token or glob_credentials.token}"
+
 def GetFuncallInToolBoxesList() ->list:
     funcall_list = []
     
@@ -3,6 +3,7 @@ from langchain_core.tools import tool
 from googleapiclient.discovery import build
 from typing import Any
 import google.generativeai as genai
+from WebUI.Server.funcall.tool_cache import cached_tool, uncached_tool
 
 DRIVE_READONLY_SCOPES = ["https://www.googleapis.com/auth/drive.metadata.readonly"]
 DRIVE_FULL_SCOPES = ["https://www.googleapis.com/auth/drive"]
@@ -87,6 +88,12 @@ def upload_to_cloud(service, file_path):
     file = service.files().create(body=body, media_body=media, fields="id").execute()
     return file
 
+def credential_account() -> str:
+    # cached results belong to the google account that is signed in.
+    from WebUI.Server.funcall.google_toolboxes.credential import get_credential_account
+    return get_credential_account()
+
+@cached_tool(ttl=60, key_extra=credential_account)
 def search_in_gdrive(search_criteria: str) ->str:
     """search file in google drive. The parameter 'search_criteria' conforms to google drive's advanced search syntax format."""
     from WebUI.Server.funcall.google_toolboxes.credential import glob_credentials
@@ -131,6 +138,7 @@ def search_in_gdrive(search_criteria: str) ->str:
         print(f"search_in_gdrive Error: {e}")
     return gdrive_messages
 
+@uncached_tool
 def download_from_gdrive(search_criteria: str, download_path: str) ->str:
     """download file from google drive."""
     from WebUI.Server.funcall.google_toolboxes.credential import glob_credentials
@@ -165,6 +173,7 @@ def download_from_gdrive(search_criteria: str, download_path: str) ->str:
         print(f"download_from_gdrive Error: {e}")
     return gdrive_messages
 
+@uncached_tool
 def upload_to_gdrive(upload_file: str) ->str:
     """upload file to google drive."""
     from WebUI.Server.funcall.google_toolboxes.credential import glob_credentials
@@ -4,6 +4,7 @@ import mimetypes
 from langchain_core.tools import tool
 from googleapiclient.discovery import build
 import google.generativeai as genai
+from WebUI.Server.funcall.tool_cache import uncached_tool
 
 GMAIL_READONLY_SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 GMAIL_MODIFY_SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
@@ -107,6 +108,7 @@ def build_file_part(file):
     msg.add_header("Content-Disposition", "attachment", filename=filename)
     return msg
 
+@uncached_tool
 def create_draft_in_gmails(subject: str, body: str, to_address: str, from_address: str, attachment_file: str) ->str:
     """create draft in gmail."""
     from email.message import EmailMessage
@@ -159,6 +161,7 @@ def create_draft_in_gmails(subject: str, body: str, to_address: str, from_addres
         print(f"create_draft_in_gmails Error: {e}")
     return email_messages
 
+@uncached_tool
 def gmail_send_mail(subject: str, body: str, to_address: str, from_address: str, attachment_file: str)->bool:
     """send email in gmail."""
     from email.message import EmailMessage
@@ -5,7 +5,9 @@ import googlemaps
 from langchain_core.tools import tool
 import google.generativeai as genai
 from WebUI.configs.basicconfig import GetSearchKeyInGToolBox
+from WebUI.Server.funcall.tool_cache import cached_tool
 
+@cached_tool(ttl=86400)
 def gmap_addressvalidation(address: str)->bool:
     if not address:
         return False
@@ -25,6 +27,7 @@ def get_gmap_geolocate()->dict:
     location = gmaps.geolocate()
     return location
 
+@cached_tool(ttl=86400)
 def get_gmap_geocode(address: str)->list:
     if not address:
         return []
@@ -37,6 +40,7 @@ def get_gmap_geocode(address: str)->list:
         return []
     return geocode_result
 
+@cached_tool(ttl=86400)
 def get_gmap_reverse_geocode(latitude: float, longitude: float)->list:
     if not latitude or not longitude:
         return []
@@ -49,6 +53,7 @@ def get_gmap_reverse_geocode(latitude: float, longitude: float)->list:
         return []
     return geocode_result
 
+@cached_tool(ttl=300)
 def get_gmap_directions(origin: str, destination: str, mode: str="", departure_time: str="", arrival_time: str="", optimize_waypoints=True)->list:
     if not origin and not destination:
         return []
@@ -149,6 +154,7 @@ def get_gmap_static_map(origin: str, destinations: list[str], size: tuple=(600,
         return image
     return None
 
+@cached_tool(ttl=600)
 def get_gmap_places(query: str, location: dict={}, radius: int=1000, min_price: int=0, max_price: int=4, open_now: bool=True)->dict:
     if not query:
         return {}
@@ -169,6 +175,7 @@ def get_gmap_places(query: str, location: dict={}, radius: int=1000, min_price:
 def get_gmap_nearest_roads():
     pass
 
+@cached_tool(ttl=86400)
 def get_gmap_timezone(location: str)->dict:
     if not location:
         return {}
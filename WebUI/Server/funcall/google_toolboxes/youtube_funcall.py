@@ -2,6 +2,7 @@ from googleapiclient.discovery import build
 from langchain_core.tools import tool
 from bs4 import BeautifulSoup
 import google.generativeai as genai
+from WebUI.Server.funcall.tool_cache import cached_tool
 
 YOUTUBE_READONLY_SCOPES = ["https://www.googleapis.com/auth/youtube.readonly"]
 YOUTUBE_FULL_SCOPES = ["https://www.googleapis.com/auth/youtube"]
@@ -95,6 +96,12 @@ def search_from_all_channel(service, title, max_results=4)->list:
         max_results -= 1
     return video_results
 
+def credential_account() -> str:
+    # cached results belong to the google account that is signed in.
+    from WebUI.Server.funcall.google_toolboxes.credential import get_credential_account
+    return get_credential_account()
+
+@cached_tool(ttl=3600, should_cache=lambda result: bool(result[1]), key_extra=credential_account)
 def get_youtube_video_url_i(title: str, mine: bool = False, max_results=4):
     """ Get URL about Youtube video from your own Youtube channel. """
 
@@ -0,0 +1,85 @@
+import pytest
+
+pytest.importorskip("fastchat")
+
+from WebUI.Server.funcall import tool_cache
+from WebUI.Server.funcall.tool_cache import ToolResultCache, cached_tool, canonical_arguments, uncached_tool
+
+
+@pytest.fixture(autouse=True)
+def result_cache(monkeypatch):
+    cache = ToolResultCache(max_entries=16)
+    monkeypatch.setattr(tool_cache, "_tool_result_cache", cache)
+    return cache
+
+
+def lookup(place: str, language: str = "en", limit: int = 3):
+    pass
+
+
+def test_equivalent_calls_give_the_same_arguments():
+    expected = canonical_arguments(lookup, ("Paris",), {})
+    assert canonical_arguments(lookup, (), {"place": "Paris"}) == expected
+    assert canonical_arguments(lookup, ("Paris", "en"), {"limit": 3}) == expected
+    assert canonical_arguments(lookup, (), {"limit": 3, "place": "Paris", "language": "en"}) == expected
+    assert canonical_arguments(lookup, ("Paris", "fr"), {}) != expected
+
+
+def test_arguments_that_do_not_bind_still_give_a_key():
+    assert canonical_arguments(lookup, (), {"city": "Paris"}) == canonical_arguments(lookup, (), {"city": "Paris"})
+
+
+def test_results_are_cached_and_copied():
+    calls = []
+
+    @cached_tool(ttl=60)
+    def weather(place: str, days: int = 1):
+        calls.append(place)
+        return {"place": place, "days": days}
+
+    first = weather("Paris")
+    first["days"] = 7
+    assert weather(place="Paris", days=1) == {"place": "Paris", "days": 1}
+    assert calls == ["Paris"]
+
+
+def test_errors_are_not_cached():
+    calls = []
+
+    @cached_tool(ttl=60)
+    def weather(place: str):
+        calls.append(place)
+        return "weather service failed, error: timeout"
+
+    weather("Paris")
+    weather("Paris")
+    assert calls == ["Paris", "Paris"]
+
+
+def test_uncached_tool_can_not_be_cached():
+    @uncached_tool
+    def send_mail(to: str):
+        pass
+
+    with pytest.raises(ValueError):
+        cached_tool(ttl=60)(send_mail)
+
+
+def test_key_extra_separates_accounts():
+    account = {"id": ""}
+    calls = []
+
+    @cached_tool(ttl=60, key_extra=lambda: account["id"])
+    def list_files(query: str):
+        calls.append(account["id"])
+        return [f"{account['id']}:{query}"]
+
+    # not signed in yet, nothing is cached.
+    assert list_files("report") == [":report"]
+    account["id"] = "alice"
+    assert list_files("report") == ["alice:report"]
+    account["id"] = "bob"
+    assert list_files("report") == ["bob:report"]
+    account["id"] = "alice"
+    assert list_files("report") == ["alice:report"]
+    assert calls == ["", "alice", "bob"]
@@ -0,0 +1,231 @@
+import os
+import copy
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import threading
+from functools import wraps
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from WebUI.configs.basicconfig import GetToolResultCacheConfig
+
+DEFAULT_TOOL_CACHE_ENTRIES = 2048
+# tools marked with uncached_tool, they have side effects and must run every time.
+_uncached_tools = set()
+# ttl in seconds of every tool wrapped with cached_tool.
+_tool_ttls: Dict[str, float] = {}
+
+
+def canonical_arguments(func: Callable, args: tuple, kwargs: dict) -> str:
+    '''
+    bind the call to func's signature with defaults applied, so f(a), f(a, b=default) and f(b=default, a=a)
+    give the same string.
+    '''
+    try:
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+    except TypeError:
+        arguments = {"args": list(args), "kwargs": kwargs}
+    return json.dumps(arguments, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def make_tool_cache_key(tool_name: str, arguments: str, extra: str = "") -> str:
+    # arguments and extra may hold api keys or account tokens, only their hash is kept.
+    h = hashlib.sha256()
+    h.update(tool_name.encode("utf-8"))
+    h.update(b"\x00")
+    h.update(arguments.encode("utf-8"))
+    if extra:
+        h.update(b"\x00")
+        h.update(extra.encode("utf-8"))
+    return h.hexdigest()
+
+
+def is_error_result(result: Any) -> bool:
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    return isinstance(result, str) and ("This error is unrecoverable" in result or "failed, error:" in result)
+
+
+class ToolResultCache:
+    '''
+    Two-tier TTL cache for results of read-only tools. The memory tier is an LRU of max_entries,
+    the optional disk tier is a SQLite file shared by all processes and kept across restarts.
+    '''
+    def __init__(self, max_entries: int = DEFAULT_TOOL_CACHE_ENTRIES, disk_path: str = ""):
+        self.max_entries = max(1, int(max_entries))
+        self.disk_path = disk_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn = None
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not self.disk_path:
+            return None
+        if self._conn is None:
+            dirname = os.path.dirname(os.path.abspath(self.disk_path))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            conn = sqlite3.connect(self.disk_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS tool_results (
+                                key TEXT PRIMARY KEY,
+                                name TEXT,
+                                expires REAL,
+                                value BLOB)""")
+            conn.execute("DELETE FROM tool_results WHERE expires<?", (time.time(),))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _set_memory(self, key: str, tool_name: str, value: Any, expires: float):
+        self._entries[key] = (expires, tool_name, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[2]
+                del self._entries[key]
+            conn = self._connect()
+            if conn is not None:
+                row = conn.execute("SELECT name, expires, value FROM tool_results WHERE key=?", (key,)).fetchone()
+                if row is not None:
+                    tool_name, expires, blob = row
+                    if expires > now:
+                        value = pickle.loads(blob)
+                        self._set_memory(key, tool_name, value, expires)
+                        self.disk_hits += 1
+                        return True, value
+                    conn.execute("DELETE FROM tool_results WHERE key=?", (key,))
+                    conn.commit()
+            self.misses += 1
+            return False, None
+
+    def set(self, key: str, tool_name: str, value: Any, ttl: float):
+        expires = time.time() + ttl
+        with self._lock:
+            self._set_memory(key, tool_name, value, expires)
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                blob = pickle.dumps(value)
+            except Exception as e:
+                print(f"tool result cache: '{tool_name}' result is kept in memory only: {e}")
+                return
+            conn.execute("INSERT OR REPLACE INTO tool_results(key, name, expires, value) VALUES (?, ?, ?, ?)",
+                         (key, tool_name, expires, blob))
+            conn.commit()
+
+    def clear(self, tool_name: str = None):
+        with self._lock:
+            if tool_name is None:
+                self._entries.clear()
+            else:
+                for key in [k for k, v in self._entries.items() if v[1] == tool_name]:
+                    del self._entries[key]
+            conn = self._connect()
+            if conn is not None:
+                if tool_name is None:
+                    conn.execute("DELETE FROM tool_results")
+                else:
+                    conn.execute("DELETE FROM tool_results WHERE name=?", (tool_name,))
+                conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_path": self.disk_path,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+                "ttls": dict(_tool_ttls),
+                "uncached": sorted(_uncached_tools),
+            }
+
+
+_tool_result_cache = None
+_tool_result_cache_lock = threading.Lock()
+
+def get_tool_result_cache() -> Optional[ToolResultCache]:
+    '''
+    return the process-wide tool result cache, or None if it is disabled in webuiconfig.json.
+    '''
+    global _tool_result_cache
+    if _tool_result_cache is None:
+        with _tool_result_cache_lock:
+            if _tool_result_cache is None:
+                config = GetToolResultCacheConfig()
+                if config.get("enable", True):
+                    _tool_result_cache = ToolResultCache(max_entries=config.get("max_entries", DEFAULT_TOOL_CACHE_ENTRIES),
+                                                         disk_path=config.get("disk_path", ""))
+                else:
+                    _tool_result_cache = False
+    return _tool_result_cache or None
+
+
+def cached_tool(ttl: float, name: str = None, should_cache: Callable[[Any], bool] = None,
+                key_extra: Callable[[], str] = None):
+    '''
+    cache the results of a read-only tool for ttl seconds, keyed by (tool name, canonical arguments).
+    empty results and error messages are not cached unless should_cache says otherwise.
+    key_extra returns what the result depends on besides the arguments, e.g. the account of the
+    credentials the tool uses. calls are not cached while it returns nothing.
+    callers get their own copy of a cached result.
+    '''
+    def decorator(func):
+        tool_name = name or func.__name__
+        if getattr(func, "__tool_cache__", True) is False or tool_name in _uncached_tools:
+            raise ValueError(f"tool '{tool_name}' is marked as uncached")
+        _tool_ttls[tool_name] = ttl
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_tool_result_cache()
+            if cache is None or ttl <= 0:
+                return func(*args, **kwargs)
+            extra = ""
+            if key_extra is not None:
+                extra = key_extra()
+                if not extra:
+                    return func(*args, **kwargs)
+            key = make_tool_cache_key(tool_name, canonical_arguments(func, args, kwargs), extra)
+            found, value = cache.get(key)
+            if found:
+                return copy.deepcopy(value)
+            value = func(*args, **kwargs)
+            cacheable = should_cache(value) if should_cache is not None else (bool(value) and not is_error_result(value))
+            if cacheable:
+                cache.set(key, tool_name, copy.deepcopy(value), ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+def uncached_tool(func):
+    '''
+    mark a tool with side effects, cached_tool refuses to wrap it.
+    '''
+    func.__tool_cache__ = False
+    _uncached_tools.add(func.__name__)
+    return func
@@ -0,0 +1,117 @@
+import json
+import time
+import asyncio
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from WebUI.Server.utils import BaseResponse
+from WebUI.configs.basicconfig import GetToolExecutorConfig
+from WebUI.Server.funcall.tool_cache import get_tool_result_cache
+
+def _tool_name(json_data: str) -> str:
+    try:
+        func = json.loads(json_data)
+        return func.get("name", "") if isinstance(func, dict) else ""
+    except json.JSONDecodeError:
+        return ""
+
+class ToolExecutor:
+    '''
+    Runs tool calls off the event loop. Sync runners go to a bounded thread pool, coroutine functions
+    are awaited directly, and the calls of one model turn run concurrently, each with its own timeout.
+    A sync tool that times out keeps its pool thread until it returns, the chat just stops waiting for it.
+    '''
+    def __init__(self, max_workers: int = 8, timeout: float = 60, tool_timeouts: Dict[str, float] = {}):
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.tool_timeouts = dict(tool_timeouts)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool-executor")
+            return self._pool
+
+    def _record(self, name: str, elapsed_ms: float, status: str):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "errors": 0, "timeouts": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["calls"] += 1
+            if status == "error":
+                stats["errors"] += 1
+            elif status == "timeout":
+                stats["timeouts"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    async def run(self, runner: Callable, json_data: str, default: Any = None) -> Any:
+        '''
+        run one tool call with runner(json_data), returns default if it fails or times out.
+        '''
+        name = _tool_name(json_data) or getattr(runner, "__name__", "tool")
+        timeout = self.tool_timeouts.get(name, self.timeout)
+        if not timeout or timeout <= 0:
+            timeout = None
+        start = time.monotonic()
+        status = "ok"
+        try:
+            if inspect.iscoroutinefunction(runner):
+                call = runner(json_data)
+            else:
+                call = asyncio.get_running_loop().run_in_executor(self._get_pool(), runner, json_data)
+            return await asyncio.wait_for(call, timeout=timeout)
+        except asyncio.TimeoutError:
+            status = "timeout"
+            return default
+        except Exception as e:
+            status = "error"
+            print(f"tool '{name}' failed: {e}")
+            return default
+        finally:
+            elapsed_ms = (time.monotonic() - start) * 1000
+            self._record(name, elapsed_ms, status)
+            print(f"tool '{name}': {status} in {elapsed_ms:.0f}ms")
+
+    async def run_all(self, runner: Callable, json_lists: List[str], default: Any = None, concurrent: bool = True) -> List[Any]:
+        '''
+        run every tool call of one model turn, results keep the order of json_lists.
+        concurrent=False runs them one after another, for tools that share state.
+        '''
+        if concurrent:
+            return list(await asyncio.gather(*(self.run(runner, item, default) for item in json_lists)))
+        return [await self.run(runner, item, default) for item in json_lists]
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: dict(stats, avg_ms=stats["total_ms"] / stats["calls"])
+                    for name, stats in self._stats.items()}
+
+
+_tool_executor: Optional[ToolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+def get_tool_executor() -> ToolExecutor:
+    '''
+    return the process-wide tool executor, configured by ToolExecutor in webuiconfig.json.
+    '''
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                config = GetToolExecutorConfig()
+                _tool_executor = ToolExecutor(max_workers=config.get("max_workers", 8),
+                                              timeout=config.get("timeout", 60),
+                                              tool_timeouts=config.get("tool_timeouts", {}))
+    return _tool_executor
+
+def tool_stats() -> BaseResponse:
+    return BaseResponse(data=get_tool_executor().stats())
+
+def tool_cache_stats() -> BaseResponse:
+    cache = get_tool_result_cache()
+    if cache is None:
+        return BaseResponse(code=404, msg="tool result cache is disabled")
+    return BaseResponse(data=cache.stats())
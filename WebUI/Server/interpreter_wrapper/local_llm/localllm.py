@@ -1,9 +1,8 @@
 import re
 from langchain.chains import LLMChain
 from langchain.chat_models import ChatOpenAI
-from WebUI.Server.chat.utils import History
+from WebUI.Server.chat.utils import ChatPromptBuilder
 from WebUI.Server.utils import get_prompt_template
-from langchain.prompts.chat import ChatPromptTemplate
 from typing import List
 
 class BaseLLM:
@@ -48,11 +47,8 @@ class LocalLLM(BaseLLM):
             if "type" in his:
                 del his["type"]
 
-        new_history = [History.from_data(h) for h in history]
         prompt_template = get_prompt_template("llm_chat", "default")
-        input_msg = History(role="user", content=prompt_template).to_msg_template(False)
-        chat_prompt = ChatPromptTemplate.from_messages(
-                [i.to_msg_template() for i in new_history] + [input_msg])
+        chat_prompt = ChatPromptBuilder(history).build(prompt_template)
         chain = LLMChain(prompt=chat_prompt, llm=self.model)
 
         answer = chain.run({"input": query})
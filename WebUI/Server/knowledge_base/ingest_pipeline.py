@@ -0,0 +1,259 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Generator, List, Set, Tuple, Union
+from langchain.docstore.document import Document
+from WebUI.configs.basicconfig import GetIngestPipelineConfig, GetDocumentLoaderConfig
+from WebUI.Server.knowledge_base.utils import (KnowledgeFile, files2docs_in_thread,
+                                               CHUNK_SIZE, OVERLAP_SIZE, ZH_TITLE_ENHANCE)
+
+_END = object()
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    # a bounded put that gives up once the consumer is gone.
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _END
+
+
+class IngestPipeline:
+    '''
+    Staged ingestion into one knowledge base. A load thread parses and splits files in parallel,
+    an embed thread embeds the chunks of many files in one call of about embed_batch_size texts,
+    and the caller inserts every embedded batch with one add_embeddings and one DB transaction.
+    The stages are connected by bounded queues of queue_size items, so parsing, embedding and
+    insertion overlap instead of taking turns. With stream_pages, files that have a page-by-page
+    loader are sent down the pipeline one page at a time, later pages are appended to the file.
+    Streaming reads the pages in this process, so it is turned off when document_loader.executor is
+    "process": those files then go through the loader process pool and its file_timeout like the others.
+    '''
+    def __init__(self, kb, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = OVERLAP_SIZE,
+                 zh_title_enhance: bool = ZH_TITLE_ENHANCE, embed_batch_size: int = None, queue_size: int = None):
+        config = GetIngestPipelineConfig()
+        self.kb = kb
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.zh_title_enhance = zh_title_enhance
+        self.embed_batch_size = max(1, int(embed_batch_size or config.get("embed_batch_size", 256)))
+        self.queue_size = max(1, int(queue_size or config.get("queue_size", 8)))
+        self.stream_pages = (config.get("stream_pages", True)
+                             and GetDocumentLoaderConfig().get("executor", "thread") != "process")
+        self.stream_workers = max(1, int(config.get("stream_workers", 4)))
+
+    def _stream_file(self, file: KnowledgeFile, out_q: queue.Queue, stop: threading.Event):
+        # parts are (kb_name, file_name, docs, first, last), the last part may have no docs.
+        first = True
+        try:
+            for docs in file.iter_file2text(zh_title_enhance=self.zh_title_enhance,
+                                            chunk_size=self.chunk_size,
+                                            chunk_overlap=self.chunk_overlap):
+                if not _put(out_q, (True, (file.kb_name, file.filename, docs, first, False)), stop):
+                    return
+                first = False
+            _put(out_q, (True, (file.kb_name, file.filename, [], first, True)), stop)
+        except Exception as e:
+            _put(out_q, (False, (file.kb_name, file.filename, f"from {file.kb_name}/{file.filename} load failed: {e}")), stop)
+
+    def _load(self, files: List, out_q: queue.Queue, stop: threading.Event):
+        stream_files = []
+        other_files = []
+        for file in files:
+            kb_file = file
+            if self.stream_pages and isinstance(file, tuple) and len(file) >= 2:
+                try:
+                    kb_file = KnowledgeFile(filename=file[0], knowledge_base_name=file[1])
+                except Exception:
+                    pass
+            if self.stream_pages and isinstance(kb_file, KnowledgeFile) and kb_file.supports_streaming():
+                stream_files.append(kb_file)
+            else:
+                other_files.append(file)
+        pool = ThreadPoolExecutor(max_workers=self.stream_workers, thread_name_prefix="ingest-stream") if stream_files else None
+        try:
+            futures = [pool.submit(self._stream_file, file, out_q, stop) for file in stream_files]
+            if other_files:
+                for status, result in files2docs_in_thread(other_files,
+                                                           chunk_size=self.chunk_size,
+                                                           chunk_overlap=self.chunk_overlap,
+                                                           zh_title_enhance=self.zh_title_enhance):
+                    if status:
+                        result = (*result, True, True)
+                    if not _put(out_q, (status, result), stop):
+                        return
+            for future in futures:
+                future.result()
+        except Exception as e:
+            print(f"ingest pipeline: load stage failed: {e}")
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            _put(out_q, _END, stop)
+
+    def _embed_batch(self, batch: List[Tuple[KnowledgeFile, List[Document], bool, bool]], out_q: queue.Queue,
+                     stop: threading.Event, failed_files: Set[str]) -> bool:
+        docs = [doc for _, file_docs, _, _ in batch for doc in file_docs]
+        data = None
+        if docs:
+            self.kb.relative_sources(docs)
+            try:
+                data = self.kb._docs_to_embeddings(docs)
+                if data is None:
+                    raise RuntimeError(f"embed model {self.kb.embed_model} returned no embeddings")
+            except Exception as e:
+                # one error per file, the parts of these files that are still to come are dropped by _embed.
+                files = {kb_file.filename: kb_file for kb_file, _, _, _ in batch}
+                for file_name, kb_file in files.items():
+                    failed_files.add(file_name)
+                    if not _put(out_q, (False, (kb_file.kb_name, file_name, f"embedding failed: {e}")), stop):
+                        return False
+                return True
+        return _put(out_q, (True, (batch, data)), stop)
+
+    def _embed(self, in_q: queue.Queue, out_q: queue.Queue, stop: threading.Event):
+        batch = []
+        count = 0
+        # chunks seen so far of every file that is streamed page by page.
+        file_docs_count: Dict[str, int] = {}
+        # files whose embedding failed, their remaining parts are skipped until the last one.
+        failed_files: Set[str] = set()
+        try:
+            while True:
+                item = _get(in_q, stop)
+                if item is _END:
+                    break
+                status, result = item
+                if not status:
+                    file_docs_count.pop(result[1], None)
+                    # pages of a failed file that are not embedded yet are dropped.
+                    batch = [entry for entry in batch if entry[0].filename != result[1]]
+                    count = sum(len(entry[1]) for entry in batch)
+                    if result[1] in failed_files:
+                        # the file was already reported when its embedding failed.
+                        failed_files.discard(result[1])
+                        continue
+                    if not _put(out_q, item, stop):
+                        return
+                    continue
+                kb_name, file_name, docs, first, last = result
+                if file_name in failed_files:
+                    if last:
+                        failed_files.discard(file_name)
+                        file_docs_count.pop(file_name, None)
+                    continue
+                total_docs = (0 if first else file_docs_count.get(file_name, 0)) + len(docs)
+                file_docs_count[file_name] = total_docs
+                if last:
+                    file_docs_count.pop(file_name, None)
+                    if not total_docs:
+                        if not _put(out_q, (False, (kb_name, file_name, "no documents were loaded")), stop):
+                            return
+                        continue
+                kb_file = KnowledgeFile(filename=file_name, knowledge_base_name=kb_name)
+                batch.append((kb_file, docs, not first, last))
+                count += len(docs)
+                if count >= self.embed_batch_size:
+                    if not self._embed_batch(batch, out_q, stop, failed_files):
+                        return
+                    batch = []
+                    count = 0
+            if batch:
+                self._embed_batch(batch, out_q, stop, failed_files)
+        except Exception as e:
+            print(f"ingest pipeline: embed stage failed: {e}")
+        finally:
+            _put(out_q, _END, stop)
+
+    def _discard_file(self, kb_file: KnowledgeFile):
+        # a file is either fully indexed or not at all, so sync_knowledge_base picks it up again.
+        try:
+            self.kb.delete_doc(kb_file, not_refresh_vs_cache=True)
+        except Exception as e:
+            print(f"ingest pipeline: remove partly ingested file '{kb_file.filename}' failed: {e}")
+
+    def run(self, files: List[Union[KnowledgeFile, Tuple[str, str], Dict]]) -> Generator[Dict, None, None]:
+        '''
+        ingest files and yield one progress event per file:
+        {"code": 200, "msg", "total", "finished", "doc"} or {"code": 500, "msg", "doc"}.
+        the vector store is not saved, callers call save_vector_store when they are done.
+        '''
+        total = len(files)
+        finished = 0
+        stop = threading.Event()
+        loaded_q = queue.Queue(maxsize=self.queue_size)
+        embedded_q = queue.Queue(maxsize=self.queue_size)
+        threading.Thread(target=self._load, args=(files, loaded_q, stop), name="ingest-load", daemon=True).start()
+        threading.Thread(target=self._embed, args=(loaded_q, embedded_q, stop), name="ingest-embed", daemon=True).start()
+        # files that got an error event, their parts still in the queue are neither inserted nor reported.
+        failed_files = set()
+        # files with parts in the store whose last part is not committed yet.
+        partial_files: Dict[str, KnowledgeFile] = {}
+        try:
+            while True:
+                item = embedded_q.get()
+                if item is _END:
+                    break
+                status, result = item
+                if not status:
+                    kb_name, file_name, error = result
+                    if file_name in failed_files:
+                        continue
+                    failed_files.add(file_name)
+                    if file_name in partial_files:
+                        self._discard_file(partial_files.pop(file_name))
+                    finished += 1
+                    yield {"code": 500,
+                           "msg": f"add file '{file_name}' to knowledge base '{kb_name}' error: {error}. skip.",
+                           "doc": file_name}
+                    continue
+                batch, data = result
+                if data is not None and any(kb_file.filename in failed_files for kb_file, _, _, _ in batch):
+                    # data holds one entry per chunk, in the order of the chunks in the batch.
+                    keep = [keep_file for kb_file, docs, _, _ in batch
+                            for keep_file in [kb_file.filename not in failed_files] * len(docs)]
+                    data = {key: [v for v, k in zip(value, keep) if k] for key, value in data.items()}
+                batch = [entry for entry in batch if entry[0].filename not in failed_files]
+                error = None
+                if batch:
+                    try:
+                        self.kb.add_docs_batch([(kb_file, docs, append, last) for kb_file, docs, append, last in batch],
+                                               data, not_refresh_vs_cache=True)
+                    except Exception as e:
+                        error = e
+                for kb_file, _, _, last in batch:
+                    if error is not None:
+                        if kb_file.filename in failed_files:
+                            continue
+                        failed_files.add(kb_file.filename)
+                        partial_files.pop(kb_file.filename, None)
+                        # the failed insert may have removed the file's old docs already.
+                        self._discard_file(kb_file)
+                        finished += 1
+                        yield {"code": 500,
+                               "msg": f"add file '{kb_file.filename}' to knowledge base '{kb_file.kb_name}' error: {error}. skip.",
+                               "doc": kb_file.filename}
+                    elif last:
+                        partial_files.pop(kb_file.filename, None)
+                        finished += 1
+                        yield {"code": 200,
+                               "msg": f"({finished} / {total}): {kb_file.filename}",
+                               "total": total,
+                               "finished": finished,
+                               "doc": kb_file.filename}
+                    else:
+                        partial_files[kb_file.filename] = kb_file
+        finally:
+            stop.set()
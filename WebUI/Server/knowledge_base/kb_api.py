@@ -10,6 +10,11 @@ def list_kbs():
     # Get List of Knowledge Base
     return ListResponse(data=list_kbs_from_db())
 
+def vector_store_cache_stats() -> BaseResponse:
+    # Get resident faiss vector stores, their size, load latency and hit rate
+    from WebUI.Server.knowledge_base.kb_cache.faiss_cache import kb_faiss_pool
+    return BaseResponse(data=kb_faiss_pool.stats())
+
 def create_kb(knowledge_base_name: str = Body(..., examples=["samples"]),
             knowledge_base_info: str = Body(""),
             vector_store_type: str = Body("faiss"),
@@ -1,20 +1,89 @@
 from langchain.embeddings.base import Embeddings
 #from langchain.vectorstores.faiss import FAISS
 import os
+import time
 import threading
 from WebUI.Server.utils import detect_device, get_embed_model_config, list_online_embed_models
 from WebUI.Server.knowledge_base.utils import CHUNK_SIZE
+from WebUI.configs.basicconfig import GetEmbeddingsPoolConfig
 from contextlib import contextmanager
 from collections import OrderedDict
-from typing import List, Any, Union, Tuple
+from typing import List, Dict, Any, Union, Tuple
+
+class RWLock:
+    '''
+    Readers-writer lock: any number of readers share the lock, a writer holds it exclusively.
+    Both sides are reentrant per thread, a writer may also take the read side.
+    Waiting writers block new readers, so a steady search load can't starve an ingest.
+    '''
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def _read_depth(self) -> int:
+        return getattr(self._local, "depth", 0)
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if self._read_depth() == 0:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._readers += 1
+            self._local.depth = self._read_depth() + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth -= 1
+                return
+            self._local.depth = self._read_depth() - 1
+            if self._local.depth == 0:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers > 0:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
 
 class ThreadSafeObject:
     def __init__(self, key: Union[str, Tuple], obj: Any = None, pool: "CachePool" = None):
         self._obj = obj
         self._key = key
         self._pool = pool
-        self._lock = threading.RLock()
+        self._lock = RWLock()
         self._loaded = threading.Event()
+        self.nbytes = 0
+        self.hits = 0
+        self.load_time = 0.0
 
     def __repr__(self) -> str:
         cls = type(self).__name__
@@ -24,19 +93,44 @@ class ThreadSafeObject:
     def key(self):
         return self._key
 
+    def _touch(self):
+        # under the pool lock, so total_bytes() and stats() never see the order change mid-iteration.
+        if self._pool is not None:
+            with self._pool.atomic:
+                try:
+                    self._pool._cache.move_to_end(self.key)
+                except KeyError:
+                    # evicted from the pool while still in use.
+                    pass
+
     @contextmanager
     def acquire(self, owner: str = "", msg: str = ""):
+        '''
+        exclusive access, use it when the object is modified.
+        '''
         owner = owner or f"thread {threading.get_native_id()}"
         try:
             self._lock.acquire()
-            if self._pool is not None:
-                self._pool._cache.move_to_end(self.key)
+            self._touch()
             print(f"{owner} begin: {self.key}. {msg}")
             yield self._obj
         finally:
             print(f"{owner} end: {self.key}. {msg}")
             self._lock.release()
 
+    @contextmanager
+    def acquire_read(self, owner: str = "", msg: str = ""):
+        '''
+        shared access, use it when the object is only read.
+        '''
+        owner = owner or f"thread {threading.get_native_id()}"
+        try:
+            self._lock.acquire_read()
+            self._touch()
+            yield self._obj
+        finally:
+            self._lock.release_read()
+
     def start_loading(self):
         self._loaded.clear()
 
@@ -56,18 +150,87 @@ class ThreadSafeObject:
 
 
 class CachePool:
-    def __init__(self, cache_num: int = -1):
+    def __init__(self, cache_num: int = -1, max_bytes: int = -1):
         self._cache_num = cache_num
+        self._max_bytes = max_bytes
         self._cache = OrderedDict()
         self.atomic = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # accumulated over the whole process lifetime, also for keys that have been evicted.
+        self._key_stats: Dict[str, Dict] = {}
 
     def keys(self) -> List[str]:
         return list(self._cache.keys())
 
+    def total_bytes(self) -> int:
+        with self.atomic:
+            return sum(item.nbytes for item in self._cache.values() if isinstance(item, ThreadSafeObject))
+
+    def _evict_one(self):
+        key, item = self._cache.popitem(last=False)
+        self.evictions += 1
+        print(f"evict '{key}' from {type(self).__name__}, free about {getattr(item, 'nbytes', 0)} bytes.")
+        self._on_evict(key, item)
+
+    def _on_evict(self, key: Union[str, Tuple], item: ThreadSafeObject):
+        pass
+
     def _check_count(self):
-        if isinstance(self._cache_num, int) and self._cache_num > 0:
-            while len(self._cache) > self._cache_num:
-                self._cache.popitem(last=False)
+        with self.atomic:
+            if isinstance(self._cache_num, int) and self._cache_num > 0:
+                while len(self._cache) > self._cache_num:
+                    self._evict_one()
+            # the most recently used entry is never evicted, even if it alone exceeds the budget.
+            if isinstance(self._max_bytes, int) and self._max_bytes > 0:
+                while len(self._cache) > 1 and self.total_bytes() > self._max_bytes:
+                    self._evict_one()
+
+    def _key_stats_of(self, key: Union[str, Tuple]) -> Dict:
+        return self._key_stats.setdefault(str(key), {"hits": 0, "loads": 0, "load_time": 0.0})
+
+    def record_hit(self, item: ThreadSafeObject):
+        self.hits += 1
+        item.hits += 1
+        self._key_stats_of(item.key)["hits"] += 1
+
+    def record_load(self, item: ThreadSafeObject, load_time: float, nbytes: int):
+        self.misses += 1
+        item.load_time = load_time
+        item.nbytes = nbytes
+        key_stats = self._key_stats_of(item.key)
+        key_stats["loads"] += 1
+        key_stats["load_time"] += load_time
+        self._check_count()
+
+    def stats(self) -> Dict:
+        with self.atomic:
+            total = self.hits + self.misses
+            return {
+                "entries": [
+                    {
+                        "key": str(key),
+                        "nbytes": item.nbytes,
+                        "hits": item.hits,
+                        "load_time": item.load_time,
+                    } for key, item in self._cache.items() if isinstance(item, ThreadSafeObject)
+                ],
+                "keys": {
+                    key: {
+                        "hits": v["hits"],
+                        "loads": v["loads"],
+                        "hit_rate": v["hits"] / (v["hits"] + v["loads"]) if v["hits"] + v["loads"] else 0.0,
+                        "avg_load_time": v["load_time"] / v["loads"] if v["loads"] else 0.0,
+                    } for key, v in self._key_stats.items()
+                },
+                "total_bytes": self.total_bytes(),
+                "max_bytes": self._max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+            }
 
     def get(self, key: str) -> ThreadSafeObject:
         if cache := self._cache.get(key):
@@ -90,11 +253,19 @@ class CachePool:
         if cache is None:
             raise RuntimeError(f"The resource '{key}' not exist!")
         elif isinstance(cache, ThreadSafeObject):
-            self._cache.move_to_end(key)
             return cache.acquire(owner=owner, msg=msg)
         else:
             return cache
 
+    def acquire_read(self, key: Union[str, Tuple], owner: str = "", msg: str = ""):
+        cache = self.get(key)
+        if cache is None:
+            raise RuntimeError(f"The resource '{key}' not exist!")
+        elif isinstance(cache, ThreadSafeObject):
+            return cache.acquire_read(owner=owner, msg=msg)
+        else:
+            return cache
+
     def load_kb_embeddings(
             self,
             kb_name: str,
@@ -113,19 +284,47 @@ class CachePool:
             return embeddings_pool.load_embeddings(model=embed_model, device=embed_device)
 
 
+def estimate_embeddings_bytes(embeddings: Embeddings) -> int:
+    '''
+    approximate resident memory of a local embeddings model (parameters + buffers), 0 for online models.
+    '''
+    client = getattr(embeddings, "client", None)
+    if client is None or not hasattr(client, "parameters"):
+        return 0
+    try:
+        nbytes = sum(p.numel() * p.element_size() for p in client.parameters())
+        nbytes += sum(b.numel() * b.element_size() for b in client.buffers())
+        return nbytes
+    except Exception as e:
+        print(f"estimate embeddings memory failed: {e}")
+        return 0
+
+
 class EmbeddingsPool(CachePool):
+    def preload(self, models: List[str] = None, device: str = None):
+        '''
+        load the configured embedding models ahead of the first request.
+        '''
+        models = models if models is not None else GetEmbeddingsPoolConfig().get("preload_models", [])
+        for model in models:
+            try:
+                self.load_embeddings(model=model, device=device)
+            except Exception as e:
+                print(f"preload embedding model '{model}' failed: {e}")
+
     def load_embeddings(self, model: str = None, device: str = None) -> Embeddings:
         self.atomic.acquire()
         model = model or ""
         if device is None or device == "":
             device = detect_device()
         key = (model, device)
-        if not self.get(key):
+        if not (cache := self.get(key)):
             embed_config = get_embed_model_config(model)
             item = ThreadSafeObject(key, pool=self)
             self.set(key, item)
             with item.acquire(msg="Initialize"):
                 self.atomic.release()
+                start = time.time()
                 if model == "text-embedding-ada-002":  # openai text-embedding-ada-002
                     from langchain.embeddings.openai import OpenAIEmbeddings
                     apikey = embed_config.get("api_key", "[Your Key]")
@@ -170,9 +369,16 @@ class EmbeddingsPool(CachePool):
                                                        model_kwargs={'device': device})
                 item.obj = embeddings
                 item.finish_loading()
+                self.record_load(item, time.time() - start, estimate_embeddings_bytes(embeddings))
+                print(f"load embedding model '{model}' on {device} in {item.load_time:.2f}s, about {item.nbytes} bytes.")
+            return embeddings
         else:
+            self._cache.move_to_end(key)
+            self.record_hit(cache)
             self.atomic.release()
-        return self.get(key).obj
+        return cache.obj
 
 
-embeddings_pool = EmbeddingsPool(cache_num=1)
+_embeddings_pool_config = GetEmbeddingsPoolConfig()
+embeddings_pool = EmbeddingsPool(cache_num=_embeddings_pool_config.get("cache_num", -1),
+                                 max_bytes=int(_embeddings_pool_config.get("max_memory_mb", 4096) * 1024 * 1024))
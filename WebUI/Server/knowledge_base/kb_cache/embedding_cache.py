@@ -0,0 +1,189 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+from WebUI.configs.basicconfig import GetEmbeddingCacheConfig
+from typing import List, Dict, Optional, Tuple
+
+DEFAULT_EMBEDDING_CACHE_PATH = "./WebUI/knowledge_base/embedding_cache.db"
+DEFAULT_EMBEDDING_CACHE_SIZE_MB = 1024
+# after an eviction the cache is trimmed down to this fraction of max size,
+# so that the next few inserts don't trigger another eviction immediately.
+EVICT_LOW_WATERMARK = 0.9
+
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFC", text or "").strip()
+
+
+def make_cache_key(embed_model: str, to_query: bool, text: str) -> str:
+    h = hashlib.sha256()
+    h.update((embed_model or "").encode("utf-8"))
+    h.update(b"\x00q" if to_query else b"\x00d")
+    h.update(b"\x00")
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    '''
+    Disk-backed, content-addressed embedding cache.
+    Vectors are stored as float32 blobs in SQLite, keyed by hash(model, to_query, normalized text),
+    and evicted in least-recently-used order once the total vector size exceeds max_size_mb.
+    '''
+    def __init__(self, path: str = DEFAULT_EMBEDDING_CACHE_PATH, max_size_mb: int = DEFAULT_EMBEDDING_CACHE_SIZE_MB):
+        self.path = path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._conn = None
+        self._total_bytes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                key TEXT PRIMARY KEY,
+                                model TEXT,
+                                dim INTEGER,
+                                nbytes INTEGER,
+                                vector BLOB,
+                                last_access REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+            conn.commit()
+            self._total_bytes = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, embed_model: str, to_query: bool, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[int]]:
+        '''
+        return (embeddings, missing): embeddings[i] is None for every index listed in missing.
+        '''
+        keys = [make_cache_key(embed_model, to_query, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            conn = self._connect()
+            unique_keys = list(set(keys))
+            # stay below SQLITE_MAX_VARIABLE_NUMBER
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET last_access=? WHERE key=?", [(now, k) for k in found])
+                conn.commit()
+
+            embeddings = []
+            missing = []
+            for i, key in enumerate(keys):
+                embedding = found.get(key)
+                if embedding is None:
+                    missing.append(i)
+                embeddings.append(embedding)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return embeddings, missing
+
+    def set_many(self, embed_model: str, to_query: bool, texts: List[str], embeddings: List[List[float]]):
+        now = time.time()
+        rows = {}
+        for text, embedding in zip(texts, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32)
+            blob = vector.tobytes()
+            rows[make_cache_key(embed_model, to_query, text)] = (embed_model, vector.shape[0], len(blob), blob, now)
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connect()
+            keys = list(rows.keys())
+            replaced = 0
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                replaced += conn.execute(f"SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({marks})", batch).fetchone()[0]
+            conn.executemany("INSERT OR REPLACE INTO embeddings(key, model, dim, nbytes, vector, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(k, *v) for k, v in rows.items()])
+            conn.commit()
+            self._total_bytes += sum(v[2] for v in rows.values()) - replaced
+            self._evict()
+
+    def _evict(self):
+        if self.max_bytes <= 0 or self._total_bytes <= self.max_bytes:
+            return
+        conn = self._conn
+        target = int(self.max_bytes * EVICT_LOW_WATERMARK)
+        while self._total_bytes > target:
+            rows = conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_access LIMIT 1000").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            victims = []
+            for key, nbytes in rows:
+                victims.append((key,))
+                self._total_bytes -= nbytes
+                if self._total_bytes <= target:
+                    break
+            conn.executemany("DELETE FROM embeddings WHERE key=?", victims)
+            self.evictions += len(victims)
+        conn.commit()
+        print(f"embedding cache evicted to {self._total_bytes} bytes, total evictions: {self.evictions}")
+
+    def clear(self, embed_model: str = None):
+        with self._lock:
+            conn = self._connect()
+            if embed_model is None:
+                conn.execute("DELETE FROM embeddings")
+            else:
+                conn.execute("DELETE FROM embeddings WHERE model=?", (embed_model,))
+            conn.commit()
+            self._total_bytes = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            conn = self._connect()
+            entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    '''
+    return the process-wide embedding cache, or None if it is disabled in kbconfig.json.
+    '''
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                config = GetEmbeddingCacheConfig()
+                if config.get("enable", True):
+                    _embedding_cache = EmbeddingCache(path=config.get("path", DEFAULT_EMBEDDING_CACHE_PATH),
+                                                      max_size_mb=config.get("max_size_mb", DEFAULT_EMBEDDING_CACHE_SIZE_MB))
+                else:
+                    _embedding_cache = False
+    return _embedding_cache or None
@@ -3,15 +3,30 @@ from WebUI.Server.knowledge_base.kb_service.base import EmbeddingsFunAdapter
 from WebUI.Server.utils import detect_device, load_embeddings
 from WebUI.Server.knowledge_base.utils import get_vs_path
 from WebUI.configs.kbconfig import DEFAULT_EMBEDDING_MODEL
-from langchain.vectorstores.faiss import FAISS
+from WebUI.configs.basicconfig import GetFaissPoolConfig
+from WebUI.configs.webuiconfig import write_json_atomic
+from WebUI.Server.knowledge_base.kb_cache.faiss_index import (is_flat_index, is_ivf_index, delete_from_ivf, delete_by_rebuild,
+                                                              estimate_index_bytes)
+from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
 from langchain.docstore.in_memory import InMemoryDocstore
 from langchain.schema import Document
 import os
+import sys
+import json
+import copy
+import time
+import atexit
+import shutil
+import tempfile
 import threading
-from typing import Union
+from contextlib import contextmanager
+from typing import Dict, List, Set, Tuple, Union
 
-CACHED_VS_NUM = 1
+CACHED_VS_NUM = -1
+CACHED_VS_MEMORY_MB = 2048
 CACHED_MEMO_VS_NUM = 10
+# seconds between background saves of changed vector stores, 0 saves synchronously.
+VS_FLUSH_INTERVAL = 5
 
 # patch FAISS to include doc id in Document.metadata
 def _new_ds_search(self, search: str) -> Union[str, Document]:
@@ -25,7 +40,163 @@ def _new_ds_search(self, search: str) -> Union[str, Document]:
 InMemoryDocstore.search = _new_ds_search
 
 
+def normalize_source(source: str) -> str:
+    return str(source or "").lower()
+
+
+def get_source_index(vs: FAISS) -> Dict[str, Set[str]]:
+    '''
+    inverted index from normalized metadata["source"] to doc ids, kept on the store object
+    so that copy-on-write copies carry their own. built on first use after loading.
+    '''
+    index = getattr(vs, "_source_ids", None)
+    if index is None:
+        index = {}
+        for id, doc in vs.docstore._dict.items():
+            if isinstance(doc, Document):
+                index.setdefault(normalize_source(doc.metadata.get("source")), set()).add(id)
+        vs._source_ids = index
+    return index
+
+
+def get_ids_by_source(vs: FAISS, source: str) -> List[str]:
+    return list(get_source_index(vs).get(normalize_source(source), ()))
+
+
+def add_to_source_index(vs: FAISS, ids: List[str], metadatas: List[Dict]):
+    index = get_source_index(vs)
+    for id, metadata in zip(ids, metadatas):
+        index.setdefault(normalize_source((metadata or {}).get("source")), set()).add(id)
+
+
+def delete_from_vector_store(vs: FAISS, ids: List[str]):
+    '''
+    delete ids from the store and from its source index.
+    '''
+    index = get_source_index(vs)
+    ids = [id for id in ids if id in vs.docstore._dict]
+    if not ids:
+        return False
+    for id in ids:
+        doc = vs.docstore._dict[id]
+        source = normalize_source(doc.metadata.get("source")) if isinstance(doc, Document) else ""
+        if source in index:
+            index[source].discard(id)
+            if not index[source]:
+                del index[source]
+    if is_flat_index(vs.index):
+        return vs.delete(ids)
+    if is_ivf_index(vs.index):
+        delete_from_ivf(vs, ids)
+    else:
+        delete_by_rebuild(vs, ids)
+    return True
+
+
+VS_MANIFEST = "index.json"
+
+
+def get_vs_index_path(path: str) -> str:
+    '''
+    the folder holding the current index.faiss and index.pkl of a store: the version named by the
+    manifest, or path itself for stores saved before versioned folders were used.
+    '''
+    try:
+        with open(os.path.join(path, VS_MANIFEST), "r") as file:
+            version = json.load(file).get("version", "")
+        if version and os.path.isdir(os.path.join(path, version)):
+            return os.path.join(path, version)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"read vector store manifest in '{path}' failed: {e}")
+    return path
+
+
+def save_vector_store_atomic(vs: FAISS, path: str, index_name: str = "index"):
+    '''
+    save index.faiss and index.pkl together into a new version folder inside path, then switch the
+    manifest to it with one os.replace. a crash at any point leaves the manifest on a complete pair.
+    the previous version is kept for readers that are still loading it, older ones are removed.
+    '''
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    previous = get_vs_index_path(path)
+    version = f"v{time.time_ns()}"
+    tmp_path = tempfile.mkdtemp(prefix=".saving-", dir=path)
+    try:
+        vs.save_local(tmp_path, index_name=index_name)
+        os.replace(tmp_path, os.path.join(path, version))
+        write_json_atomic(os.path.join(path, VS_MANIFEST), {"version": version})
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    for name in os.listdir(path):
+        name_path = os.path.join(path, name)
+        if name.startswith("v") and name != version and os.path.isdir(name_path) and name_path != previous:
+            shutil.rmtree(name_path, ignore_errors=True)
+    if previous == path:
+        # a store saved before versioned folders, its files are superseded by the new version.
+        for ext in ["pkl", "faiss"]:
+            if os.path.isfile(os.path.join(path, f"{index_name}.{ext}")):
+                os.remove(os.path.join(path, f"{index_name}.{ext}"))
+
+
+def estimate_doc_bytes(doc: Document) -> int:
+    # the docstore entry plus its index_to_docstore_id entry (int key + uuid string value).
+    if not isinstance(doc, Document):
+        return 100
+    return sys.getsizeof(doc.page_content) + sys.getsizeof(str(doc.metadata)) + 100
+
+
+def estimate_docs_bytes(vs: FAISS, ids: List[str]) -> int:
+    return sum(estimate_doc_bytes(vs.docstore._dict[id]) for id in ids if id in vs.docstore._dict)
+
+
+def copy_vector_store(vs: FAISS) -> FAISS:
+    '''
+    copy the index, docstore and id mapping, documents themselves are shared.
+    '''
+    faiss = dependable_faiss_import()
+    new_vs = copy.copy(vs)
+    new_vs.index = faiss.clone_index(vs.index)
+    new_vs.docstore = InMemoryDocstore(dict(vs.docstore._dict))
+    new_vs.index_to_docstore_id = dict(vs.index_to_docstore_id)
+    if (source_index := getattr(vs, "_source_ids", None)) is not None:
+        new_vs._source_ids = {source: set(ids) for source, ids in source_index.items()}
+    return new_vs
+
+
 class ThreadSafeFaiss(ThreadSafeObject):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # set when the in-memory store has changes that are not saved to disk yet.
+        self.dirty = False
+        # serializes writers (exclusive, copy-on-write and save), readers never take it.
+        self._write_mutex = threading.RLock()
+        # estimated bytes of the docstore, kept up to date by update_bytes instead of rescanning it.
+        self.docs_bytes = 0
+        # set when the pool evicts the store, writers holding a reference may still change it.
+        self.evicted = False
+
+    @contextmanager
+    def acquire(self, owner: str = "", msg: str = ""):
+        with self._write_mutex:
+            with super().acquire(owner=owner, msg=msg) as vs:
+                yield vs
+
+    @contextmanager
+    def acquire_copy(self, owner: str = "", msg: str = ""):
+        '''
+        copy-on-write access for long modifications: yields a private copy of the store that
+        replaces the live one on success. searches keep using the old store in the meantime.
+        '''
+        with self._write_mutex:
+            with self.acquire_read():
+                vs = copy_vector_store(self._obj)
+            yield vs
+            with super().acquire(owner=owner, msg=msg):
+                self._obj = vs
+
     def __repr__(self) -> str:
         cls = type(self).__name__
         return f"<{cls}: key: {self.key}, obj: {self._obj}, docs_count: {self.docs_count()}>"
@@ -33,21 +204,52 @@ class ThreadSafeFaiss(ThreadSafeObject):
     def docs_count(self) -> int:
         return len(self._obj.docstore._dict)
 
+    def estimate_bytes(self) -> int:
+        '''
+        index bytes plus a rough estimate of the docstore and id mapping, scans the whole docstore.
+        '''
+        if self._obj is None:
+            return 0
+        self.docs_bytes = sum(estimate_doc_bytes(doc) for doc in list(self._obj.docstore._dict.values()))
+        return estimate_index_bytes(self._obj.index) + self.docs_bytes
+
+    def update_bytes(self, docs_delta: int = 0) -> int:
+        '''
+        refresh nbytes after docs_delta bytes of documents were added (or removed, if negative).
+        '''
+        self.docs_bytes = max(0, self.docs_bytes + docs_delta)
+        if self._obj is not None:
+            self.nbytes = estimate_index_bytes(self._obj.index) + self.docs_bytes
+        return self.nbytes
+
+    def mark_dirty(self):
+        self.dirty = True
+
     def save(self, path: str, create_path: bool = True):
-        with self.acquire():
-            if not os.path.isdir(path) and create_path:
-                os.makedirs(path)
-            ret = self._obj.save_local(path)
+        # writing to disk doesn't modify the store, searches may go on.
+        with self._write_mutex, self.acquire_read():
+            if not os.path.isdir(path) and not create_path:
+                raise RuntimeError(f"The path '{path}' not exist!")
+            ret = save_vector_store_atomic(self._obj, path)
+            self.dirty = False
             print(f"Save '{self.key}' to disk.")
         return ret
 
+    def save_if_dirty(self, path: str):
+        with self._write_mutex:
+            if self.dirty and self._obj is not None:
+                return self.save(path)
+
     def clear(self):
         ret = []
         with self.acquire():
             ids = list(self._obj.docstore._dict.keys())
             if ids:
-                ret = self._obj.delete(ids)
+                ret = delete_from_vector_store(self._obj, ids)
                 assert len(self._obj.docstore._dict) == 0
+            self._obj._source_ids = {}
+            self.docs_bytes = 0
+            self.update_bytes()
             print(f"Clear '{self.key}'!")
         return ret
 
@@ -77,6 +279,91 @@ class _FaissPool(CachePool):
 
 
 class KBFaissPool(_FaissPool):
+    def __init__(self, *args, flush_interval: float = VS_FLUSH_INTERVAL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending_saves: Dict[Tuple, threading.Thread] = {}
+        # evicted stores with unsaved changes by id, kept until they are saved so flush() doesn't miss them.
+        self._evicted_dirty: Dict[int, ThreadSafeFaiss] = {}
+        self._flush_interval = flush_interval
+        self._flusher = None
+
+    def schedule_save(self, item: ThreadSafeFaiss, path: str):
+        '''
+        mark the store as changed. it is saved by the background flusher, so a bulk ingest
+        writes the index once per flush interval instead of once per file.
+        '''
+        item.mark_dirty()
+        if self._flush_interval is None or self._flush_interval <= 0:
+            item.save(path)
+            return
+        with self.atomic:
+            if item.evicted:
+                # changed through a reference held since before the eviction.
+                self._evicted_dirty[id(item)] = item
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="faiss-flusher", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"flush vector stores failed: {e}")
+
+    def flush(self):
+        '''
+        save every changed vector store, called periodically, on eviction and on shutdown.
+        '''
+        with self.atomic:
+            items = [item for item in self._cache.values() if isinstance(item, ThreadSafeFaiss) and item.dirty]
+            items += list(self._evicted_dirty.values())
+            pending = list(self._pending_saves.values())
+        for item in items:
+            item.save_if_dirty(get_vs_path(*item.key))
+        with self.atomic:
+            for item in items:
+                if not item.dirty:
+                    self._evicted_dirty.pop(id(item), None)
+        for thread in pending:
+            thread.join()
+
+    def _on_evict(self, key: Tuple, item: ThreadSafeFaiss):
+        if not isinstance(item, ThreadSafeFaiss):
+            return
+        item.evicted = True
+        if item.dirty and item.obj is not None:
+            # save outside of the pool lock, the store may still be in use by another thread.
+            self._evicted_dirty[id(item)] = item
+            thread = threading.Thread(target=self._save_evicted, args=(key, item), daemon=True)
+            self._pending_saves[key] = thread
+            thread.start()
+
+    def _save_evicted(self, key: Tuple, item: ThreadSafeFaiss):
+        try:
+            item.save_if_dirty(get_vs_path(*key))
+        except Exception as e:
+            print(f"save evicted vector store '{key}' failed: {e}")
+        finally:
+            with self.atomic:
+                if not item.dirty:
+                    self._evicted_dirty.pop(id(item), None)
+                if self._pending_saves.get(key) is threading.current_thread():
+                    del self._pending_saves[key]
+
+    def _wait_for_pending_save(self, key: Tuple):
+        if thread := self._pending_saves.pop(key, None):
+            thread.join()
+
+    def resize(self, item: ThreadSafeFaiss, docs_delta: int = 0):
+        '''
+        refresh the size of a store after docs_delta bytes of documents were added or removed,
+        evicting other stores if the budget is exceeded.
+        '''
+        item.update_bytes(docs_delta)
+        self._check_count()
+
     def load_vector_store(
             self,
             kb_name: str,
@@ -93,25 +380,33 @@ class KBFaissPool(_FaissPool):
             self.set((kb_name, vector_name), item)
             with item.acquire(msg="Initialize"):
                 self.atomic.release()
+                self._wait_for_pending_save((kb_name, vector_name))
+                start = time.time()
                 print(f"loading vector store in '{kb_name}/vector_store/{vector_name}' from disk.")
                 vs_path = get_vs_path(kb_name, vector_name)
 
-                if os.path.isfile(os.path.join(vs_path, "index.faiss")):
+                index_path = get_vs_index_path(vs_path)
+
+                if os.path.isfile(os.path.join(index_path, "index.faiss")):
                     embeddings = self.load_kb_embeddings(kb_name=kb_name, embed_device=embed_device, default_embed_model=embed_model)
-                    vector_store = FAISS.load_local(vs_path, embeddings, normalize_L2=True,distance_strategy="METRIC_INNER_PRODUCT")
+                    vector_store = FAISS.load_local(index_path, embeddings, normalize_L2=True,distance_strategy="METRIC_INNER_PRODUCT")
                 elif create:
                     # create an empty vector store
-                    if not os.path.exists(vs_path):
-                        os.makedirs(vs_path)
                     vector_store = self.new_vector_store(embed_model=embed_model, embed_device=embed_device)
-                    vector_store.save_local(vs_path)
+                    save_vector_store_atomic(vector_store, vs_path)
                 else:
                     raise RuntimeError(f"knowledge base {kb_name} not exist.")
+                get_source_index(vector_store)
                 item.obj = vector_store
                 item.finish_loading()
+            self.record_load(item, time.time() - start, item.estimate_bytes())
+            print(f"load vector store '{kb_name}/{vector_name}' in {item.load_time:.2f}s, about {item.nbytes} bytes.")
+            return item
         else:
+            self._cache.move_to_end((kb_name, vector_name))
+            self.record_hit(cache)
             self.atomic.release()
-        return self.get((kb_name, vector_name))
+        return cache
 
 
 class MemoFaissPool(_FaissPool):
@@ -138,7 +433,11 @@ class MemoFaissPool(_FaissPool):
         return self.get(kb_name)
 
 
-kb_faiss_pool = KBFaissPool(cache_num=CACHED_VS_NUM)
+_faiss_pool_config = GetFaissPoolConfig()
+kb_faiss_pool = KBFaissPool(cache_num=_faiss_pool_config.get("cache_num", CACHED_VS_NUM),
+                            max_bytes=int(_faiss_pool_config.get("max_memory_mb", CACHED_VS_MEMORY_MB) * 1024 * 1024),
+                            flush_interval=_faiss_pool_config.get("flush_interval", VS_FLUSH_INTERVAL))
+atexit.register(kb_faiss_pool.flush)
 memo_faiss_pool = MemoFaissPool(cache_num=CACHED_MEMO_VS_NUM)
 
 
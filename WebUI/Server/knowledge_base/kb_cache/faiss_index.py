@@ -0,0 +1,243 @@
+import numpy as np
+from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
+from langchain.schema import Document
+from WebUI.configs.basicconfig import GetKbsConfig
+from typing import Dict, List, Tuple, Optional
+
+SUPPORTED_INDEX_TYPES = ["Flat", "IVF-Flat", "IVF-PQ", "HNSW"]
+
+DEFAULT_INDEX_CONFIG = {
+    "index_type": "Flat",
+    # IVF: number of clusters, and how many of them are scanned per query
+    "nlist": 1024,
+    "nprobe": 16,
+    # IVF-PQ: sub-quantizers (must divide the embedding dim) and bits per code
+    "pq_m": 16,
+    "pq_nbits": 8,
+    # HNSW: graph degree, build and search beam width
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+    # IVF indexes are trained once the store holds this many vectors, until then it stays flat.
+    "min_train_size": 10000,
+}
+
+
+def get_faiss_index_config(kb_name: str) -> Dict:
+    '''
+    kbs_config.faiss.index.default merged with kbs_config.faiss.index.<kb_name> from kbconfig.json.
+    '''
+    index_config = GetKbsConfig("faiss").get("index", {})
+    config = dict(DEFAULT_INDEX_CONFIG)
+    config.update(index_config.get("default", {}))
+    config.update(index_config.get(kb_name, {}))
+    if config["index_type"] not in SUPPORTED_INDEX_TYPES:
+        print(f"unsupported faiss index type '{config['index_type']}' for '{kb_name}', use Flat instead.")
+        config["index_type"] = "Flat"
+    return config
+
+
+def get_index_type(index) -> str:
+    name = type(index).__name__
+    if name.startswith("IndexHNSW"):
+        return "HNSW"
+    if name.startswith("IndexIVFPQ"):
+        return "IVF-PQ"
+    if name.startswith("IndexIVF"):
+        return "IVF-Flat"
+    return "Flat"
+
+
+def is_flat_index(index) -> bool:
+    return get_index_type(index) == "Flat"
+
+
+def is_ivf_index(index) -> bool:
+    return get_index_type(index) in ["IVF-Flat", "IVF-PQ"]
+
+
+def new_faiss_index(dim: int, config: Dict, ntotal: int = 0):
+    '''
+    build an empty index of the configured type. the store scores by L2 distance,
+    so every index type uses METRIC_L2 to keep SCORE_THRESHOLD meaningful.
+    '''
+    faiss = dependable_faiss_import()
+    index_type = config["index_type"]
+    if index_type == "HNSW":
+        index = faiss.index_factory(dim, f"HNSW{config['hnsw_m']},Flat", faiss.METRIC_L2)
+        index.hnsw.efConstruction = config["ef_construction"]
+    elif index_type in ["IVF-Flat", "IVF-PQ"]:
+        # about 39 training points per cluster are needed, don't ask for more clusters than that.
+        nlist = max(1, min(config["nlist"], ntotal // 39 if ntotal else config["nlist"]))
+        if index_type == "IVF-PQ":
+            description = f"IVF{nlist},PQ{config['pq_m']}x{config['pq_nbits']}"
+        else:
+            description = f"IVF{nlist},Flat"
+        index = faiss.index_factory(dim, description, faiss.METRIC_L2)
+    else:
+        index = faiss.IndexFlatL2(dim)
+    return index
+
+
+def need_convert(vs: FAISS, config: Dict) -> bool:
+    current = get_index_type(vs.index)
+    if current == config["index_type"]:
+        return False
+    if config["index_type"] in ["IVF-Flat", "IVF-PQ"]:
+        return vs.index.ntotal >= config["min_train_size"]
+    return vs.index.ntotal > 0
+
+
+def convert_index(vs: FAISS, config: Dict):
+    '''
+    rebuild the index of vs with the configured type, training it on the stored vectors.
+    labels stay 0..ntotal-1 so index_to_docstore_id is still valid.
+    '''
+    ntotal = vs.index.ntotal
+    vectors = vs.index.reconstruct_n(0, ntotal) if ntotal else np.zeros((0, vs.index.d), dtype=np.float32)
+    index = new_faiss_index(vs.index.d, config, ntotal=ntotal)
+    if not index.is_trained:
+        index.train(vectors)
+    if ntotal:
+        index.add(vectors)
+    print(f"convert faiss index from {get_index_type(vs.index)} to {config['index_type']} with {ntotal} vectors.")
+    vs.index = index
+
+
+def delete_from_ivf(vs: FAISS, ids: List[str]):
+    '''
+    remove ids from an IVF index with remove_ids, then renumber the labels left in the inverted lists
+    to 0..ntotal-1 so index_to_docstore_id stays dense and new vectors get unused labels.
+    the stored codes are kept, a PQ index is never re-encoded from lossy reconstructions.
+    '''
+    faiss = dependable_faiss_import()
+    ids_to_delete = set(ids)
+    removed = [i for i, id in vs.index_to_docstore_id.items() if id in ids_to_delete]
+    keep = [(i, id) for i, id in sorted(vs.index_to_docstore_id.items()) if id not in ids_to_delete]
+    index = vs.index
+    ivf = faiss.extract_index_ivf(index)
+    # a direct map can't follow removals, it is rebuilt once the labels are renumbered.
+    direct_map_type = ivf.direct_map.type
+    if direct_map_type != faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+    if removed:
+        index.remove_ids(faiss.IDSelectorBatch(np.array(removed, dtype=np.int64)))
+    labels = np.full(max(vs.index_to_docstore_id, default=-1) + 1, -1, dtype=np.int64)
+    labels[[i for i, _ in keep]] = np.arange(len(keep), dtype=np.int64)
+    invlists = ivf.invlists
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            old = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+            new = np.ascontiguousarray(labels[old])
+            invlists.update_entries(list_no, 0, size, faiss.swig_ptr(new), invlists.get_codes(list_no))
+    if direct_map_type != faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(direct_map_type)
+    vs.docstore.delete(list(ids_to_delete))
+    vs.index_to_docstore_id = {n: id for n, (_, id) in enumerate(keep)}
+
+
+def delete_by_rebuild(vs: FAISS, ids: List[str]):
+    '''
+    HNSW can't remove ids, so the remaining vectors are re-added to an empty copy of the trained index.
+    its vectors are stored in full, reconstructing them loses nothing.
+    '''
+    faiss = dependable_faiss_import()
+    ids_to_delete = set(ids)
+    keep = [(i, id) for i, id in sorted(vs.index_to_docstore_id.items()) if id not in ids_to_delete]
+    vectors = vs.index.reconstruct_n(0, vs.index.ntotal)
+    index = faiss.clone_index(vs.index)
+    index.reset()
+    if keep:
+        index.add(np.ascontiguousarray(vectors[[i for i, _ in keep]]))
+    vs.index = index
+    vs.docstore.delete(list(ids_to_delete))
+    vs.index_to_docstore_id = {n: id for n, (_, id) in enumerate(keep)}
+
+
+def estimate_index_bytes(index) -> int:
+    index_type = get_index_type(index)
+    if index_type == "IVF-PQ":
+        # pq codes plus the 8-byte id kept in the inverted lists
+        return index.ntotal * (index.code_size + 8)
+    if index_type == "HNSW":
+        # full vectors plus about 2 * M neighbour links per vector on level 0
+        return index.ntotal * (index.d * 4 + index.hnsw.nb_neighbors(0) * 4)
+    return index.ntotal * index.d * 4
+
+
+def make_search_params(index, config: Dict, nprobe: int = 0, ef_search: int = 0):
+    '''
+    per-query parameters, so concurrent searches with different knobs don't touch the shared index.
+    '''
+    faiss = dependable_faiss_import()
+    index_type = get_index_type(index)
+    if index_type == "HNSW":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or config["ef_search"])
+    if index_type in ["IVF-Flat", "IVF-PQ"]:
+        return faiss.SearchParametersIVF(nprobe=nprobe or config["nprobe"])
+    return None
+
+
+def search_with_params(
+        vs: FAISS,
+        embeddings: List[List[float]],
+        k: int,
+        score_threshold: Optional[float] = None,
+        params=None,
+) -> List[List[Tuple[Document, float]]]:
+    '''
+    search one or many query vectors in a single index.search call, return hits per query.
+    scores are L2 distances, hits farther than score_threshold are dropped like FAISS does.
+    '''
+    faiss = dependable_faiss_import()
+    vectors = np.array(embeddings, dtype=np.float32)
+    if getattr(vs, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+    if params is not None:
+        scores, indices = vs.index.search(vectors, k, params=params)
+    else:
+        scores, indices = vs.index.search(vectors, k)
+    results = []
+    for row_scores, row_indices in zip(scores, indices):
+        docs = []
+        for score, i in zip(row_scores, row_indices):
+            if i == -1 or (score_threshold is not None and score > score_threshold):
+                continue
+            doc = vs.docstore.search(vs.index_to_docstore_id[i])
+            if isinstance(doc, Document):
+                docs.append((doc, float(score)))
+        results.append(docs)
+    return results
+
+
+def rebuild_vector_index(kb_name: str, index_type: Optional[str] = None) -> bool:
+    '''
+    convert the index of an existing faiss knowledge base, e.g. a flat store created before
+    an index type was configured for it, and save it to disk.
+    '''
+    from WebUI.Server.knowledge_base.kb_service.base import KBServiceFactory, SupportedVSType
+
+    kb = KBServiceFactory.get_service_by_name(kb_name)
+    if kb is None or kb.vs_type() != SupportedVSType.FAISS:
+        print(f"knowledge base '{kb_name}' not exist or is not a faiss knowledge base.")
+        return False
+    config = get_faiss_index_config(kb_name)
+    if index_type:
+        config["index_type"] = index_type
+    vector_store = kb.load_vector_store()
+    with vector_store.acquire_copy(msg="Rebuild index") as vs:
+        convert_index(vs, config)
+        vector_store.mark_dirty()
+    vector_store.save(kb.vs_path)
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="rebuild the faiss index of a knowledge base")
+    parser.add_argument("kb_name", type=str)
+    parser.add_argument("--index-type", type=str, choices=SUPPORTED_INDEX_TYPES, default=None,
+                        help="default is the index type configured in kbconfig.json")
+    args = parser.parse_args()
+    rebuild_vector_index(args.kb_name, args.index_type)
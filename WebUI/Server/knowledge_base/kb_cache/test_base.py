@@ -0,0 +1,85 @@
+import threading
+import time
+import pytest
+
+pytest.importorskip("langchain")
+
+from WebUI.Server.knowledge_base.kb_cache.base import RWLock
+
+
+def start(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_share_the_lock():
+    lock = RWLock()
+    both_inside = threading.Barrier(2, timeout=5)
+
+    def reader():
+        lock.acquire_read()
+        both_inside.wait()
+        lock.release_read()
+
+    threads = [start(reader), start(reader)]
+    for thread in threads:
+        thread.join(timeout=5)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    order = []
+    lock.acquire_read()
+    writer = start(lambda: (lock.acquire(), order.append("writer"), lock.release()))
+    while not lock._writers_waiting:
+        time.sleep(0.01)
+    reader = start(lambda: (lock.acquire_read(), order.append("reader"), lock.release_read()))
+    time.sleep(0.2)
+    # the new reader queues behind the writer instead of joining the active reader.
+    assert order == []
+    lock.release_read()
+    writer.join(timeout=5)
+    reader.join(timeout=5)
+    assert order == ["writer", "reader"]
+
+
+def test_reader_reenters_while_a_writer_waits():
+    lock = RWLock()
+    lock.acquire_read()
+    writer = start(lambda: (lock.acquire(), lock.release()))
+    while not lock._writers_waiting:
+        time.sleep(0.01)
+    # a nested read of the same thread must not wait for the writer, or it would deadlock.
+    lock.acquire_read()
+    lock.release_read()
+    lock.release_read()
+    writer.join(timeout=5)
+    assert not writer.is_alive()
+
+
+def test_writer_reenters_and_may_read():
+    lock = RWLock()
+    lock.acquire()
+    lock.acquire()
+    lock.acquire_read()
+    lock.release_read()
+    lock.release()
+    assert lock._writer == threading.get_ident()
+    lock.release()
+    assert lock._writer is None
+    reader = start(lambda: (lock.acquire_read(), lock.release_read()))
+    reader.join(timeout=5)
+    assert not reader.is_alive()
+
+
+def test_writer_excludes_readers():
+    lock = RWLock()
+    entered = threading.Event()
+    lock.acquire()
+    reader = start(lambda: (lock.acquire_read(), entered.set(), lock.release_read()))
+    assert not entered.wait(0.2)
+    lock.release()
+    assert entered.wait(5)
+    reader.join(timeout=5)
@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("fastchat")
+
+from WebUI.Server.knowledge_base.kb_cache.embedding_cache import EmbeddingCache
+
+# 64 float32 values, 256 bytes per vector.
+DIM = 64
+
+
+def vector(value: float):
+    return [value] * DIM
+
+
+def test_least_recently_used_vectors_are_evicted(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embedding_cache.db"), max_size_mb=1024 / 1024 / 1024)
+    for i, text in enumerate(["a", "b", "c", "d"]):
+        cache.set_many("m", False, [text], [vector(i)])
+    # "a" is read, so "b" and "c" are the least recently used ones.
+    assert cache.get_many("m", False, ["a"])[1] == []
+    cache.set_many("m", False, ["e"], [vector(4)])
+    # 5 vectors exceed the budget of 4, the cache is trimmed below 90% of it.
+    embeddings, missing = cache.get_many("m", False, ["a", "b", "c", "d", "e"])
+    assert missing == [1, 2]
+    assert embeddings[0] == vector(0)
+    stats = cache.stats()
+    assert stats["evictions"] == 2
+    assert stats["size_bytes"] == 3 * DIM * 4
+
+
+def test_size_is_kept_across_replacements_and_restarts(tmp_path):
+    path = str(tmp_path / "embedding_cache.db")
+    cache = EmbeddingCache(path=path)
+    cache.set_many("m", False, ["a", "b"], [vector(1), vector(2)])
+    cache.set_many("m", False, ["a"], [vector(3)])
+    assert cache.stats()["size_bytes"] == 2 * DIM * 4
+    assert EmbeddingCache(path=path).stats()["size_bytes"] == 2 * DIM * 4
+
+
+def test_keys_depend_on_model_and_query_flag(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embedding_cache.db"))
+    cache.set_many("m", False, [" text "], [vector(1)])
+    assert cache.get_many("m", False, ["text"])[1] == []
+    assert cache.get_many("m", True, ["text"])[1] == [0]
+    assert cache.get_many("other", False, ["text"])[1] == [0]
+    cache.clear("m")
+    assert cache.stats()["size_bytes"] == 0
@@ -0,0 +1,103 @@
+import os
+import pytest
+
+pytest.importorskip("langchain")
+
+from WebUI.Server.knowledge_base.kb_cache import faiss_cache
+from WebUI.Server.knowledge_base.kb_cache.faiss_cache import KBFaissPool, ThreadSafeFaiss
+
+
+class FakeStore:
+    '''
+    writes its value into index.faiss and index.pkl, fail_after makes it crash after the first file.
+    '''
+    def __init__(self, value: str, fail_after: bool = False):
+        self.value = value
+        self.fail_after = fail_after
+
+    def save_local(self, path: str, index_name: str = "index"):
+        for ext in ["faiss", "pkl"]:
+            with open(os.path.join(path, f"{index_name}.{ext}"), "w") as file:
+                file.write(self.value)
+            if self.fail_after:
+                raise RuntimeError("disk full")
+
+
+def saved_value(path: str) -> str:
+    with open(os.path.join(faiss_cache.get_vs_index_path(path), "index.faiss")) as faiss_file, \
+            open(os.path.join(faiss_cache.get_vs_index_path(path), "index.pkl")) as pkl_file:
+        value = faiss_file.read()
+        assert pkl_file.read() == value
+        return value
+
+
+@pytest.fixture
+def vs_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_cache, "get_vs_path", lambda kb_name, vector_name: str(tmp_path / kb_name / vector_name))
+    return tmp_path
+
+
+def test_evicted_store_changed_through_a_held_reference_is_flushed(vs_root):
+    pool = KBFaissPool(cache_num=1, flush_interval=3600)
+    first = pool.set(("kb1", "m"), ThreadSafeFaiss(("kb1", "m"), obj=FakeStore("1"), pool=pool))
+    pool.set(("kb2", "m"), ThreadSafeFaiss(("kb2", "m"), obj=FakeStore("2"), pool=pool))
+    assert pool.keys() == [("kb2", "m")]
+    # a writer that loaded kb1 before the eviction changes it afterwards.
+    first.obj.value = "changed"
+    pool.schedule_save(first, str(vs_root / "kb1" / "m"))
+    pool.flush()
+    assert saved_value(str(vs_root / "kb1" / "m")) == "changed"
+    assert not first.dirty
+    assert pool._evicted_dirty == {}
+
+
+def test_finished_eviction_save_is_forgotten(vs_root):
+    pool = KBFaissPool(cache_num=1, flush_interval=3600)
+    first = pool.set(("kb1", "m"), ThreadSafeFaiss(("kb1", "m"), obj=FakeStore("1"), pool=pool))
+    first.mark_dirty()
+    pool.set(("kb2", "m"), ThreadSafeFaiss(("kb2", "m"), obj=FakeStore("2"), pool=pool))
+    thread = pool._pending_saves[("kb1", "m")]
+    thread.join()
+    assert saved_value(str(vs_root / "kb1" / "m")) == "1"
+    assert pool._pending_saves == {}
+    assert pool._evicted_dirty == {}
+
+
+def test_save_switches_the_manifest_and_keeps_one_previous_version(tmp_path):
+    path = str(tmp_path / "vs")
+    for value in ["1", "2", "3"]:
+        faiss_cache.save_vector_store_atomic(FakeStore(value), path)
+        assert saved_value(path) == value
+    versions = [name for name in os.listdir(path) if name.startswith("v")]
+    assert len(versions) == 2
+    assert not [name for name in os.listdir(path) if name.startswith(".saving-")]
+
+
+@pytest.mark.parametrize("crash", ["save_local", "manifest"])
+def test_crash_while_saving_keeps_the_previous_pair(tmp_path, monkeypatch, crash):
+    path = str(tmp_path / "vs")
+    faiss_cache.save_vector_store_atomic(FakeStore("1"), path)
+    store = FakeStore("2", fail_after=crash == "save_local")
+    if crash == "manifest":
+        def write_json_atomic(*args):
+            raise RuntimeError("killed")
+        monkeypatch.setattr(faiss_cache, "write_json_atomic", write_json_atomic)
+    with pytest.raises(RuntimeError):
+        faiss_cache.save_vector_store_atomic(store, path)
+    assert saved_value(path) == "1"
+    assert not [name for name in os.listdir(path) if name.startswith(".saving-")]
+    # the next save goes through and drops the orphaned version.
+    monkeypatch.undo()
+    faiss_cache.save_vector_store_atomic(FakeStore("3"), path)
+    assert saved_value(path) == "3"
+    assert len([name for name in os.listdir(path) if name.startswith("v")]) == 2
+
+
+def test_store_saved_before_versioned_folders_is_migrated(tmp_path):
+    path = str(tmp_path / "vs")
+    os.makedirs(path)
+    FakeStore("old").save_local(path)
+    assert faiss_cache.get_vs_index_path(path) == path
+    faiss_cache.save_vector_store_atomic(FakeStore("new"), path)
+    assert saved_value(path) == "new"
+    assert not os.path.exists(os.path.join(path, "index.faiss"))
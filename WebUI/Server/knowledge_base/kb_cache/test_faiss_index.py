@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain")
+faiss = pytest.importorskip("faiss")
+
+from WebUI.Server.knowledge_base.kb_cache import faiss_index
+from WebUI.Server.knowledge_base.kb_cache.faiss_index import delete_from_ivf
+
+
+class FakeDocstore:
+    def __init__(self, ids):
+        self._dict = {id: id for id in ids}
+
+    def delete(self, ids):
+        for id in ids:
+            del self._dict[id]
+
+
+class FakeStore:
+    def __init__(self, index, ids):
+        self.index = index
+        self.docstore = FakeDocstore(ids)
+        self.index_to_docstore_id = dict(enumerate(ids))
+
+
+@pytest.fixture(autouse=True)
+def real_faiss(monkeypatch):
+    monkeypatch.setattr(faiss_index, "dependable_faiss_import", lambda: faiss)
+
+
+def make_store(description: str, count: int = 1000, dim: int = 16):
+    vectors = np.random.default_rng(0).random((count, dim)).astype(np.float32)
+    index = faiss.index_factory(dim, description, faiss.METRIC_L2)
+    index.train(vectors)
+    index.add(vectors)
+    index.nprobe = index.nlist
+    return FakeStore(index, [f"id{i}" for i in range(count)]), vectors
+
+
+def search_ids(vs, vectors, k: int = 5):
+    distances, labels = vs.index.search(vectors, k)
+    return [[vs.index_to_docstore_id[label] for label in row if label != -1] for row in labels], distances
+
+
+@pytest.mark.parametrize("description", ["IVF8,PQ4x8", "IVF8,Flat"])
+def test_ivf_delete_keeps_codes_and_renumbers_labels(description):
+    vs, vectors = make_store(description)
+    ids_before, distances_before = search_ids(vs, vectors[3:10])
+    delete_from_ivf(vs, ["id0", "id1", "id2", "id500"])
+    assert vs.index.ntotal == 996
+    assert sorted(vs.index_to_docstore_id) == list(range(996))
+    assert "id500" not in vs.docstore._dict
+    ids_after, distances_after = search_ids(vs, vectors[3:10])
+    removed = {"id0", "id1", "id2", "id500"}
+    for before, after, row_before, row_after in zip(ids_before, ids_after, distances_before, distances_after):
+        # the remaining vectors keep their codes, so hits and distances don't change.
+        kept = [(id, d) for id, d in zip(before, row_before) if id not in removed]
+        assert list(zip(after, row_after))[:len(kept)] == kept
+    # a vector added afterwards gets a label of its own.
+    vs.index.add(vectors[:1])
+    vs.index_to_docstore_id[996] = "new"
+    assert search_ids(vs, vectors[:1], k=1)[0] == [["new"]]
+
+
+def test_ivf_delete_rebuilds_a_direct_map():
+    vs, vectors = make_store("IVF8,Flat")
+    vs.index.make_direct_map()
+    delete_from_ivf(vs, ["id0"])
+    assert np.array_equal(vs.index.reconstruct(0), vectors[1])
@@ -6,10 +6,12 @@ from sse_starlette import EventSourceResponse
 from fastapi.responses import FileResponse
 from fastapi import File, Form, Body, Query, UploadFile
 from WebUI.Server.utils import BaseResponse, ListResponse, run_in_thread_pool
-from WebUI.Server.knowledge_base.utils import (validate_kb_name, get_file_path, list_files_from_folder, files2docs_in_thread, KnowledgeFile)
-from WebUI.Server.db.repository.knowledge_file_repository import get_file_detail
+from WebUI.Server.knowledge_base.utils import (validate_kb_name, get_file_path, list_files_from_folder, KnowledgeFile)
+from WebUI.Server.db.repository.knowledge_file_repository import (get_file_detail, list_file_fingerprints_from_db,
+                                                                  update_file_fingerprints_in_db)
 from WebUI.Server.knowledge_base.kb_service.base import KBServiceFactory
-from WebUI.Server.knowledge_base.utils import (CHUNK_SIZE, OVERLAP_SIZE, ZH_TITLE_ENHANCE, SCORE_THRESHOLD)
+from WebUI.Server.knowledge_base.ingest_pipeline import IngestPipeline
+from WebUI.Server.knowledge_base.utils import (CHUNK_SIZE, OVERLAP_SIZE, ZH_TITLE_ENHANCE, SCORE_THRESHOLD, SUPPORTED_EXTS)
 from WebUI.Server.knowledge_base.model.kb_document_model import DocumentWithVSId
 from langchain.docstore.document import Document
 from typing import List, Dict
@@ -93,17 +95,40 @@ def search_docs(
                                       description="Knowledge base matching relevance threshold, with a range between 0 and 1. A smaller SCORE indicates higher relevance, and setting it to 1 is equivalent to no filtering. It is recommended to set it around 0.5"),
         file_name: str = Body("", description="file name"),
         metadata: dict = Body({}, description=""),
+        nprobe: int = Body(0, description="IVF index only: clusters scanned per query, 0 uses the knowledge base config"),
+        ef_search: int = Body(0, description="HNSW index only: search beam width, 0 uses the knowledge base config"),
 ) -> List[DocumentWithVSId]:
     kb = KBServiceFactory.get_service_by_name(knowledge_base_name)
     data = []
     if kb is not None:
         if query:
-            docs = kb.search_docs(query, top_k, score_threshold)
+            # in-process callers leave these as Body defaults.
+            search_kwargs = {k: v for k, v in {"nprobe": nprobe, "ef_search": ef_search}.items()
+                             if isinstance(v, int) and v > 0}
+            docs = kb.search_docs(query, top_k, score_threshold, **search_kwargs)
             data = [DocumentWithVSId(**x[0].dict(), score=x[1], id=x[0].metadata.get("id")) for x in docs]
         elif file_name or metadata:
             data = kb.list_docs(file_name=file_name, metadata=metadata)
     return data
 
+def search_docs_batch(
+        queries: List[str] = Body(..., description="User inputs", examples=[["chat", "knowledge base"]]),
+        knowledge_base_name: str = Body(..., description="Knowledge base name", examples=["samples"]),
+        top_k: int = Body(3, description="Vector count for each query"),
+        score_threshold: float = Body(SCORE_THRESHOLD, description="Knowledge base matching relevance threshold, same as search_docs"),
+        nprobe: int = Body(0, description="IVF index only: clusters scanned per query, 0 uses the knowledge base config"),
+        ef_search: int = Body(0, description="HNSW index only: search beam width, 0 uses the knowledge base config"),
+) -> List[List[DocumentWithVSId]]:
+    # the results are in the same order as queries, an unknown knowledge base gives no results at all.
+    kb = KBServiceFactory.get_service_by_name(knowledge_base_name)
+    if kb is None or not queries:
+        return []
+    search_kwargs = {k: v for k, v in {"nprobe": nprobe, "ef_search": ef_search}.items()
+                     if isinstance(v, int) and v > 0}
+    results = kb.search_docs_batch(queries, top_k, score_threshold, **search_kwargs)
+    return [[DocumentWithVSId(**x[0].dict(), score=x[1], id=x[0].metadata.get("id")) for x in docs]
+            for docs in results]
+
 def update_docs(
         knowledge_base_name: str = Body(..., description="Knowledge base name", examples=["samples"]),
         file_names: List[str] = Body(..., description="file name, support multiple files", examples=[["file_name1", "text.txt"]]),
@@ -137,19 +162,13 @@ def update_docs(
                 msg = f"load doc '{file_name}' failed: {e}"
                 failed_files[file_name] = msg
 
-    for status, result in files2docs_in_thread(kb_files,
-                                               chunk_size=chunk_size,
-                                               chunk_overlap=chunk_overlap,
-                                               zh_title_enhance=zh_title_enhance):
-        if status:
-            kb_name, file_name, new_docs = result
-            kb_file = KnowledgeFile(filename=file_name,
-                                    knowledge_base_name=knowledge_base_name)
-            kb_file.splited_docs = new_docs
-            kb.update_doc(kb_file, not_refresh_vs_cache=True)
-        else:
-            kb_name, file_name, error = result
-            failed_files[file_name] = error
+    pipeline = IngestPipeline(kb,
+                              chunk_size=chunk_size,
+                              chunk_overlap=chunk_overlap,
+                              zh_title_enhance=zh_title_enhance)
+    for event in pipeline.run(kb_files):
+        if event["code"] != 200:
+            failed_files[event["doc"]] = event["msg"]
 
     for file_name, v in docs.items():
         try:
@@ -305,32 +324,93 @@ def recreate_vector_store(
             kb.create_kb()
             files = list_files_from_folder(knowledge_base_name)
             kb_files = [(file, knowledge_base_name) for file in files]
-            i = 0
-            for status, result in files2docs_in_thread(kb_files,
-                                                       chunk_size=chunk_size,
-                                                       chunk_overlap=chunk_overlap,
-                                                       zh_title_enhance=zh_title_enhance):
-                if status:
-                    kb_name, file_name, docs = result
-                    kb_file = KnowledgeFile(filename=file_name, knowledge_base_name=kb_name)
-                    kb_file.splited_docs = docs
-                    yield json.dumps({
-                        "code": 200,
-                        "msg": f"({i + 1} / {len(files)}): {file_name}",
-                        "total": len(files),
-                        "finished": i + 1,
-                        "doc": file_name,
-                    }, ensure_ascii=False)
-                    kb.add_doc(kb_file, not_refresh_vs_cache=True)
-                else:
-                    kb_name, file_name, error = result
-                    msg = f"add file '{file_name}' to knowledge base '{knowledge_base_name}' error: {error}. skip."
-                    yield json.dumps({
-                        "code": 500,
-                        "msg": msg,
-                    })
-                i += 1
+            pipeline = IngestPipeline(kb,
+                                      chunk_size=chunk_size,
+                                      chunk_overlap=chunk_overlap,
+                                      zh_title_enhance=zh_title_enhance)
+            for event in pipeline.run(kb_files):
+                yield json.dumps(event, ensure_ascii=False)
             if not not_refresh_vs_cache:
                 kb.save_vector_store()
 
-    return EventSourceResponse(output())
\ No newline at end of file
+    return EventSourceResponse(output())
+
+
+def sync_knowledge_base(
+        knowledge_base_name: str = Body(..., examples=["samples"]),
+        chunk_size: int = Body(CHUNK_SIZE, description="Chunk size"),
+        chunk_overlap: int = Body(OVERLAP_SIZE, description="Overlap size"),
+        zh_title_enhance: bool = Body(ZH_TITLE_ENHANCE, description="zh title enhance"),
+        not_refresh_vs_cache: bool = Body(False, description=""),
+):
+    """
+    bring the vector store in line with the content folder without rebuilding it.
+    a file is re-ingested only if it is new, or its mtime/size changed and so did its content hash.
+    files gone from the folder are deleted, files with custom docs are left alone.
+    """
+
+    def output():
+        if not validate_kb_name(knowledge_base_name):
+            yield json.dumps({"code": 403, "msg": "Don't attack me"})
+            return
+        kb = KBServiceFactory.get_service_by_name(knowledge_base_name)
+        if kb is None:
+            yield json.dumps({"code": 404, "msg": f"Not found Knowledge base '{knowledge_base_name}'"})
+            return
+
+        fingerprints = list_file_fingerprints_from_db(knowledge_base_name)
+        added, changed, touched = [], [], {}
+        folder_files = set()
+        for file_name in list_files_from_folder(knowledge_base_name):
+            # a file still in the folder is never deleted, even if its extension is no longer supported.
+            folder_files.add(file_name)
+            if os.path.splitext(file_name)[-1].lower() not in SUPPORTED_EXTS:
+                continue
+            stored = fingerprints.get(file_name)
+            if stored is None:
+                added.append(file_name)
+                continue
+            if stored["custom_docs"]:
+                continue
+            kb_file = KnowledgeFile(filename=file_name, knowledge_base_name=knowledge_base_name)
+            mtime, size = kb_file.get_mtime(), kb_file.get_size()
+            if mtime == stored["file_mtime"] and size == stored["file_size"]:
+                continue
+            if size == stored["file_size"] and stored["file_hash"] and kb_file.get_hash() == stored["file_hash"]:
+                touched[file_name] = (mtime, size)
+            else:
+                changed.append(file_name)
+        deleted = [file_name for file_name, stored in fingerprints.items()
+                   if file_name not in folder_files and not stored["custom_docs"]]
+        update_file_fingerprints_in_db(knowledge_base_name, touched)
+
+        yield json.dumps({
+            "code": 200,
+            "msg": f"sync '{knowledge_base_name}': {len(added)} added, {len(changed)} changed, {len(deleted)} deleted.",
+            "added": added,
+            "changed": changed,
+            "deleted": deleted,
+            "unchanged": len(fingerprints) - len(changed) - len(deleted),
+        }, ensure_ascii=False)
+
+        for file_name in deleted:
+            try:
+                kb.delete_doc(KnowledgeFile(filename=file_name, knowledge_base_name=knowledge_base_name),
+                              not_refresh_vs_cache=True)
+                yield json.dumps({"code": 200, "msg": f"delete file '{file_name}'", "doc": file_name}, ensure_ascii=False)
+            except Exception as e:
+                yield json.dumps({"code": 500, "msg": f"The file '{file_name}' delete failed, error: {e}", "doc": file_name},
+                                 ensure_ascii=False)
+
+        if added or changed:
+            pipeline = IngestPipeline(kb,
+                                      chunk_size=chunk_size,
+                                      chunk_overlap=chunk_overlap,
+                                      zh_title_enhance=zh_title_enhance)
+            for event in pipeline.run([(file_name, knowledge_base_name) for file_name in added + changed]):
+                yield json.dumps(event, ensure_ascii=False)
+
+        if not not_refresh_vs_cache and (added or changed or deleted):
+            kb.save_vector_store()
+
+    return EventSourceResponse(output())
@@ -14,13 +14,14 @@ from WebUI.Server.db.repository.knowledge_base_repository import (
     load_kb_from_db, get_kb_detail,
 )
 from WebUI.Server.db.repository.knowledge_file_repository import (
-    add_file_to_db, delete_file_from_db, delete_files_from_db, file_exists_in_db,
+    add_file_to_db, add_files_to_db, delete_file_from_db, delete_files_from_db, file_exists_in_db,
     count_files_from_db, list_files_from_db, get_file_detail, list_docs_from_db,
 )
 from WebUI.Server.knowledge_base.model.kb_document_model import DocumentWithVSId
-from WebUI.Server.embeddings_api import embed_texts, aembed_texts, embed_documents
+from WebUI.Server.embeddings_api import (embed_texts, aembed_texts, embed_documents,
+                                        embed_query_batched, aembed_query_batched)
 
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Tuple
 
 def normalize(embeddings: List[List[float]]) -> np.ndarray:
     norm = np.linalg.norm(embeddings, axis=1)
@@ -94,14 +95,7 @@ class KBService(ABC):
             custom_docs = False
 
         if docs:
-            for doc in docs:
-                try:
-                    source = doc.metadata.get("source", "")
-                    if os.path.isabs(source):
-                        rel_path = Path(source).relative_to(self.doc_path)
-                        doc.metadata["source"] = str(rel_path.as_posix().strip("/"))
-                except Exception as e:
-                    print(f"cannot convert absolute path ({source}) to relative path. error is : {e}")
+            self.relative_sources(docs)
             self.delete_doc(kb_file)
             doc_infos = self.do_add_doc(docs, **kwargs)
             status = add_file_to_db(kb_file,
@@ -112,6 +106,42 @@ class KBService(ABC):
             status = False
         return status
 
+    def relative_sources(self, docs: List[Document]):
+        for doc in docs:
+            try:
+                source = doc.metadata.get("source", "")
+                if os.path.isabs(source):
+                    rel_path = Path(source).relative_to(self.doc_path)
+                    doc.metadata["source"] = str(rel_path.as_posix().strip("/"))
+            except Exception as e:
+                print(f"cannot convert absolute path ({source}) to relative path. error is : {e}")
+
+    def add_docs_batch(self, files: List[Tuple], data: Dict = None, **kwargs):
+        '''
+        add the split docs of many files with one vector store insert and one DB transaction.
+        files: [(kb_file, docs) or (kb_file, docs, append[, complete]), ...], append adds to the docs the file
+        already has instead of replacing them, complete is False while more parts of the file are to come.
+        data is the output of _docs_to_embeddings for all docs in order, it is computed here if not given.
+        '''
+        files = [(f[0], f[1], len(f) > 2 and f[2], len(f) <= 3 or f[3]) for f in files]
+        # an empty last part still completes its file.
+        files = [f for f in files if f[1] or (f[2] and f[3])]
+        if not files:
+            return False
+        docs = [doc for _, file_docs, _, _ in files for doc in file_docs]
+        if data is None:
+            self.relative_sources(docs)
+        replaced_files = [kb_file for kb_file, _, append, _ in files if not append]
+        if replaced_files:
+            self.do_delete_docs(replaced_files, not_refresh_vs_cache=True)
+        doc_infos = self.do_add_embeddings(docs, data, **kwargs) if docs else []
+        files_infos = []
+        start = 0
+        for kb_file, file_docs, append, complete in files:
+            files_infos.append((kb_file, doc_infos[start:start + len(file_docs)], append, complete))
+            start += len(file_docs)
+        return add_files_to_db(files_infos)
+
     def delete_doc(self, kb_file: KnowledgeFile, delete_content: bool = False, **kwargs):
         """
         delete doc from kb.
@@ -149,10 +179,24 @@ class KBService(ABC):
                     query: str,
                     top_k: int = 3,
                     score_threshold: float = SCORE_THRESHOLD,
+                    **kwargs,
                     ) ->List[Document]:
-        docs = self.do_search(query, top_k, score_threshold)
+        docs = self.do_search(query, top_k, score_threshold, **kwargs)
         return docs
 
+    def search_docs_batch(self,
+                          queries: List[str],
+                          top_k: int = 3,
+                          score_threshold: float = SCORE_THRESHOLD,
+                          **kwargs,
+                          ) -> List[List[Document]]:
+        '''
+        search many queries at once, return the hits of each query in the same order.
+        '''
+        if not queries:
+            return []
+        return self.do_search_batch(queries, top_k, score_threshold, **kwargs)
+
     def get_doc_by_ids(self, ids: List[str]) -> List[Document]:
         return []
 
@@ -219,9 +263,19 @@ class KBService(ABC):
                   query: str,
                   top_k: int,
                   score_threshold: float,
+                  **kwargs,
                   ) -> List[Document]:
         pass
 
+    def do_search_batch(self,
+                        queries: List[str],
+                        top_k: int,
+                        score_threshold: float,
+                        **kwargs,
+                        ) -> List[List[Document]]:
+        # vector stores without a matrix search fall back to one search per query.
+        return [self.do_search(query, top_k, score_threshold, **kwargs) for query in queries]
+
     @abstractmethod
     def do_add_doc(self,
                    docs: List[Document],
@@ -229,11 +283,26 @@ class KBService(ABC):
                    ) -> List[Dict]:
         pass
 
+    def do_add_embeddings(self,
+                          docs: List[Document],
+                          data: Dict = None,
+                          **kwargs,
+                          ) -> List[Dict]:
+        # vector stores that can not take precomputed embeddings embed again, mostly from the embedding cache.
+        return self.do_add_doc(docs, **kwargs)
+
     @abstractmethod
     def do_delete_doc(self,
                       kb_file: KnowledgeFile):
         pass
 
+    def do_delete_docs(self,
+                       kb_files: List[KnowledgeFile],
+                       **kwargs):
+        # vector stores without a batched delete fall back to one delete per file.
+        for kb_file in kb_files:
+            self.do_delete_doc(kb_file, **kwargs)
+
     @abstractmethod
     def do_clear_vs(self):
         pass
@@ -366,18 +435,22 @@ class EmbeddingsFunAdapter(Embeddings):
         return normalize(embeddings).tolist()
 
     def embed_query(self, text: str) -> List[float]:
-        embeddings = embed_texts(texts=[text], embed_model=self.embed_model, to_query=True).data
+        embeddings = embed_query_batched(text=text, embed_model=self.embed_model).data
         query_embed = embeddings[0]
         query_embed_2d = np.reshape(query_embed, (1, -1))
         normalized_query_embed = normalize(query_embed_2d)
         return normalized_query_embed[0].tolist()
 
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        embeddings = embed_texts(texts=texts, embed_model=self.embed_model, to_query=True).data
+        return normalize(embeddings).tolist()
+
     async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
         embeddings = (await aembed_texts(texts=texts, embed_model=self.embed_model, to_query=False)).data
         return normalize(embeddings).tolist()
 
     async def aembed_query(self, text: str) -> List[float]:
-        embeddings = (await aembed_texts(texts=[text], embed_model=self.embed_model, to_query=True)).data
+        embeddings = (await aembed_query_batched(text=text, embed_model=self.embed_model)).data
         query_embed = embeddings[0]
         query_embed_2d = np.reshape(query_embed, (1, -1))
         normalized_query_embed = normalize(query_embed_2d)
@@ -2,7 +2,11 @@ import os
 import shutil
 from typing import List, Dict
 from WebUI.Server.knowledge_base.kb_service.base import KBService, SupportedVSType, EmbeddingsFunAdapter
-from WebUI.Server.knowledge_base.kb_cache.faiss_cache import kb_faiss_pool, ThreadSafeFaiss
+from WebUI.Server.knowledge_base.kb_cache.faiss_cache import (kb_faiss_pool, ThreadSafeFaiss, get_ids_by_source,
+                                                              add_to_source_index, delete_from_vector_store,
+                                                              estimate_docs_bytes)
+from WebUI.Server.knowledge_base.kb_cache.faiss_index import (get_faiss_index_config, need_convert, convert_index,
+                                                              is_flat_index, make_search_params, search_with_params)
 from WebUI.Server.knowledge_base.utils import KnowledgeFile, get_kb_path, get_vs_path
 from WebUI.Server.utils import torch_gc
 from langchain.docstore.document import Document
@@ -28,15 +32,23 @@ class FaissKBService(KBService):
                                                embed_model=self.embed_model)
 
     def save_vector_store(self):
-        self.load_vector_store().save(self.vs_path)
+        vector_store = self.load_vector_store()
+        if vector_store.dirty:
+            vector_store.save(self.vs_path)
 
     def get_doc_by_ids(self, ids: List[str]) -> List[Document]:
-        with self.load_vector_store().acquire() as vs:
+        with self.load_vector_store().acquire_read() as vs:
             return [vs.docstore._dict.get(id) for id in ids]
 
     def del_doc_by_ids(self, ids: List[str]) -> bool:
-        with self.load_vector_store().acquire() as vs:
-            vs.delete(ids)
+        vector_store = self.load_vector_store()
+        with vector_store.acquire() as vs:
+            removed_bytes = estimate_docs_bytes(vs, ids)
+            delete_from_vector_store(vs, ids)
+            vector_store.mark_dirty()
+        kb_faiss_pool.schedule_save(vector_store, self.vs_path)
+        kb_faiss_pool.resize(vector_store, -removed_bytes)
+        return True
 
     def do_init(self):
         self.vector_name = self.vector_name or self.embed_model
@@ -59,25 +71,76 @@ class FaissKBService(KBService):
                   query: str,
                   top_k: int,
                   score_threshold: float = SCORE_THRESHOLD,
+                  nprobe: int = 0,
+                  ef_search: int = 0,
+                  **kwargs,
                   ) -> List[Document]:
         embed_func = EmbeddingsFunAdapter(self.embed_model)
         embeddings = embed_func.embed_query(query)
-        with self.load_vector_store().acquire() as vs:
-            docs = vs.similarity_search_with_score_by_vector(embeddings, k=top_k, score_threshold=score_threshold)
+        with self.load_vector_store().acquire_read() as vs:
+            if is_flat_index(vs.index):
+                docs = vs.similarity_search_with_score_by_vector(embeddings, k=top_k, score_threshold=score_threshold)
+            else:
+                params = make_search_params(vs.index, get_faiss_index_config(self.kb_name), nprobe, ef_search)
+                docs = search_with_params(vs, [embeddings], top_k, score_threshold, params)[0]
         return docs
 
+    def do_search_batch(self,
+                        queries: List[str],
+                        top_k: int,
+                        score_threshold: float = SCORE_THRESHOLD,
+                        nprobe: int = 0,
+                        ef_search: int = 0,
+                        **kwargs,
+                        ) -> List[List[Document]]:
+        # one embedding call for all queries and one matrix search against the index.
+        embed_func = EmbeddingsFunAdapter(self.embed_model)
+        embeddings = embed_func.embed_queries(queries)
+        with self.load_vector_store().acquire_read() as vs:
+            params = None
+            if not is_flat_index(vs.index):
+                params = make_search_params(vs.index, get_faiss_index_config(self.kb_name), nprobe, ef_search)
+            return search_with_params(vs, embeddings, top_k, score_threshold, params)
+
+    def convert_index_if_needed(self, vector_store: ThreadSafeFaiss):
+        '''
+        switch the store to the configured ANN index once it is big enough, on a copy so searches go on.
+        '''
+        config = get_faiss_index_config(self.kb_name)
+        with vector_store.acquire_read() as vs:
+            if not need_convert(vs, config):
+                return
+        with vector_store.acquire_copy(msg="Convert index") as vs:
+            if need_convert(vs, config):
+                convert_index(vs, config)
+                vector_store.mark_dirty()
+
     def do_add_doc(self,
                    docs: List[Document],
                    **kwargs,
                    ) -> List[Dict]:
-        data = self._docs_to_embeddings(docs)
-
-        with self.load_vector_store().acquire() as vs:
+        return self.do_add_embeddings(docs, self._docs_to_embeddings(docs), **kwargs)
+
+    def do_add_embeddings(self,
+                          docs: List[Document],
+                          data: Dict = None,
+                          **kwargs,
+                          ) -> List[Dict]:
+        if data is None:
+            data = self._docs_to_embeddings(docs)
+
+        vector_store = self.load_vector_store()
+        with vector_store.acquire() as vs:
             ids = vs.add_embeddings(text_embeddings=zip(data["texts"], data["embeddings"]),
                                     metadatas=data["metadatas"],
                                     ids=kwargs.get("ids"))
-            if not kwargs.get("not_refresh_vs_cache"):
-                vs.save_local(self.vs_path)
+            add_to_source_index(vs, ids, data["metadatas"])
+            added_bytes = estimate_docs_bytes(vs, ids)
+            vector_store.mark_dirty()
+        self.convert_index_if_needed(vector_store)
+        if not kwargs.get("not_refresh_vs_cache"):
+            kb_faiss_pool.schedule_save(vector_store, self.vs_path)
+        kb_faiss_pool.resize(vector_store, added_bytes)
         doc_infos = [{"id": id, "metadata": doc.metadata} for id, doc in zip(ids, docs)]
         torch_gc()
         return doc_infos
@@ -85,17 +148,35 @@ class FaissKBService(KBService):
     def do_delete_doc(self,
                       kb_file: KnowledgeFile,
                       **kwargs):
-        with self.load_vector_store().acquire() as vs:
-            ids = [k for k, v in vs.docstore._dict.items() if v.metadata.get("source").lower() == kb_file.filename.lower()]
-            if len(ids) > 0:
-                vs.delete(ids)
-            if not kwargs.get("not_refresh_vs_cache"):
-                vs.save_local(self.vs_path)
+        return self.do_delete_docs([kb_file], **kwargs)
+
+    def do_delete_docs(self,
+                       kb_files: List[KnowledgeFile],
+                       **kwargs):
+        # the ids of all files are removed in one call, an ANN index is rebuilt once instead of once per file.
+        vector_store = self.load_vector_store()
+        with vector_store.acquire_read() as vs:
+            ids = [id for kb_file in kb_files for id in get_ids_by_source(vs, kb_file.filename)]
+            flat = is_flat_index(vs.index)
+        removed_bytes = 0
+        if len(ids) > 0:
+            # a flat index removes ids in place, ANN indexes are changed on a copy so searches are not blocked.
+            with (vector_store.acquire() if flat else vector_store.acquire_copy()) as vs:
+                removed_bytes = estimate_docs_bytes(vs, ids)
+                delete_from_vector_store(vs, ids)
+                vector_store.mark_dirty()
+        if not kwargs.get("not_refresh_vs_cache") and vector_store.dirty:
+            kb_faiss_pool.schedule_save(vector_store, self.vs_path)
+        kb_faiss_pool.resize(vector_store, -removed_bytes)
         return ids
 
     def do_clear_vs(self):
         with kb_faiss_pool.atomic:
-            kb_faiss_pool.pop((self.kb_name, self.vector_name))
+            item = kb_faiss_pool.pop((self.kb_name, self.vector_name))
+        if item is not None:
+            # waits for a running background save, and keeps later flushes from writing it back.
+            with item.acquire():
+                item.dirty = False
         try:
             shutil.rmtree(self.vs_path)
         except Exception:
@@ -0,0 +1,116 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from WebUI.Server.knowledge_base import ingest_pipeline
+from WebUI.Server.knowledge_base.ingest_pipeline import IngestPipeline
+
+
+class FakeKnowledgeFile:
+    # pages of "<name>.pdf" are streamed, "bad-page-<n>" in a name makes page n fail to load.
+    def __init__(self, filename: str, knowledge_base_name: str):
+        self.filename = filename
+        self.kb_name = knowledge_base_name
+
+    def supports_streaming(self):
+        return self.filename.endswith(".pdf")
+
+    def iter_file2text(self, **kwargs):
+        for page in range(4):
+            if f"bad-page-{page}" in self.filename:
+                raise RuntimeError(f"page {page} can not be read")
+            yield [f"{self.filename}:{page}:{i}" for i in range(2)]
+
+
+class FakeKB:
+    '''
+    keeps the chunks and the DB row of every file like a real knowledge base would.
+    '''
+    embed_model = "fake"
+
+    def __init__(self, fail_embedding: str = "", fail_insert: str = ""):
+        self.fail_embedding = fail_embedding
+        self.fail_insert = fail_insert
+        self.chunks = {}
+        self.rows = {}
+
+    def relative_sources(self, docs):
+        pass
+
+    def _docs_to_embeddings(self, docs):
+        if self.fail_embedding and any(self.fail_embedding in doc for doc in docs):
+            raise RuntimeError("embedding failed")
+        return {"texts": list(docs), "embeddings": [[0.0]] * len(docs), "metadatas": [{}] * len(docs)}
+
+    def add_docs_batch(self, files, data, **kwargs):
+        assert len(data["texts"] if data else []) == sum(len(docs) for _, docs, _, _ in files)
+        if self.fail_insert and any(kb_file.filename == self.fail_insert for kb_file, _, _, _ in files):
+            for kb_file, _, append, _ in files:
+                if not append:
+                    self.chunks.pop(kb_file.filename, None)
+            raise RuntimeError("insert failed")
+        for kb_file, docs, append, complete in files:
+            if not append:
+                self.chunks[kb_file.filename] = []
+            self.chunks.setdefault(kb_file.filename, []).extend(docs)
+            self.rows[kb_file.filename] = "fingerprint" if complete else ""
+        return True
+
+    def delete_doc(self, kb_file, **kwargs):
+        self.chunks.pop(kb_file.filename, None)
+        self.rows.pop(kb_file.filename, None)
+
+
+@pytest.fixture(autouse=True)
+def fake_environment(monkeypatch):
+    monkeypatch.setattr(ingest_pipeline, "KnowledgeFile", FakeKnowledgeFile)
+    monkeypatch.setattr(ingest_pipeline, "GetIngestPipelineConfig",
+                        lambda: {"embed_batch_size": 2, "queue_size": 2, "stream_pages": True, "stream_workers": 1})
+    monkeypatch.setattr(ingest_pipeline, "GetDocumentLoaderConfig", lambda: {"executor": "thread"})
+
+    def files2docs_in_thread(files, **kwargs):
+        for file_name, kb_name in files:
+            yield True, (kb_name, file_name, [f"{file_name}:{i}" for i in range(2)])
+    monkeypatch.setattr(ingest_pipeline, "files2docs_in_thread", files2docs_in_thread)
+
+
+def run(kb, files):
+    events = list(IngestPipeline(kb).run([(file_name, "samples") for file_name in files]))
+    return {event["doc"]: event["code"] for event in events}, events
+
+
+def test_all_files_are_ingested():
+    kb = FakeKB()
+    codes, events = run(kb, ["a.pdf", "b.txt"])
+    assert codes == {"a.pdf": 200, "b.txt": 200}
+    assert len(events) == 2
+    assert len(kb.chunks["a.pdf"]) == 8
+    assert kb.rows == {"a.pdf": "fingerprint", "b.txt": "fingerprint"}
+
+
+def test_page_load_failure_leaves_no_partial_file():
+    kb = FakeKB()
+    codes, events = run(kb, ["bad-page-2.pdf", "b.txt"])
+    assert codes == {"bad-page-2.pdf": 500, "b.txt": 200}
+    assert len(events) == 2
+    assert "bad-page-2.pdf" not in kb.chunks
+    assert "bad-page-2.pdf" not in kb.rows
+    assert kb.rows["b.txt"] == "fingerprint"
+
+
+def test_page_embedding_failure_leaves_no_partial_file():
+    kb = FakeKB(fail_embedding="a.pdf:3:")
+    codes, events = run(kb, ["a.pdf"])
+    assert codes == {"a.pdf": 500}
+    assert len(events) == 1
+    assert "a.pdf" not in kb.chunks
+    assert "a.pdf" not in kb.rows
+
+
+def test_insert_failure_is_reported_once_per_file():
+    kb = FakeKB(fail_insert="b.txt")
+    codes, events = run(kb, ["b.txt", "c.txt"])
+    assert codes["b.txt"] == 500
+    assert [event["doc"] for event in events].count("b.txt") == 1
+    assert "b.txt" not in kb.chunks
+    assert "b.txt" not in kb.rows
@@ -0,0 +1,52 @@
+import threading
+import time
+import pytest
+
+pytest.importorskip("langchain")
+
+from WebUI.Server.knowledge_base import utils
+from WebUI.Server.knowledge_base.utils import get_loader_pool, run_in_loader_process_pool
+
+
+def load_file(filename, kb_name, loader_kwargs, kwargs):
+    # runs in the loader processes, kwargs["sleep"] stands in for a slow or stuck loader.
+    time.sleep(kwargs.get("sleep", 0))
+    return True, (kb_name, filename, [filename])
+
+
+@pytest.fixture
+def loader_pool():
+    # start the workers before the timeouts are measured, spawning them can take a while.
+    pool = get_loader_pool(3)
+    pool.apply(load_file, ("warm-up", "samples", {}, {}))
+    yield pool
+    with utils._loader_pool_lock:
+        if utils._loader_pool is not None:
+            utils._loader_pool.terminate()
+            utils._loader_pool = None
+
+
+def test_timed_out_file_is_reported_and_the_rest_loads(loader_pool):
+    params = [("slow.txt", "samples", {}, {"sleep": 60}),
+              ("a.txt", "samples", {}, {}),
+              ("b.txt", "samples", {}, {}),
+              ("c.txt", "samples", {}, {})]
+    results = list(run_in_loader_process_pool(params, timeout=2, func=load_file))
+    status = {result[1][1]: result[0] for result in results}
+    assert status == {"slow.txt": False, "a.txt": True, "b.txt": True, "c.txt": True}
+    assert "timed out" in [result[1][2] for result in results if not result[0]][0]
+    # the pool with the stuck worker is replaced.
+    assert utils._loader_pool is not loader_pool
+
+
+def test_timeout_does_not_break_a_concurrent_ingest(loader_pool):
+    other_results = []
+    other = threading.Thread(target=lambda: other_results.extend(run_in_loader_process_pool(
+        [("b1.txt", "samples", {}, {"sleep": 3}), ("b2.txt", "samples", {}, {"sleep": 3})], func=load_file)))
+    other.start()
+    time.sleep(0.5)
+    results = list(run_in_loader_process_pool([("slow.txt", "samples", {}, {"sleep": 60})], timeout=1, func=load_file))
+    assert results[0][0] is False
+    other.join(timeout=30)
+    assert not other.is_alive()
+    assert sorted((status, result[1]) for status, result in other_results) == [(True, "b1.txt"), (True, "b2.txt")]
@@ -1,16 +1,22 @@
 
 import os
+import time
+import queue
 import chardet
+import hashlib
 import importlib
+import threading
+import multiprocessing
 from pathlib import Path
 from WebUI.text_splitter import zh_title_enhance as func_zh_title_enhance
 from WebUI.Server.document_loaders import RapidOCRPDFLoader, RapidOCRLoader
+from WebUI.Server.document_loaders.ocr import get_ocr_pool
 import langchain.document_loaders
 from langchain.docstore.document import Document
 from langchain.text_splitter import TextSplitter
-from WebUI.configs.basicconfig import (GetKbConfig, GetKbRootPath, GetTextSplitterDict)
+from WebUI.configs.basicconfig import (GetKbConfig, GetKbRootPath, GetTextSplitterDict, GetDocumentLoaderConfig)
 from WebUI.Server.utils import run_in_thread_pool, get_model_worker_config
-from typing import List, Union,Dict, Tuple, Generator
+from typing import List, Union,Dict, Tuple, Generator, Callable
 
 TEXT_SPLITTER_NAME = "ChineseRecursiveTextSplitter"
 CHUNK_SIZE = 500
@@ -46,6 +52,8 @@ LOADER_DICT = {"UnstructuredHTMLLoader": ['.html'],
                "UnstructuredFileLoader": ['.txt'],
                }
 SUPPORTED_EXTS = [ext for sublist in LOADER_DICT.values() for ext in sublist]
+# loaders whose lazy_load yields one Document per page.
+STREAMING_LOADERS = ["RapidOCRPDFLoader", "RapidOCRLoader"]
 
 def validate_kb_name(knowledge_base_id: str) -> bool:
     if "../" in knowledge_base_id:
@@ -313,6 +321,41 @@ class KnowledgeFile:
                                                 text_splitter=text_splitter)
         return self.splited_docs
 
+    def supports_streaming(self):
+        return self.document_loader_name in STREAMING_LOADERS
+
+    def iter_file2text(
+            self,
+            zh_title_enhance: bool = ZH_TITLE_ENHANCE,
+            chunk_size: int = CHUNK_SIZE,
+            chunk_overlap: int = OVERLAP_SIZE,
+            text_splitter: TextSplitter = None,
+    ) -> Generator[List[Document], None, None]:
+        '''
+        yield the split docs of one page at a time, each with its page number in metadata, so the
+        whole file is never held in memory. files without a page-by-page loader are yielded at once.
+        '''
+        if not self.supports_streaming():
+            yield self.file2text(zh_title_enhance=zh_title_enhance,
+                                 chunk_size=chunk_size,
+                                 chunk_overlap=chunk_overlap,
+                                 text_splitter=text_splitter)
+            return
+        print(f"{self.document_loader_name} used for {self.filepath}, page by page")
+        loader = get_loader(loader_name=self.document_loader_name,
+                            file_path=self.filepath,
+                            loader_kwargs=self.loader_kwargs)
+        if text_splitter is None:
+            text_splitter, self.text_splitter_name = make_text_splitter(splitter_name=self.text_splitter_name,
+                                                                        chunk_size=chunk_size,
+                                                                        chunk_overlap=chunk_overlap)
+        for doc in loader.lazy_load():
+            docs = text_splitter.split_documents([doc])
+            if zh_title_enhance:
+                docs = func_zh_title_enhance(docs)
+            if docs:
+                yield docs
+
     def file_exist(self):
         return os.path.isfile(self.filepath)
 
@@ -322,6 +365,144 @@ class KnowledgeFile:
     def get_size(self):
         return os.path.getsize(self.filepath)
 
+    def get_hash(self):
+        h = hashlib.sha256()
+        with open(self.filepath, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        return h.hexdigest()
+
+
+_loader_pool = None
+_loader_pool_lock = threading.RLock()
+# text splitters of this loader process, keyed by (splitter name, chunk size, overlap).
+_process_splitters: Dict[Tuple[str, int, int], Tuple[TextSplitter, str]] = {}
+
+
+def _get_process_splitter(splitter_name: str, chunk_size: int, chunk_overlap: int) -> Tuple[TextSplitter, str]:
+    key = (splitter_name, chunk_size, chunk_overlap)
+    if key not in _process_splitters:
+        _process_splitters[key] = make_text_splitter(splitter_name=splitter_name, chunk_size=chunk_size,
+                                                     chunk_overlap=chunk_overlap)
+    return _process_splitters[key]
+
+
+def _init_loader_process():
+    '''
+    runs once in every loader process, so the first file of each worker does not pay for the warm up.
+    '''
+    try:
+        _get_process_splitter(TEXT_SPLITTER_NAME, CHUNK_SIZE, OVERLAP_SIZE)
+        get_ocr_pool().warm_up()
+    except Exception as e:
+        print(f"loader process {os.getpid()}: warm up failed: {e}")
+
+
+def _file2text_in_process(filename: str, kb_name: str, loader_kwargs: Dict, kwargs: Dict) -> Tuple[bool, Tuple[str, str, List[Document]]]:
+    try:
+        file = KnowledgeFile(filename=filename, knowledge_base_name=kb_name, loader_kwargs=loader_kwargs)
+        if file.ext not in [".csv"]:
+            text_splitter, file.text_splitter_name = _get_process_splitter(file.text_splitter_name,
+                                                                           kwargs.get("chunk_size", CHUNK_SIZE),
+                                                                           kwargs.get("chunk_overlap", OVERLAP_SIZE))
+            kwargs = dict(kwargs, text_splitter=text_splitter)
+        return True, (kb_name, filename, file.file2text(**kwargs))
+    except Exception as e:
+        msg = f"from {kb_name}/{filename} load failed: {e}"
+        return False, (kb_name, filename, msg)
+
+
+def get_loader_pool(max_workers: int = 0):
+    '''
+    return the process pool of document loaders, started on first use with the spawn method.
+    '''
+    global _loader_pool
+    with _loader_pool_lock:
+        if _loader_pool is None:
+            processes = max_workers if max_workers and max_workers > 0 else (os.cpu_count() or 1)
+            _loader_pool = multiprocessing.get_context("spawn").Pool(processes=processes, initializer=_init_loader_process)
+            _loader_pool.max_workers = processes
+            # calls of run_in_loader_process_pool that have jobs on the pool.
+            _loader_pool.users = 0
+            _loader_pool.retired = False
+        return _loader_pool
+
+
+def _acquire_loader_pool(max_workers: int = 0):
+    with _loader_pool_lock:
+        pool = get_loader_pool(max_workers)
+        pool.users += 1
+        return pool
+
+
+def _release_loader_pool(pool, retire: bool = False):
+    '''
+    a worker of a retired pool is stuck in a file that timed out, the only way to get it back is to kill
+    the pool. New calls get a fresh pool at once, the old one is terminated when its last user is done,
+    so the jobs of other ingests that share it still complete.
+    '''
+    global _loader_pool
+    with _loader_pool_lock:
+        pool.users -= 1
+        if retire:
+            pool.retired = True
+            if _loader_pool is pool:
+                _loader_pool = None
+        terminate = pool.retired and pool.users <= 0
+    if terminate:
+        pool.terminate()
+
+
+def run_in_loader_process_pool(params: List[Tuple[str, str, Dict, Dict]], max_workers: int = 0,
+                               timeout: float = 0, func: Callable = None) -> Generator:
+    '''
+    run func (_file2text_in_process by default) for every (filename, kb_name, loader_kwargs, kwargs) in params
+    and yield the results as they complete. At most one file per worker is in flight, so each file gets its
+    own timeout from the moment it starts. A file that times out is reported as failed and the pool is replaced.
+    '''
+    func = func or _file2text_in_process
+    pool = _acquire_loader_pool(max_workers)
+    done = queue.Queue()
+    pending = list(params)
+    pending.reverse()
+    running = {}
+    timed_out = False
+
+    def submit():
+        filename, kb_name, loader_kwargs, kwargs = pending.pop()
+        key = (kb_name, filename)
+        pool.apply_async(func, (filename, kb_name, loader_kwargs, kwargs),
+                         callback=lambda result: done.put((key, result)),
+                         error_callback=lambda e: done.put((key, (False, (kb_name, filename, f"from {kb_name}/{filename} load failed: {e}")))))
+        running[key] = time.monotonic() + timeout if timeout and timeout > 0 else None
+
+    try:
+        while pending and len(running) < pool.max_workers:
+            submit()
+        while running:
+            deadlines = [d for d in running.values() if d is not None]
+            wait = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                key, result = done.get(timeout=wait)
+            except queue.Empty:
+                now = time.monotonic()
+                for key in [k for k, d in running.items() if d is not None and d <= now]:
+                    del running[key]
+                    timed_out = True
+                    yield False, (key[0], key[1], f"from {key[0]}/{key[1]} load failed: timed out after {timeout}s")
+                continue
+            if running.pop(key, False) is False:
+                continue
+            yield result
+            if pending and not timed_out:
+                submit()
+    finally:
+        _release_loader_pool(pool, retire=timed_out)
+    if timed_out and pending:
+        # the files that were still waiting go to a fresh pool.
+        pending.reverse()
+        yield from run_in_loader_process_pool(pending, max_workers, timeout, func)
+
 
 def files2docs_in_thread(
         files: List[Union[KnowledgeFile, Tuple[str, str], Dict]],
@@ -357,5 +538,16 @@ def files2docs_in_thread(
         except Exception as e:
             yield False, (kb_name, filename, str(e))
 
-    for result in run_in_thread_pool(func=file2docs, params=kwargs_list):
-        yield result
\ No newline at end of file
+    config = GetDocumentLoaderConfig()
+    if config.get("executor", "thread") == "process":
+        params = []
+        for kwargs in kwargs_list:
+            kwargs = dict(kwargs)
+            file = kwargs.pop("file")
+            params.append((file.filename, file.kb_name, file.loader_kwargs, kwargs))
+        yield from run_in_loader_process_pool(params,
+                                              max_workers=config.get("max_workers", 0),
+                                              timeout=config.get("file_timeout", 0))
+    else:
+        for result in run_in_thread_pool(func=file2docs, params=kwargs_list):
+            yield result
\ No newline at end of file
@@ -4,7 +4,7 @@ from WebUI.configs import HTTPX_DEFAULT_TIMEOUT
 from WebUI.Server.utils import (BaseResponse, fschat_controller_address, list_config_llm_models,
                           get_httpx_client, get_model_worker_config, get_vtot_worker_config, get_speech_worker_config,
                           get_image_recognition_worker_config, get_image_generation_worker_config,
-                          get_music_generation_worker_config)
+                          get_music_generation_worker_config, proxy_stream, NDJSON_MEDIA_TYPE)
 import json
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse, InnerJsonConfigAIGeneratorParse
 from WebUI.configs.basicconfig import (ModelType, ModelSize, ModelSubType, GetSizeName, GetSubTypeName)
@@ -100,33 +100,22 @@ async def chat_llm_model(
     
     controller_address = controller_address or fschat_controller_address()
     async def fake_json_streamer() -> AsyncIterable[str]:
-        import asyncio
-        with get_httpx_client() as client:
-            response = client.stream(
-                "POST",
-                url=controller_address + "/text_chat",
-                json={
-                    "query": query,
-                    "imagesdata": imagesdata,
-                    "audiosdata": audiosdata,
-                    "videosdata": videosdata,
-                    "imagesprompt": imagesprompt,
-                    "history": history,
-                    "stream": stream,
-                    "model_name": model_name,
-                    "speechmodel": speechmodel,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                    "prompt_name": prompt_name,
-                    },
-            )
-            with response as r:
-                for chunk in r.iter_text(None):
-                    if not chunk:
-                        continue
-                    yield chunk
-                    await asyncio.sleep(0.1)
-    return StreamingResponse(fake_json_streamer(), media_type="text/event-stream")
+        async for chunk in proxy_stream(controller_address, "/text_chat", json={
+            "query": query,
+            "imagesdata": imagesdata,
+            "audiosdata": audiosdata,
+            "videosdata": videosdata,
+            "imagesprompt": imagesprompt,
+            "history": history,
+            "stream": stream,
+            "model_name": model_name,
+            "speechmodel": speechmodel,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "prompt_name": prompt_name,
+            }):
+            yield chunk
+    return StreamingResponse(fake_json_streamer(), media_type=NDJSON_MEDIA_TYPE)
 
 async def llm_knowledge_base_chat(
     query: str = Body(..., description="User input: ", examples=["chat"]),
@@ -152,33 +141,22 @@ async def llm_knowledge_base_chat(
 ) -> StreamingResponse:
     controller_address = controller_address or fschat_controller_address()
     async def fake_json_streamer() -> AsyncIterable[str]:
-        import asyncio
-        with get_httpx_client() as client:
-            response = client.stream(
-                "POST",
-                url=controller_address + "/knowledge_base_chat",
-                json={
-                    "query": query,
-                    "knowledge_base_name": knowledge_base_name,
-                    "top_k": top_k,
-                    "score_threshold": score_threshold,
-                    "history": history,
-                    "stream": stream,
-                    "model_name": model_name,
-                    "imagesdata": imagesdata,
-                    "speechmodel": speechmodel,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                    "prompt_name": prompt_name,
-                    },
-            )
-            with response as r:
-                for chunk in r.iter_text(None):
-                    if not chunk:
-                        continue
-                    yield chunk
-                    await asyncio.sleep(0.1)
-    return StreamingResponse(fake_json_streamer(), media_type="text/event-stream")
+        async for chunk in proxy_stream(controller_address, "/knowledge_base_chat", json={
+            "query": query,
+            "knowledge_base_name": knowledge_base_name,
+            "top_k": top_k,
+            "score_threshold": score_threshold,
+            "history": history,
+            "stream": stream,
+            "model_name": model_name,
+            "imagesdata": imagesdata,
+            "speechmodel": speechmodel,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "prompt_name": prompt_name,
+            }):
+            yield chunk
+    return StreamingResponse(fake_json_streamer(), media_type=NDJSON_MEDIA_TYPE)
     
 def change_llm_model(
     model_name: str = Body(..., description="Change Model", examples=""),
@@ -279,15 +257,12 @@ def save_model_config(
                 code=500,
                 msg="failed to save model configration, error mtype!")
 
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             if mtype == ModelType.Online.value:
                 jsondata["ModelConfig"]["OnlineModel"][model_name].update(config)
             else:
                 jsondata["ModelConfig"]["LocalModel"][provider][msize][model_name].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save model configration!")
@@ -306,23 +281,13 @@ async def download_llm_model(
 ) -> StreamingResponse:
     controller_address = controller_address or fschat_controller_address()
     async def fake_json_streamer() -> AsyncIterable[str]:
-        import asyncio
-        with get_httpx_client() as client:
-            response = client.stream(
-                "POST",
-                url=controller_address + "/download_llm_model",
-                json={"model_name": model_name,
-                    "hugg_path": hugg_path,
-                    "local_path": local_path,
-                    },
-            )
-            with response as r:
-                for chunk in r.iter_text(None):
-                    if not chunk:
-                        continue
-                    yield chunk
-                    await asyncio.sleep(0.1)
-    return StreamingResponse(fake_json_streamer(), media_type="text/event-stream")
+        async for chunk in proxy_stream(controller_address, "/download_llm_model", json={
+            "model_name": model_name,
+            "hugg_path": hugg_path,
+            "local_path": local_path,
+            }):
+            yield chunk
+    return StreamingResponse(fake_json_streamer(), media_type=NDJSON_MEDIA_TYPE)
 
 # Voice Model
 
@@ -345,12 +310,9 @@ def save_voice_model_config(
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])    
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["ModelConfig"]["VtoTModel"][model_name].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save local model configration!")
@@ -405,6 +367,39 @@ def get_vtot_data(
             data="",
             msg=f"failed to translate voice data, error: {e}")
     
+def get_vtot_stream(
+    session_id: str = Body(..., description="streaming session id"),
+    voice_data: str = Body("", description="base64 audio chunk"),
+    voice_format: str = Body("", description="pcm16 for raw 16-bit mono audio, empty for an encoded file"),
+    sample_rate: int = Body(16000, description="sample rate of pcm16 chunks"),
+    final: bool = Body(False, description="last chunk of the session"),
+    controller_address: str = Body(None, description="Fastchat controller adress", examples=[fschat_controller_address()])
+) -> BaseResponse:
+    try:
+        controller_address = controller_address or fschat_controller_address()
+        with get_httpx_client() as client:
+            r = client.post(
+                controller_address + "/get_vtot_stream",
+                json={"session_id": session_id, "voice_data": voice_data, "voice_format": voice_format,
+                      "sample_rate": sample_rate, "final": final},
+                )
+            result = r.json()
+            if result.get("code") == 200:
+                return BaseResponse(data={"text": result.get("text", ""),
+                                          "committed": result.get("committed", ""),
+                                          "final": result.get("final", final)})
+            else:
+                return BaseResponse(
+                    code=500,
+                    data={},
+                    msg=f"failed to translate voice stream, error: {result.get('msg', '')}")
+    except Exception as e:
+        print(f'{e.__class__.__name__}: {e}')
+        return BaseResponse(
+            code=500,
+            data={},
+            msg=f"failed to translate voice stream, error: {e}")
+    
 def stop_vtot_model(
     model_name: str = Body(..., description="Stop Model"),
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])
@@ -464,12 +459,9 @@ def save_speech_model_config(
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])    
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["ModelConfig"]["TtoVModel"][model_name].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save local model configration!")
@@ -583,12 +575,9 @@ def save_image_recognition_model_config(
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])    
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["ModelConfig"]["ImageRecognition"][model_name].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save local model configration!")
@@ -705,12 +694,9 @@ def save_image_generation_model_config(
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])    
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["ModelConfig"]["ImageGeneration"][model_name].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save local model configration!")
@@ -824,12 +810,9 @@ def save_music_generation_model_config(
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])    
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["ModelConfig"]["MusicGeneration"][model_name].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save local model configration!")
@@ -928,12 +911,9 @@ def save_chat_config(
         controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["ChatConfiguration"].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save chat configration!")
@@ -949,12 +929,9 @@ def save_search_engine_config(
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["SearchEngine"].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save chat configration!")
@@ -983,29 +960,18 @@ def llm_search_engine_chat(
 ):
     controller_address = controller_address or fschat_controller_address()
     async def fake_json_streamer() -> AsyncIterable[str]:
-        import asyncio
-        with get_httpx_client() as client:
-            response = client.stream(
-                "POST",
-                url=controller_address + "/llm_search_engine_chat",
-                json={
-                    "query": query,
-                    "search_engine_name": search_engine_name,
-                    "history": history,
-                    "stream": stream,
-                    "model_name": model_name,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                    "prompt_name": prompt_name,
-                    },
-            )
-            with response as r:
-                for chunk in r.iter_text(None):
-                    if not chunk:
-                        continue
-                    yield chunk
-                    await asyncio.sleep(0.1)
-    return StreamingResponse(fake_json_streamer(), media_type="text/event-stream")
+        async for chunk in proxy_stream(controller_address, "/llm_search_engine_chat", json={
+            "query": query,
+            "search_engine_name": search_engine_name,
+            "history": history,
+            "stream": stream,
+            "model_name": model_name,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "prompt_name": prompt_name,
+            }):
+            yield chunk
+    return StreamingResponse(fake_json_streamer(), media_type=NDJSON_MEDIA_TYPE)
 
 def list_search_engines() -> BaseResponse:
     pass
@@ -1018,12 +984,9 @@ def save_code_interpreter_config(
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["CodeInterpreter"].update(config)
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save chat configration!")
@@ -1039,12 +1002,9 @@ def save_google_toolboxes_config(
     controller_address: str = Body(None, description="Fastchat controller address", examples=[fschat_controller_address()])
 ) -> BaseResponse:
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["ToolBoxes"]["Google ToolBoxes"]=google_toolboxes
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return BaseResponse(
             code=200,
             msg="success save google toolboxes configration!")
@@ -2,12 +2,225 @@ import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-from typing import Any,  Optional, Sequence
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any,  Optional, Sequence, Dict, List, Tuple
 from sentence_transformers import CrossEncoder
 from langchain_core.documents import Document
 from langchain.callbacks.manager import Callbacks
 from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
 from llama_index.bridge.pydantic import Field, PrivateAttr
+from WebUI.Server.knowledge_base.kb_cache.base import ThreadSafeObject, CachePool
+from WebUI.configs.basicconfig import GetRerankerConfig
+
+
+def estimate_reranker_bytes(model: CrossEncoder) -> int:
+    try:
+        nbytes = sum(p.numel() * p.element_size() for p in model.model.parameters())
+        nbytes += sum(b.numel() * b.element_size() for b in model.model.buffers())
+        return nbytes
+    except Exception as e:
+        print(f"estimate reranker memory failed: {e}")
+        return 0
+
+
+class RerankerPool(CachePool):
+    def load_reranker(self, model_name_or_path: str, device: str, max_length: int = 1024) -> CrossEncoder:
+        self.atomic.acquire()
+        key = (model_name_or_path, device, max_length)
+        try:
+            if cache := self.get(key):
+                if cache.obj is None:
+                    raise RuntimeError(f"reranker model '{model_name_or_path}' failed to load.")
+                self._cache.move_to_end(key)
+                self.record_hit(cache)
+            else:
+                item = ThreadSafeObject(key, pool=self)
+                self.set(key, item)
+        except Exception:
+            self.atomic.release()
+            raise
+        if cache:
+            self.atomic.release()
+            return cache.obj
+        with item.acquire(msg="Initialize"):
+            self.atomic.release()
+            start = time.time()
+            try:
+                model = CrossEncoder(model_name=model_name_or_path, max_length=max_length, device=device)
+            except Exception:
+                # wake the waiters first, they hold the pool lock while waiting for the load.
+                item.finish_loading()
+                with self.atomic:
+                    if self._cache.get(key) is item:
+                        self.pop(key)
+                raise
+            item.obj = model
+            item.finish_loading()
+            self.record_load(item, time.time() - start, estimate_reranker_bytes(model))
+            print(f"load reranker model '{model_name_or_path}' on {device} in {item.load_time:.2f}s, about {item.nbytes} bytes.")
+        return model
+
+
+class RerankScoreCache:
+    '''
+    LRU of cross-encoder scores keyed by model, query and a hash of the chunk text.
+    '''
+    def __init__(self, max_size: int = 20000):
+        self.max_size = max_size
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(model_key: Tuple, query: str, text: str) -> str:
+        chunk_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        return f"{model_key}|{query}|{chunk_hash}"
+
+    def get_many(self, model_key: Tuple, query: str, texts: List[str]) -> Tuple[List[Optional[float]], List[int]]:
+        scores = [None] * len(texts)
+        missing = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = self._key(model_key, query, text)
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[i] = self._scores[key]
+                else:
+                    missing.append(i)
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return scores, missing
+
+    def set_many(self, model_key: Tuple, query: str, texts: List[str], scores: List[float]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            for text, score in zip(texts, scores):
+                self._scores[self._key(model_key, query, text)] = score
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._scores),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class RerankBatcher:
+    '''
+    Score the sentence pairs of concurrent requests in one CrossEncoder.predict call.
+    Each model gets a daemon worker thread that waits up to max_wait_ms for more
+    requests (or until max_batch_pairs is reached) and fans the scores back out.
+    '''
+    def __init__(self, max_batch_pairs: int = 64, max_wait_ms: float = 5, timeout_s: float = 60):
+        self.max_batch_pairs = max(1, int(max_batch_pairs))
+        self.max_wait = max(0.0, max_wait_ms / 1000)
+        self.timeout = timeout_s if timeout_s and timeout_s > 0 else None
+        self._queues: Dict[Tuple, queue.Queue] = {}
+        self._lock = threading.Lock()
+
+    def _get_queue(self, model_key: Tuple) -> queue.Queue:
+        with self._lock:
+            q = self._queues.get(model_key)
+            if q is None:
+                q = queue.Queue()
+                self._queues[model_key] = q
+                threading.Thread(target=self._worker,
+                                 args=(model_key, q),
+                                 name=f"reranker-batcher-{model_key[0]}",
+                                 daemon=True).start()
+            return q
+
+    def submit(self, model_key: Tuple, pairs: List[List[str]], batch_size: int = 32) -> Future:
+        future = Future()
+        self._get_queue(model_key).put((pairs, batch_size, future))
+        return future
+
+    def _collect(self, q: queue.Queue) -> List[Tuple[List[List[str]], int, Future]]:
+        batch = [q.get()]
+        count = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch_pairs:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            count += len(request[0])
+        return batch
+
+    def _worker(self, model_key: Tuple, q: queue.Queue):
+        while True:
+            batch = []
+            try:
+                # requests that timed out and were cancelled are not scored.
+                batch = [request for request in self._collect(q) if request[2].set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                pairs = [pair for request_pairs, _, _ in batch for pair in request_pairs]
+                batch_size = max(batch_size for _, batch_size, _ in batch)
+                model = reranker_pool.load_reranker(*model_key)
+                scores = model.predict(sentences=pairs, batch_size=batch_size, convert_to_numpy=True).tolist()
+                start = 0
+                for request_pairs, _, future in batch:
+                    future.set_result(scores[start:start + len(request_pairs)])
+                    start += len(request_pairs)
+                if len(batch) > 1:
+                    print(f"reranker batcher: {len(batch)} requests scored in one call with {model_key[0]}")
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+_reranker_config = GetRerankerConfig()
+reranker_pool = RerankerPool(cache_num=_reranker_config.get("cache_num", 1),
+                             max_bytes=int(_reranker_config.get("max_memory_mb", 2048) * 1024 * 1024))
+rerank_score_cache = RerankScoreCache(max_size=_reranker_config.get("score_cache_size", 20000))
+rerank_batcher = RerankBatcher(max_batch_pairs=_reranker_config.get("max_batch_pairs", 64),
+                               max_wait_ms=_reranker_config.get("max_wait_ms", 5),
+                               timeout_s=_reranker_config.get("timeout_s", 60))
+
+
+def rerank_scores(
+        model_name_or_path: str,
+        device: str,
+        query: str,
+        texts: List[str],
+        max_length: int = 1024,
+        batch_size: int = 32,
+) -> List[float]:
+    '''
+    cross-encoder scores of (query, text) pairs, only pairs missing from the score cache are predicted.
+    '''
+    model_key = (model_name_or_path, device, max_length)
+    scores, missing = rerank_score_cache.get_many(model_key, query, texts)
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        future = rerank_batcher.submit(model_key, [[query, text] for text in missing_texts], batch_size)
+        try:
+            new_scores = future.result(timeout=rerank_batcher.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise RuntimeError(f"rerank with '{model_name_or_path}' timed out after {rerank_batcher.timeout}s")
+        for i, score in zip(missing, new_scores):
+            scores[i] = score
+        rerank_score_cache.set_many(model_key, query, missing_texts, new_scores)
+    return scores
 
 
 class LangchainReranker(BaseDocumentCompressor):
@@ -45,7 +258,6 @@ class LangchainReranker(BaseDocumentCompressor):
         # self.activation_fct=activation_fct
         # self.apply_softmax=apply_softmax
 
-        self._model = CrossEncoder(model_name=model_name_or_path, max_length=1024, device=device)
         super().__init__(
             top_n=top_n,
             model_name_or_path=model_name_or_path,
@@ -57,6 +269,8 @@ class LangchainReranker(BaseDocumentCompressor):
             # activation_fct=activation_fct,
             # apply_softmax=apply_softmax
         )
+        # the cross encoder is shared by all rerankers through reranker_pool, not loaded per request.
+        self._model = reranker_pool.load_reranker(model_name_or_path, device, max_length)
 
     def compress_documents(
             self,
@@ -79,22 +293,19 @@ class LangchainReranker(BaseDocumentCompressor):
             return []
         doc_list = list(documents)
         _docs = [d.page_content for d in doc_list]
-        sentence_pairs = [[query, _doc] for _doc in _docs]
-        results = self._model.predict(sentences=sentence_pairs,
-                                      batch_size=self.batch_size,
-                                      #  show_progress_bar=self.show_progress_bar,
-                                      num_workers=self.num_workers,
-                                      #  activation_fct=self.activation_fct,
-                                      #  apply_softmax=self.apply_softmax,
-                                      convert_to_tensor=True
-                                      )
+        results = rerank_scores(self.model_name_or_path,
+                                self.device,
+                                query,
+                                _docs,
+                                max_length=self.max_length,
+                                batch_size=self.batch_size)
         top_k = self.top_n if self.top_n < len(results) else len(results)
 
-        values, indices = results.topk(top_k)
+        indices = sorted(range(len(results)), key=lambda i: results[i], reverse=True)[:top_k]
         final_results = []
-        for value, index in zip(values, indices):
+        for index in indices:
             doc = doc_list[index]
-            doc.metadata["relevance_score"] = value
+            doc.metadata["relevance_score"] = results[index]
             final_results.append(doc)
         return final_results
 
@@ -11,7 +11,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain.chat_models import ChatOpenAI #AzureChatOpenAI, ChatAnthropic
 #from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.llms import OpenAI, AzureOpenAI, Anthropic
-from typing import Dict, Union, Optional, Literal, Any, List, Callable, Awaitable, Generator, Tuple
+from typing import Dict, Union, Optional, Literal, Any, List, Callable, Awaitable, Generator, AsyncGenerator, AsyncIterable, Tuple
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
 from WebUI.configs.basicconfig import (ModelType, ModelSize, ModelSubType, GetModelInfoByName, GetModelConfig)
 
@@ -135,6 +135,53 @@ def get_httpx_client(
     else:
         return httpx.Client(**kwargs)
     
+# chat streams are newline-delimited JSON: one json.dumps() object per line.
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+async def ndjson_stream(iterator: AsyncIterable[str]) -> AsyncGenerator[str, None]:
+    '''
+    frame an iterator of json.dumps() strings as NDJSON, so clients can split the objects
+    no matter how the transport merges or splits the chunks. json.dumps never emits raw newlines.
+    '''
+    async for data in iterator:
+        yield data + "\n"
+
+_proxy_clients: Dict[str, httpx.AsyncClient] = {}
+
+def get_proxy_client(address: str) -> httpx.AsyncClient:
+    '''
+    shared keep-alive AsyncClient for one worker address, so proxied requests reuse pooled connections.
+    must be called from the event loop that uses the client. pool limits are read from
+    ServerConfig.fastchat_controller.proxy_pool in webuiconfig.json.
+    '''
+    client = _proxy_clients.get(address)
+    if client is None or client.is_closed:
+        configinst = InnerJsonConfigWebUIParse()
+        server_config = configinst.get("ServerConfig") or {}
+        pool_config = server_config.get("fastchat_controller", {}).get("proxy_pool", {})
+        limits = httpx.Limits(max_connections=pool_config.get("max_connections", 100),
+                              max_keepalive_connections=pool_config.get("max_keepalive_connections", 20),
+                              keepalive_expiry=pool_config.get("keepalive_expiry", 30))
+        client = get_httpx_client(use_async=True, base_url=address, limits=limits)
+        _proxy_clients[address] = client
+    return client
+
+async def close_proxy_clients():
+    for client in list(_proxy_clients.values()):
+        await client.aclose()
+    _proxy_clients.clear()
+
+async def proxy_stream(address: str, path: str, json: Dict) -> AsyncGenerator[str, None]:
+    '''
+    POST json to a worker and pass its streamed response through chunk by chunk. chunks are only read
+    when the caller asks for the next one, and a disconnected caller closes the upstream response.
+    '''
+    client = get_proxy_client(address)
+    async with client.stream("POST", path, json=json) as response:
+        async for chunk in response.aiter_text():
+            if chunk:
+                yield chunk
+
 def set_httpx_config(timeout: float = HTTPX_DEFAULT_TIMEOUT, proxy: Union[str, Dict] = None):
     httpx._config.DEFAULT_TIMEOUT_CONFIG.connect = timeout
     httpx._config.DEFAULT_TIMEOUT_CONFIG.read = timeout
@@ -549,10 +596,21 @@ class ListResponse(BaseResponse):
             }
         }
 
+_prompt_templates_mtime = None
+
 def get_prompt_template(type: str, name: str) -> Optional[str]:
+    '''
+    prompttemplates.py is reloaded only when the file changed, edits still apply without a restart.
+    '''
+    global _prompt_templates_mtime
     from WebUI.configs import prompttemplates
     import importlib
-    importlib.reload(prompttemplates)
+    mtime = os.path.getmtime(prompttemplates.__file__)
+    if _prompt_templates_mtime is None:
+        _prompt_templates_mtime = mtime
+    elif mtime != _prompt_templates_mtime:
+        importlib.reload(prompttemplates)
+        _prompt_templates_mtime = mtime
     return prompttemplates.PROMPT_TEMPLATES[type].get(name)
 
 def get_OpenAI(
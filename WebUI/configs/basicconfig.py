@@ -402,6 +402,13 @@ def GetKbConfig():
     kb_config = knowledgeinst.dump()
     return kb_config
 
+def GetKbConfigSnapshot():
+    '''
+    the shared read-only kbconfig.json, for settings that are only read.
+    '''
+    from WebUI.configs.webuiconfig import InnerJsonConfigKnowledgeBaseParse
+    return InnerJsonConfigKnowledgeBaseParse().snapshot()
+
 def GetKbRootPath(kb_config: dict):
     if isinstance(kb_config, dict):
         return kb_config.get("kb_root_path", "")
@@ -520,13 +527,11 @@ def GetCurrentRunningCfg(activate: bool=False) ->dict:
     return config
 
 def SaveCurrentRunningCfg(running_cfg: dict = InitCurrentRunningCfg()) ->bool:
+    from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
     try:
-        with open("WebUI/configs/webuiconfig.json", 'r+') as file:
-            jsondata = json.load(file)
+        def update_config(jsondata: dict):
             jsondata["CurrentRunningConfig"]=running_cfg
-            file.seek(0)
-            json.dump(jsondata, file, indent=4)
-            file.truncate()
+        InnerJsonConfigWebUIParse().update(update_config)
         return True
     except Exception as e:
         print(f'Save running config failed, error: {e}')
@@ -537,6 +542,92 @@ def GetTextSplitterDict():
     text_splitter_dict = kb_config.get("text_splitter_dict", {})
     return text_splitter_dict
 
+def GetEmbeddingCacheConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("embedding_cache", {})
+    return {}
+
+def GetEmbeddingsPoolConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("embeddings_pool", {})
+    return {}
+
+def GetFaissPoolConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("faiss_pool", {})
+    return {}
+
+def GetEmbeddingBatcherConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("embedding_batcher", {})
+    return {}
+
+def GetOcrConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("ocr", {})
+    return {}
+
+def GetDocumentLoaderConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("document_loader", {})
+    return {}
+
+def GetIngestPipelineConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("ingest_pipeline", {})
+    return {}
+
+def GetRerankerConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("reranker", {})
+    return {}
+
+def GetToolExecutorConfig() -> dict:
+    from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
+    configinst = InnerJsonConfigWebUIParse()
+    config = (configinst.snapshot() or {}).get("ToolExecutor")
+    if isinstance(config, dict):
+        return config
+    return {}
+
+def GetToolResultCacheConfig() -> dict:
+    from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
+    configinst = InnerJsonConfigWebUIParse()
+    config = (configinst.snapshot() or {}).get("ToolResultCache")
+    if isinstance(config, dict):
+        return config
+    return {}
+
+def GetGenerationSchedulerConfig(webui_config: dict, model_name: str = "") -> dict:
+    '''
+    GenerationScheduler section of webuiconfig.json, merged with its "models" entry for model_name.
+    '''
+    config = {}
+    if isinstance(webui_config, dict):
+        config = webui_config.get("GenerationScheduler") or {}
+    merged = {k: v for k, v in config.items() if k != "models"}
+    merged.update((config.get("models") or {}).get(model_name, {}))
+    return merged
+
+def GetVoiceRecognizerConfig(webui_config: dict) -> dict:
+    if isinstance(webui_config, dict):
+        return webui_config.get("VoiceRecognizer") or {}
+    return {}
+
+def GetChatHistoryConfig() -> dict:
+    kb_config = GetKbConfigSnapshot()
+    if isinstance(kb_config, dict):
+        return kb_config.get("chat_history", {})
+    return {}
+
 def generate_new_query(query : str = "", imagesprompt : List[str] = []):
     en_nums = ['first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth']
 
@@ -614,98 +705,112 @@ def ConvertCompletionRequestToHistory(request: ChatCompletionRequest):
         return [], None 
     return historys, query
 
-def ExtractJsonStrings(input_string):
-    import json
-    json_data_list = []
-    stack = []
-    start = None
-
-    for i, char in enumerate(input_string):
-        if char == '{':
-            if not stack:
-                start = i
-            stack.append(char)
-        elif char == '}':
-            if stack:
-                stack.pop()
-                if not stack:
-                    json_str = input_string[start:i+1]
+class JsonScanner:
+    '''
+    Incremental scanner for top-level JSON objects in a growing text.
+    Tracks brace depth and string state across calls, so each character is scanned once.
+    '''
+    def __init__(self):
+        self.pos = 0
+        self.depth = 0
+        self.start = None
+        self.in_string = False
+        self.escape = False
+        self.json_strings = []
+        self.json_objects = []
+
+    def scan(self, text: str) -> List[Tuple[str, dict]]:
+        '''
+        scan text[self.pos:], text must start with everything that was scanned before.
+        return the JSON objects completed by the new characters.
+        '''
+        found = []
+        for i in range(self.pos, len(text)):
+            char = text[i]
+            if self.depth > 0 and self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                if self.depth > 0:
+                    self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.start = i
+                self.depth += 1
+            elif char == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    json_str = text[self.start:i+1]
                     try:
-                        json.loads(json_str)
-                        json_data_list.append(json_str)
+                        json_obj = json.loads(json_str)
+                        self.json_strings.append(json_str)
+                        self.json_objects.append(json_obj)
+                        found.append((json_str, json_obj))
                     except json.JSONDecodeError:
                         pass
-    return json_data_list
+        self.pos = len(text)
+        return found
 
-def use_new_search_engine(json_lists : list = []) ->bool:
+def ExtractJsonStrings(input_string):
+    scanner = JsonScanner()
+    scanner.scan(input_string)
+    return scanner.json_strings
+
+_tool_types = None
+
+def GetToolTypeByName(name: str) -> ToolsType:
+    # name -> ToolsType, built once. a name listed twice keeps the type checked first by CallingExternalToolsForCurConfig.
+    global _tool_types
+    if _tool_types is None:
+        from WebUI.Server.funcall.funcall import search_tool_names, kb_tool_names, tool_names, code_tool_names
+        from WebUI.Server.funcall.google_toolboxes.calendar_funcall import calendar_tool_names
+        from WebUI.Server.funcall.google_toolboxes.gmail_funcall import email_tool_names
+        from WebUI.Server.funcall.google_toolboxes.gcloud_funcall import drive_tool_names
+        from WebUI.Server.funcall.google_toolboxes.gmap_funcall import map_tool_names
+        from WebUI.Server.funcall.google_toolboxes.youtube_funcall import youtube_tool_names
+        from WebUI.Server.funcall.google_toolboxes.photo_funcall import photo_tool_names
+        tool_types = {}
+        for names, tool_type in [
+            (["search_engine", *search_tool_names], ToolsType.ToolSearchEngine),
+            (["knowledge_base", *kb_tool_names], ToolsType.ToolKnowledgeBase),
+            (tool_names, ToolsType.ToolFunctionCalling),
+            (code_tool_names, ToolsType.ToolCodeInterpreter),
+            ([*calendar_tool_names, *email_tool_names, *drive_tool_names,
+              *map_tool_names, *youtube_tool_names, *photo_tool_names], ToolsType.ToolToolBoxes),
+        ]:
+            for tool_name in names:
+                tool_types.setdefault(tool_name, tool_type)
+        _tool_types = tool_types
+    return _tool_types.get(name, ToolsType.Unknown)
+
+def _use_tool_type(json_lists: list, tool_type: ToolsType) -> bool:
     try:
         for item in json_lists:
             it = json.loads(item)
-            from WebUI.Server.funcall.funcall import search_tool_names
-            if it.get("name", "") == "search_engine" or it.get("name", "") in search_tool_names:
+            if isinstance(it, dict) and GetToolTypeByName(it.get("name", "")) == tool_type:
                 return True
     except Exception as e:
         print(e)
     return False
 
+def use_new_search_engine(json_lists : list = []) ->bool:
+    return _use_tool_type(json_lists, ToolsType.ToolSearchEngine)
+
 def use_knowledge_base(json_lists : list = []) ->bool:
-    try:
-        for item in json_lists:
-            it = json.loads(item)
-            from WebUI.Server.funcall.funcall import kb_tool_names
-            if it.get("name", "") == "knowledge_base" or it.get("name", "") in kb_tool_names:
-                return True
-    except Exception as e:
-        print(e)
-    return False
+    return _use_tool_type(json_lists, ToolsType.ToolKnowledgeBase)
 
 def use_new_function_calling(json_lists : list = []) ->bool:
-    from WebUI.Server.funcall.funcall import tool_names
-    try:
-        for item in json_lists:
-            it = json.loads(item)
-            if it.get("name", "") in tool_names:
-                return True
-    except Exception as e:
-        print(e)
-    return False
+    return _use_tool_type(json_lists, ToolsType.ToolFunctionCalling)
 
 def use_code_interpreter(json_lists : list = []) ->bool:
-    from WebUI.Server.funcall.funcall import code_tool_names
-    try:
-        for item in json_lists:
-            it = json.loads(item)
-            if it.get("name", "") in code_tool_names:
-                return True
-    except Exception as e:
-        print(e)
-    return False
+    return _use_tool_type(json_lists, ToolsType.ToolCodeInterpreter)
 
 def use_new_toolboxes_calling(json_lists : list = []) ->bool:
-    from WebUI.Server.funcall.google_toolboxes.calendar_funcall import calendar_tool_names
-    from WebUI.Server.funcall.google_toolboxes.gmail_funcall import email_tool_names
-    from WebUI.Server.funcall.google_toolboxes.gcloud_funcall import drive_tool_names
-    from WebUI.Server.funcall.google_toolboxes.gmap_funcall import map_tool_names
-    from WebUI.Server.funcall.google_toolboxes.youtube_funcall import youtube_tool_names
-    from WebUI.Server.funcall.google_toolboxes.photo_funcall import photo_tool_names
-    try:
-        for item in json_lists:
-            it = json.loads(item)
-            if it.get("name", "") in calendar_tool_names:
-                return True
-            if it.get("name", "") in email_tool_names:
-                return True
-            if it.get("name", "") in drive_tool_names:
-                return True
-            if it.get("name", "") in map_tool_names:
-                return True
-            if it.get("name", "") in youtube_tool_names:
-                return True
-            if it.get("name", "") in photo_tool_names:
-                return True
-    except Exception as e:
-        print(e)
-    return False
+    return _use_tool_type(json_lists, ToolsType.ToolToolBoxes)
 
 def GenerateToolsPrompt(rendered_tools: str) ->str:
     tools_system_prompt = f"""You can access to the following set of tools. Here are the function name and descriptions for each tool:
@@ -1029,32 +1134,45 @@ def GetSystemPromptForSupportTools()->str:
         return GetSystemPromptForChatSolutionSupportTools(config)
     return GetSystemPromptForNormalChatSupportTools(config)
 
-def CallingExternalToolsForCurConfig(text: str) -> bool:
-    if not text:
-        return False, ""
+def _strip_tool_calls(text: str, json_lists: list) -> str:
     new_answer = text
-    json_lists = ExtractJsonStrings(text)
-    if not json_lists:
-        return False, new_answer
     for json_str in json_lists:
         new_answer = new_answer.replace(json_str, "")
     if "```json" in new_answer:
         new_answer = new_answer.replace("```json", "")
     if "```" in new_answer:
         new_answer = new_answer.replace("```", "")
-    new_answer = new_answer.strip(' \n')
-    if use_new_search_engine(json_lists):
-        return True, new_answer
-    if use_knowledge_base(json_lists):
-        return True, new_answer
-    if use_new_function_calling(json_lists):
-        return True, new_answer
-    if use_code_interpreter(json_lists):
-        return True, new_answer
-    if use_new_toolboxes_calling(json_lists):
+    return new_answer.strip(' \n')
+
+def _is_tool_call(json_obj) -> bool:
+    return isinstance(json_obj, dict) and GetToolTypeByName(json_obj.get("name", "")) != ToolsType.Unknown
+
+def CallingExternalToolsForCurConfig(text: str) -> bool:
+    if not text:
+        return False, ""
+    scanner = JsonScanner()
+    scanner.scan(text)
+    if not scanner.json_strings:
+        return False, text
+    new_answer = _strip_tool_calls(text, scanner.json_strings)
+    if any(_is_tool_call(json_obj) for json_obj in scanner.json_objects):
         return True, new_answer
-    return False, new_answer  
-    
+    return False, new_answer
+
+class ToolCallDetector:
+    '''
+    Streaming replacement for CallingExternalToolsForCurConfig: call detect(answer) after every token,
+    only the new part of answer is scanned. It returns True once, when a token completes a tool call.
+    '''
+    def __init__(self):
+        self.scanner = JsonScanner()
+
+    def detect(self, text: str) -> Tuple[bool, str]:
+        found = self.scanner.scan(text)
+        if any(_is_tool_call(json_obj) for _, json_obj in found):
+            return True, _strip_tool_calls(text, self.scanner.json_strings)
+        return False, text
+
 def GetNewAnswerForCurConfig(answer: str, tool_name: str, tool_type: ToolsType) ->str:
     new_answer = answer
     if tool_type == ToolsType.ToolKnowledgeBase:
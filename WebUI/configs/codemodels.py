@@ -4,9 +4,9 @@ import asyncio
 from WebUI.configs.basicconfig import (ModelType, ModelSize, ModelSubType, GetModelInfoByName, GetModelConfig)
 from fastapi.responses import StreamingResponse
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
-from WebUI.Server.db.repository import add_chat_history_to_db, update_chat_history
+from WebUI.Server.db.repository import queue_chat_history, queue_chat_history_update
 from WebUI.Server.chat.StreamHandler import StreamSpeakHandler
-from WebUI.Server.utils import FastAPI
+from WebUI.Server.utils import FastAPI, ndjson_stream, NDJSON_MEDIA_TYPE
 from typing import Dict, List, Any, Optional, AsyncIterable
 
 def load_causallm_model(app: FastAPI, model_name, model_path, device):
@@ -108,7 +108,7 @@ def code_model_chat(
                     speak_handler = StreamSpeakHandler(run_place=modeltype, provider=provider, synthesis=spspeaker, subscription=speechkey, region=speechregion)
 
         answer = ""
-        chat_history_id = add_chat_history_to_db(chat_type="llm_chat", query=query)
+        chat_history_id = queue_chat_history(chat_type="llm_chat", query=query)
         modelconfig = GetModelConfig(webui_config, modelinfo)
         device = modelconfig.get("device", "auto")
         device = "cuda" if device == "gpu" else detect_device() if device == "auto" else device
@@ -165,9 +165,9 @@ def code_model_chat(
                 speak_handler.on_llm_new_token(answer)
                 speak_handler.on_llm_end(None)
         
-        update_chat_history(chat_history_id, response=answer)
+        queue_chat_history_update(chat_history_id, response=answer)
         
-    return StreamingResponse(code_chat_iterator(
+    return StreamingResponse(ndjson_stream(code_chat_iterator(
                                             model=model,
                                             tokenizer=tokenizer,
                                             async_callback=async_callback,
@@ -180,5 +180,5 @@ def code_model_chat(
                                             modelinfo=modelinfo,
                                             temperature=temperature,
                                             max_tokens=max_tokens,
-                                            prompt_name=prompt_name),
-                             media_type="text/event-stream")
+                                            prompt_name=prompt_name)),
+                             media_type=NDJSON_MEDIA_TYPE)
@@ -3,19 +3,18 @@ import re
 import json
 import asyncio
 import base64
-import threading
 from pathlib import Path
 import google.generativeai as genai
 from fastapi.responses import StreamingResponse
 from WebUI.configs.basicconfig import (TMP_DIR, ToolsType, ModelType, ModelSize, ModelSubType, GetModelInfoByName, GetProviderByName, GetModelConfig, GetGGUFModelPath, generate_new_query, GeneratePresetPrompt, 
-                                       GetSystemPromptForSupportTools, GetSystemPromptForCurrentRunningConfig, GetGoogleNativeTools, GetOpenaiNativeTools, CallingExternalToolsForCurConfig, GetNewAnswerForCurConfig,
-                                       GetUserAnswerForCurConfig)
+                                       GetSystemPromptForSupportTools, GetSystemPromptForCurrentRunningConfig, GetGoogleNativeTools, GetOpenaiNativeTools, CallingExternalToolsForCurConfig, ToolCallDetector, GetNewAnswerForCurConfig,
+                                       GetUserAnswerForCurConfig, GetGenerationSchedulerConfig)
 from WebUI.configs.codemodels import code_model_chat
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
-from WebUI.Server.db.repository import add_chat_history_to_db, update_chat_history
+from WebUI.Server.db.repository import queue_chat_history, queue_chat_history_update
 from WebUI.Server.chat.StreamHandler import StreamSpeakHandler
-from langchain.chains import LLMChain
-from WebUI.Server.utils import FastAPI
+from WebUI.Server.chat.generation_scheduler import GenerationScheduler, pipeline_generate_fn, llamacpp_generate_fn
+from WebUI.Server.utils import FastAPI, ndjson_stream, NDJSON_MEDIA_TYPE
 from WebUI.Server.chat.chat import GetQueryFromExternalToolsForCurConfig, RunAllEnableToolsInString
 from typing import List, Dict, Any, Optional, AsyncIterable
 
@@ -64,11 +63,14 @@ def init_cloud_models(model_name):
     return None
 
 def load_pipeline_model(app: FastAPI, model_name, model_path, device):
-    from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer, pipeline
+    from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
     from langchain.llms.huggingface_pipeline import HuggingFacePipeline
     model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype="auto", device_map=device, trust_remote_code=True)
     tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    # batched prompts are left padded, so every row ends right before its first new token
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
     configinst = InnerJsonConfigWebUIParse()
     webui_config = configinst.dump()
     chatconfig = webui_config.get("ChatConfiguration")
@@ -85,7 +87,6 @@ def load_pipeline_model(app: FastAPI, model_name, model_path, device):
         temperature=temperature,
         top_p=top_p,
         repetition_penalty=repetition_penalty,
-        streamer=streamer
     )
     pipe.model.config.pad_token_id = pipe.model.config.eos_token_id
     if model_name.startswith("phi"):
@@ -99,18 +100,25 @@ def load_pipeline_model(app: FastAPI, model_name, model_path, device):
         pipe.model.config.eos_token_id = terminators
         pipe.model.config.pad_token_id = tokenizer.eos_token_id
     llm_model = HuggingFacePipeline(pipeline=pipe)
+    scheduler_config = GetGenerationSchedulerConfig(webui_config, model_name)
+    generate = pipeline_generate_fn(pipe.model, tokenizer,
+                                    max_length=tokens_length,
+                                    do_sample=True,
+                                    temperature=temperature,
+                                    top_p=top_p,
+                                    repetition_penalty=repetition_penalty)
     app._model = llm_model
     app._tokenizer = tokenizer
-    app._streamer = streamer
+    app._streamer = GenerationScheduler(generate,
+                                        max_concurrency=scheduler_config.get("max_concurrency", 1),
+                                        max_batch_size=scheduler_config.get("max_batch_size", 1),
+                                        max_wait_ms=scheduler_config.get("max_wait_ms", 10),
+                                        name=model_name)
     app._model_name = model_name
 
 def load_llamacpp_model(app: FastAPI, model_name, model_path):
     from langchain.llms.llamacpp import LlamaCpp
-    from langchain.callbacks.manager import CallbackManager
-    from WebUI.Server.chat.StreamHandler import LlamacppStreamCallbackHandler
     from transformers import AutoTokenizer
-    async_callback = LlamacppStreamCallbackHandler()
-    callback_manager = CallbackManager([async_callback])
     configinst = InnerJsonConfigWebUIParse()
     webui_config = configinst.dump()
     chatconfig = webui_config.get("ChatConfiguration")
@@ -129,13 +137,13 @@ def load_llamacpp_model(app: FastAPI, model_name, model_path):
             max_tokens=tokens_length,
             top_p=top_p,
             verbose=True,
-            callback_manager=callback_manager,
             n_threads=4,
             streaming=True,
         )
+        # one llama.cpp context can only run one generation at a time
         app._model = llm_model
         app._tokenizer = tokenizer
-        app._streamer = async_callback
+        app._streamer = GenerationScheduler(llamacpp_generate_fn(llm_model), max_concurrency=1, name=model_name)
         app._model_name = model_name
 
 def init_special_models(app: FastAPI, args):
@@ -189,7 +197,7 @@ async def special_chat_iterator(model: Any,
 
     btalk = True
     answer = ""
-    chat_history_id = add_chat_history_to_db(chat_type="llm_chat", query=query)
+    chat_history_id = queue_chat_history(chat_type="llm_chat", query=query)
     if imagesprompt:
         query = generate_new_query(query, imagesprompt)
     system_msg = {}
@@ -208,7 +216,6 @@ async def special_chat_iterator(model: Any,
             }
             history = [system_msg] + history
     if modelinfo["mtype"] == ModelType.Special:
-        from langchain.prompts import PromptTemplate
         modelconfig = GetModelConfig(webui_config, modelinfo)
         loadtype = modelconfig["load_type"]
 
@@ -225,33 +232,28 @@ async def special_chat_iterator(model: Any,
         btalk = True
         while btalk:
             answer = ""
+            tool_detector = ToolCallDetector()
             btalk = False
             prompt = history.copy()
             prompt.append({'role': "user",
-                            'content': "{{input}}"})
+                            'content': query})
 
-            messages = tokenizer.apply_chat_template(
+            # the query goes into the chat template as is, it is never rendered as jinja2
+            prompt_text = tokenizer.apply_chat_template(
                     prompt,
                     tokenize=False, 
                     add_generation_prompt=True
             )
-            prompt = PromptTemplate(template=messages, template_format="jinja2", input_variables=["input"])
             if loadtype == "pipeline":
-                chain = LLMChain(prompt=prompt, llm=model)
-                def running_chain(chain, query):
-                    chain.run(query)
-                    print("running_chain exit!")
-                
-                thread = threading.Thread(target=running_chain, args=(chain, query))
-                thread.start()
+                # async_callback is the GenerationScheduler of the model, every request gets its own stream
+                request = async_callback.submit(prompt_text)
                 if loadtype == "pipeline":
-                    streamer = async_callback
-                    for chunk in streamer:
+                    async for chunk in request.stream():
                         if chunk is not None:
                             answer += chunk
                             print(chunk, end="")
                             if not btalk:
-                                btalk, new_answer = CallingExternalToolsForCurConfig(answer)
+                                btalk, new_answer = tool_detector.detect(answer)
                                 if btalk:
                                     new_query, tool_name, docs, tool_dict, tooltype = await GetQueryFromExternalToolsForCurConfig(answer=answer, query=query)
                                     if not new_query:
@@ -269,13 +271,15 @@ async def special_chat_iterator(model: Any,
                                             {"user": user_answer, "tooltype": tooltype.value},
                                             ensure_ascii=False)
                                         query = new_query
+                                        # the rest of this answer is not used, free the model for other requests
+                                        request.cancel()
+                                        break
                             if not btalk:
                                 yield json.dumps(
                                     {"text": chunk, "chat_history_id": chat_history_id},
                                     ensure_ascii=False)
                                 if speak_handler: 
                                     speak_handler.on_llm_new_token(chunk)
-                        await asyncio.sleep(0.1)
                     print("async_callback exit!")
                 if speak_handler: 
                     speak_handler.on_llm_end(None)
@@ -286,50 +290,41 @@ async def special_chat_iterator(model: Any,
             elif loadtype == "llamacpp":
                 presetname = modelconfig["preset"]
                 prompttemplate = GeneratePresetPrompt(presetname)
-                chain = LLMChain(prompt=prompt, llm=model)
-                def running_chain(chain, query):
-                    chain.run(query)
-                    print("running_chain exit!")
-                
-                thread = threading.Thread(target=running_chain, args=(chain, query))
-                thread.start()
-                noret = False
-                while True:
-                    chunk = async_callback.get_tokens()
-                    if chunk is not None:
-                        answer += chunk
-                        print(chunk, end="")
-                        if noret is False:
-                            noret = clean_special_text(chunk, prompttemplate)
-                            if noret is False:
-                                if not btalk:
-                                    btalk, new_answer = CallingExternalToolsForCurConfig(answer)
-                                if btalk:
-                                    new_query, tool_name, docs, tool_dict, tooltype = await GetQueryFromExternalToolsForCurConfig(answer=answer, query=query)
-                                    if not new_query:
-                                        btalk = False
-                                    else:
-                                        new_answer = GetNewAnswerForCurConfig(new_answer, tool_name, tooltype)
-                                        history.append({'role': "user",'content': query})
-                                        history.append({'role': "assistant", 'content': new_answer})
-                                        yield json.dumps(
-                                            {"clear": new_answer, "tool_dict": tool_dict},
-                                            ensure_ascii=False)
-                                        user_answer = GetUserAnswerForCurConfig(tool_name, tooltype)
-                                        yield json.dumps(
-                                            {"user": user_answer, "tooltype": tooltype.value},
-                                            ensure_ascii=False)
-                                        query = new_query
-                                if not btalk:
-                                    yield json.dumps(
-                                        {"text": chunk, "chat_history_id": chat_history_id},
-                                        ensure_ascii=False)
-                                    if speak_handler: 
-                                        speak_handler.on_llm_new_token(chunk)
-                    await asyncio.sleep(0.1)
-                    if not thread.is_alive():
-                        print("async_callback exit!")
+                request = async_callback.submit(prompt_text)
+                async for chunk in request.stream():
+                    answer += chunk
+                    print(chunk, end="")
+                    if clean_special_text(chunk, prompttemplate):
+                        # the model started a new turn on its own, drop the rest
+                        request.cancel()
                         break
+                    if not btalk:
+                        btalk, new_answer = tool_detector.detect(answer)
+                    if btalk:
+                        new_query, tool_name, docs, tool_dict, tooltype = await GetQueryFromExternalToolsForCurConfig(answer=answer, query=query)
+                        if not new_query:
+                            btalk = False
+                        else:
+                            new_answer = GetNewAnswerForCurConfig(new_answer, tool_name, tooltype)
+                            history.append({'role': "user",'content': query})
+                            history.append({'role': "assistant", 'content': new_answer})
+                            yield json.dumps(
+                                {"clear": new_answer, "tool_dict": tool_dict},
+                                ensure_ascii=False)
+                            user_answer = GetUserAnswerForCurConfig(tool_name, tooltype)
+                            yield json.dumps(
+                                {"user": user_answer, "tooltype": tooltype.value},
+                                ensure_ascii=False)
+                            query = new_query
+                            request.cancel()
+                            break
+                    if not btalk:
+                        yield json.dumps(
+                            {"text": chunk, "chat_history_id": chat_history_id},
+                            ensure_ascii=False)
+                        if speak_handler: 
+                            speak_handler.on_llm_new_token(chunk)
+                print("async_callback exit!")
                 if speak_handler: 
                     speak_handler.on_llm_end(None)
                 if not btalk and docs:
@@ -486,6 +481,7 @@ async def special_chat_iterator(model: Any,
             btalk = True
             while btalk:
                 answer = ""
+                tool_detector = ToolCallDetector()
                 btalk = False
                 messages = history.copy()
                 messages.append({'role': Role.USER,
@@ -505,7 +501,7 @@ async def special_chat_iterator(model: Any,
                             print(response)
                             answer += response.output.choices[0]['message']['content']
                             if not btalk:
-                                btalk, new_answer = CallingExternalToolsForCurConfig(answer)
+                                btalk, new_answer = tool_detector.detect(answer)
                                 if btalk:
                                     new_query, tool_name, docs, tool_dict, tooltype = await GetQueryFromExternalToolsForCurConfig(answer=answer, query=query)
                                     if not new_query:
@@ -734,6 +730,7 @@ async def special_chat_iterator(model: Any,
             while btalk:
                 btalk = False
                 answer = ""
+                tool_detector = ToolCallDetector()
                 system_list = []
                 if history and history[0]["role"] == "system":
                     system_list = [history.pop(0)]
@@ -748,7 +745,7 @@ async def special_chat_iterator(model: Any,
                     print(response)
                     answer += response['result']
                     if not btalk:
-                        btalk, new_answer = CallingExternalToolsForCurConfig(answer)
+                        btalk, new_answer = tool_detector.detect(answer)
                         if btalk:
                             new_query, tool_name, docs, tool_dict, tooltype = await GetQueryFromExternalToolsForCurConfig(answer=answer, query=query)
                             if not new_query:
@@ -861,7 +858,7 @@ async def special_chat_iterator(model: Any,
                 docs = []
                 tooltype = ToolsType.Unknown
 
-    update_chat_history(chat_history_id, response=answer)
+    queue_chat_history_update(chat_history_id, response=answer)
 
 def special_model_chat(
     model: Any,
@@ -880,7 +877,7 @@ def special_model_chat(
     max_tokens: Optional[int],
     prompt_name: str,
 ):    
-    return StreamingResponse(special_chat_iterator(
+    return StreamingResponse(ndjson_stream(special_chat_iterator(
                                             model=model,
                                             tokenizer=tokenizer,
                                             async_callback=async_callback,
@@ -895,8 +892,8 @@ def special_model_chat(
                                             temperature=temperature,
                                             max_tokens=max_tokens,
                                             modelinfo=modelinfo,
-                                            prompt_name=prompt_name),
-                             media_type="text/event-stream")
+                                            prompt_name=prompt_name)),
+                             media_type=NDJSON_MEDIA_TYPE)
 
 def model_knowledge_base_chat(
     app: FastAPI,
@@ -1231,7 +1228,7 @@ def multimodal_model_chat(
                     speak_handler = StreamSpeakHandler(run_place=modeltype, provider=provider, synthesis=spspeaker, subscription=speechkey, region=speechregion)
 
         answer = ""
-        chat_history_id = add_chat_history_to_db(chat_type="llm_chat", query=query)
+        chat_history_id = queue_chat_history(chat_type="llm_chat", query=query)
         modelconfig = GetModelConfig(webui_config, modelinfo)
         device = modelconfig.get("device", "auto")
         device = "cuda" if device == "gpu" else detect_device() if device == "auto" else device
@@ -1488,9 +1485,9 @@ def multimodal_model_chat(
             if speak_handler: 
                 speak_handler.on_llm_end(None)
 
-        update_chat_history(chat_history_id, response=answer)
+        queue_chat_history_update(chat_history_id, response=answer)
         
-    return StreamingResponse(multimodal_chat_iterator(
+    return StreamingResponse(ndjson_stream(multimodal_chat_iterator(
                                             model=model,
                                             tokenizer=tokenizer,
                                             query=query,
@@ -1500,8 +1497,8 @@ def multimodal_model_chat(
                                             imagesprompt=imagesprompt,
                                             history=history,
                                             modelinfo=modelinfo,
-                                            prompt_name=prompt_name),
-                             media_type="text/event-stream")
+                                            prompt_name=prompt_name)),
+                             media_type=NDJSON_MEDIA_TYPE)
 
 def model_chat(
         app: FastAPI,
@@ -1606,7 +1603,7 @@ def special_model_search_engine_chat(
                             ensure_ascii=False)
 
         
-    return StreamingResponse(special_search_chat_iterator(
+    return StreamingResponse(ndjson_stream(special_search_chat_iterator(
                                             model=model,
                                             tokenizer=tokenizer,
                                             async_callback=async_callback,
@@ -1616,8 +1613,8 @@ def special_model_search_engine_chat(
                                             modelinfo=modelinfo,
                                             temperature=temperature,
                                             max_tokens=max_tokens,
-                                            prompt_name=prompt_name),
-                             media_type="text/event-stream")
+                                            prompt_name=prompt_name)),
+                             media_type=NDJSON_MEDIA_TYPE)
 
 def model_search_engine_chat(
     app: FastAPI,
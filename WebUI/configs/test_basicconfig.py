@@ -0,0 +1,54 @@
+import json
+import pytest
+
+pytest.importorskip("fastchat")
+
+from WebUI.configs import basicconfig
+from WebUI.configs.basicconfig import JsonScanner, ToolCallDetector, ToolsType
+
+
+@pytest.fixture(autouse=True)
+def tool_types(monkeypatch):
+    monkeypatch.setattr(basicconfig, "_tool_types", {"search_web": ToolsType.ToolSearchEngine})
+
+
+TOOL_CALL = json.dumps({"name": "search_web", "arguments": {"query": "close } and open { in \"quotes\""}})
+
+
+def test_braces_inside_strings_do_not_end_the_object():
+    text = f"Let me look that up. {TOOL_CALL} done"
+    found = JsonScanner().scan(text)
+    assert found == [(TOOL_CALL, json.loads(TOOL_CALL))]
+
+
+def test_objects_split_across_scans():
+    text = f'{{"a": "}}"}} and {TOOL_CALL}'
+    scanner = JsonScanner()
+    found = []
+    for end in range(1, len(text) + 1):
+        found += scanner.scan(text[:end])
+    assert [json_str for json_str, _ in found] == ['{"a": "}"}', TOOL_CALL]
+    assert scanner.json_strings == [json_str for json_str, _ in found]
+
+
+def test_invalid_object_is_skipped():
+    scanner = JsonScanner()
+    assert scanner.scan('{not json} {"b": 2}') == [('{"b": 2}', {"b": 2})]
+
+
+def test_detector_fires_once_when_the_tool_call_completes():
+    answer = f"Let me look that up.\n```json\n{TOOL_CALL}\n```"
+    detector = ToolCallDetector()
+    hits = []
+    for end in range(1, len(answer) + 1):
+        called, new_answer = detector.detect(answer[:end])
+        if called:
+            hits.append((end, new_answer))
+    end_of_call = answer.index(TOOL_CALL) + len(TOOL_CALL)
+    assert hits == [(end_of_call, "Let me look that up.")]
+
+
+def test_detector_ignores_json_that_is_not_a_tool_call():
+    answer = 'Here is the data: {"name": "not_a_tool", "value": "{}"}'
+    detector = ToolCallDetector()
+    assert not any(detector.detect(answer[:end])[0] for end in range(1, len(answer) + 1))
@@ -1,16 +1,26 @@
 import io
 import os
 import json
+import time
+import queue
 import torch
 import base64
+import threading
+import numpy as np
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Tuple, Union
 from WebUI.Server.utils import detect_device
 from WebUI.configs.basicconfig import TMP_DIR
 from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
 import wave
 
+WHISPER_MODELS = ["whisper-large-v3", "whisper-base", "whisper-medium"]
+FASTER_WHISPER_MODELS = ["faster-whisper-large-v3"]
+VOICE_SAMPLING_RATE = 16000
+
 def init_voice_models(config):
     if isinstance(config, dict):
-        if config["model_name"] == "whisper-large-v3" or config["model_name"] == "whisper-base" or config["model_name"] == "whisper-medium":
+        if config["model_name"] in WHISPER_MODELS:
             model_id = config["model_path"]
             device = config.get("device", "auto")
             device = "cuda" if device == "gpu" else detect_device() if device == "auto" else device
@@ -26,7 +36,7 @@ def init_voice_models(config):
                     )
             model.to(device)
             return model
-        elif config["model_name"] == "faster-whisper-large-v3":
+        elif config["model_name"] in FASTER_WHISPER_MODELS:
             from faster_whisper import WhisperModel
             model_id = config["model_path"]
             device = config.get("device", "auto")
@@ -44,43 +54,186 @@ def init_voice_models(config):
             pass
     return None
 
-def translate_voice_data(model, config, voice_data: str = "") -> str:
-    if len(voice_data):
-        decoded_data = base64.b64decode(voice_data)
-        if isinstance(config, dict):
-            if config["model_name"] == "whisper-large-v3" or config["model_name"] == "whisper-base" or config["model_name"] == "whisper-medium":
-                model_id = config["model_path"]
-                if config["loadbits"] == 16:
-                    torch_dtype = torch.float16
-                else:
-                    torch_dtype = torch.float32
-                device = config.get("device", "auto")
-                device = "cuda" if device == "gpu" else detect_device() if device == "auto" else device
-                model.to(device)
-                processor = AutoProcessor.from_pretrained(model_id)
-                pipe = pipeline(
-                    "automatic-speech-recognition",
-                    model=model,
-                    tokenizer=processor.tokenizer,
-                    feature_extractor=processor.feature_extractor,
-                    max_new_tokens=128,
-                    chunk_length_s=30,
-                    batch_size=16,
-                    return_timestamps=True,
-                    torch_dtype=torch_dtype,
-                    device=device,
-                )
-                result = pipe(decoded_data)
-                return result["text"]
-            elif config["model_name"] == "faster-whisper-large-v3":
-                binary_data = io.BytesIO(decoded_data)
-                segments, _ = model.transcribe(binary_data, beam_size=5)
-                result = ""
-                for segment in segments:
-                    result += segment.text
-                return result
+
+class VoiceStreamSession:
+    '''
+    Audio of one streaming transcription. Every chunk re-transcribes only the open window, the audio
+    after the last committed text, so a partial transcript costs at most window_s of audio. When the
+    window grows past window_s, all segments but the last are committed and the window restarts at
+    the start of the last segment.
+    '''
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.committed = ""
+        self.partial = ""
+        self.window = np.zeros(0, dtype=np.float32)
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class VoiceRecognizer:
+    '''
+    ASR front end of a local voice model. The HuggingFace pipeline is built once, requests are queued
+    and one worker thread waits up to max_wait_ms to transcribe up to max_batch_size of them in a single
+    pipeline call. faster-whisper models take the same queue and transcribe a batch one by one.
+    A request that is not transcribed within timeout_s fails instead of blocking its caller.
+    '''
+    def __init__(self, model, config: dict, max_batch_size: int = 8, max_wait_ms: float = 20,
+                 stream_window_s: float = 15, session_timeout_s: float = 120, timeout_s: float = 120):
+        self.model = model
+        self.config = config
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000)
+        self.stream_window = max(1.0, float(stream_window_s)) * VOICE_SAMPLING_RATE
+        self.session_timeout = session_timeout_s
+        self.timeout = timeout_s if timeout_s and timeout_s > 0 else None
+        self.pipe = None
+        if config["model_name"] in WHISPER_MODELS:
+            processor = AutoProcessor.from_pretrained(config["model_path"])
+            self.pipe = pipeline(
+                "automatic-speech-recognition",
+                model=model,
+                tokenizer=processor.tokenizer,
+                feature_extractor=processor.feature_extractor,
+                max_new_tokens=128,
+                chunk_length_s=30,
+                batch_size=16,
+                return_timestamps=True,
+                torch_dtype=model.dtype,
+                device=model.device,
+            )
+        self._queue = queue.Queue()
+        self._sessions: Dict[str, VoiceStreamSession] = {}
+        self._sessions_lock = threading.Lock()
+        threading.Thread(target=self._worker, name=f"voice-recognizer-{config['model_name']}", daemon=True).start()
+
+    def decode_audio(self, data: bytes, voice_format: str = "", sample_rate: int = VOICE_SAMPLING_RATE) -> np.ndarray:
+        '''
+        decode a chunk to mono float32 at 16kHz. "pcm16" is raw little-endian int16 mono audio,
+        anything else is an encoded file (wav, webm, ...) and goes through ffmpeg.
+        '''
+        if voice_format == "pcm16":
+            samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+            if sample_rate and sample_rate != VOICE_SAMPLING_RATE and len(samples):
+                duration = len(samples) / sample_rate
+                samples = np.interp(np.arange(0, duration, 1 / VOICE_SAMPLING_RATE),
+                                    np.arange(len(samples)) / sample_rate, samples).astype(np.float32)
+            return samples
+        if self.pipe is not None:
+            from transformers.pipelines.audio_utils import ffmpeg_read
+            return ffmpeg_read(data, VOICE_SAMPLING_RATE)
+        from faster_whisper import decode_audio
+        return decode_audio(io.BytesIO(data), sampling_rate=VOICE_SAMPLING_RATE)
+
+    def _transcribe_batch(self, inputs: List[Union[bytes, np.ndarray]]) -> List[List[Tuple[float, float, str]]]:
+        '''
+        transcribe every input, returns the (start, end, text) segments of each one.
+        '''
+        results = []
+        if self.pipe is not None:
+            outputs = self.pipe(list(inputs), batch_size=len(inputs))
+            for output in outputs:
+                chunks = output.get("chunks") or [{"timestamp": (0.0, None), "text": output["text"]}]
+                results.append([(chunk["timestamp"][0] or 0.0, chunk["timestamp"][1], chunk["text"]) for chunk in chunks])
+        else:
+            for data in inputs:
+                audio = io.BytesIO(data) if isinstance(data, bytes) else data
+                segments, _ = self.model.transcribe(audio, beam_size=5)
+                results.append([(segment.start, segment.end, segment.text) for segment in segments])
+        return results
+
+    def submit(self, audio: Union[bytes, np.ndarray]) -> Future:
+        future = Future()
+        self._queue.put((audio, future))
+        return future
+
+    def _collect(self) -> List[Tuple[Union[bytes, np.ndarray], Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = []
+            try:
+                # requests that timed out and were cancelled are not transcribed.
+                batch = [request for request in self._collect() if request[1].set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                results = self._transcribe_batch([audio for audio, _ in batch])
+                for (_, future), segments in zip(batch, results):
+                    future.set_result(segments)
+                if len(batch) > 1:
+                    print(f"voice recognizer: {len(batch)} requests transcribed in one batch")
+            except Exception as e:
+                print(f"voice recognizer: transcription failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _wait(self, future: Future) -> List[Tuple[float, float, str]]:
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise RuntimeError(f"transcription with '{self.config['model_name']}' timed out after {self.timeout}s")
+
+    def transcribe(self, audio: Union[bytes, np.ndarray]) -> str:
+        return "".join(text for _, _, text in self._wait(self.submit(audio)))
+
+    def _get_session(self, session_id: str) -> VoiceStreamSession:
+        now = time.monotonic()
+        with self._sessions_lock:
+            for key in [k for k, v in self._sessions.items() if now - v.last_used > self.session_timeout]:
+                del self._sessions[key]
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = VoiceStreamSession(session_id)
+                self._sessions[session_id] = session
+            session.last_used = now
+            return session
+
+    def stream(self, session_id: str, data: bytes, voice_format: str = "", sample_rate: int = VOICE_SAMPLING_RATE,
+               final: bool = False) -> dict:
+        '''
+        add one audio chunk to a streaming session and return its transcript so far.
+        final=True commits the rest of the audio and closes the session.
+        '''
+        session = self._get_session(session_id)
+        with session.lock:
+            if data:
+                session.window = np.concatenate([session.window, self.decode_audio(data, voice_format, sample_rate)])
+            segments = self._wait(self.submit(session.window)) if len(session.window) else []
+            if final:
+                session.committed += "".join(text for _, _, text in segments)
+                session.partial = ""
+                with self._sessions_lock:
+                    self._sessions.pop(session_id, None)
+            elif len(session.window) >= self.stream_window and len(segments) > 1:
+                # the last segment may be cut off by the end of the chunk, keep it open
+                session.committed += "".join(text for _, _, text in segments[:-1])
+                session.partial = segments[-1][2]
+                session.window = session.window[int(segments[-1][0] * VOICE_SAMPLING_RATE):]
+            elif len(session.window) >= 2 * self.stream_window:
+                session.committed += "".join(text for _, _, text in segments)
+                session.partial = ""
+                session.window = np.zeros(0, dtype=np.float32)
             else:
-                pass
+                session.partial = "".join(text for _, _, text in segments)
+            return {"text": session.committed + session.partial, "committed": session.committed, "final": final}
+
+
+def translate_voice_data(recognizer: VoiceRecognizer, voice_data: str = "") -> str:
+    if len(voice_data) and recognizer is not None:
+        return recognizer.transcribe(base64.b64decode(voice_data))
     return ""
 
 def cloud_voice_data(config, voice_data: str="") -> str:
@@ -1,40 +1,180 @@
+import os
 import json
+import time
+import pickle
+import tempfile
+import threading
+from typing import Any, Callable, Dict
+
+# seconds a cached config file is trusted before its mtime is checked again.
+# writes through InnerJsonConfigParse.update are visible at once.
+CONFIG_RECHECK_INTERVAL = 1.0
+
+class FrozenDict(dict):
+    '''
+    Read-only dict for config snapshots shared by all callers. copy.copy / copy.deepcopy return plain
+    mutable dicts, so code that wants to change a config has to work on its own copy.
+    '''
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("config snapshots are read-only, use copy.deepcopy() to get a mutable copy")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    __ior__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (dict, (thaw(self),))
+
+def freeze(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+def thaw(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(v) for v in obj]
+    return obj
+
+def write_json_atomic(path: str, jsondata: Any):
+    '''
+    write into a temporary file next to path and os.replace it, readers never see a half-written file.
+    '''
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".saving-", suffix=".json", dir=dirname)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(jsondata, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class JsonConfigCache:
+    '''
+    Process-wide cache of parsed json config files. A file is parsed once and parsed again
+    only when its mtime or size changed, so reading a config is a dict lookup.
+    '''
+    def __init__(self):
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _version(path: str):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load_entry(self, path: str) -> Dict:
+        entry = self._entries.get(path)
+        now = time.monotonic()
+        if entry is not None and now - entry["checked"] < CONFIG_RECHECK_INTERVAL:
+            return entry
+        with self._lock:
+            version = self._version(path)
+            entry = self._entries.get(path)
+            if entry is None or entry["version"] != version:
+                with open(path, 'r') as file:
+                    jsondata = json.load(file)
+                entry = self._make_entry(jsondata, version)
+                self._entries[path] = entry
+            entry["checked"] = now
+            return entry
+
+    @staticmethod
+    def _make_entry(jsondata: dict, version) -> Dict:
+        # the pickled content gives callers a mutable copy faster than json or deepcopy would.
+        return {"version": version, "config": freeze(jsondata), "data": pickle.dumps(jsondata),
+                "checked": time.monotonic()}
+
+    def load(self, path: str) -> FrozenDict:
+        '''
+        the shared read-only snapshot of the file.
+        '''
+        return self._load_entry(path)["config"]
+
+    def load_copy(self, path: str) -> dict:
+        '''
+        a private mutable copy of the file content.
+        '''
+        return pickle.loads(self._load_entry(path)["data"])
+
+    def update(self, path: str, func: Callable[[dict], None]) -> FrozenDict:
+        '''
+        read-modify-write: func changes a mutable copy of the file content in place,
+        the result is written atomically and becomes the new snapshot.
+        '''
+        with self._lock:
+            with open(path, 'r') as file:
+                jsondata = json.load(file)
+            func(jsondata)
+            write_json_atomic(path, jsondata)
+            entry = self._make_entry(jsondata, self._version(path))
+            self._entries[path] = entry
+            return entry["config"]
+
+config_cache = JsonConfigCache()
 
 class InnerJsonConfigParse:
+    '''
+    get() and dump() return mutable copies that callers may change freely, snapshot() returns
+    the shared read-only config for hot paths that only read it.
+    '''
     def __init__(self, path):
         try:
             self.path = path
             self.config = None
-            with open(self.path, 'r') as file:
-                jsondata = json.load(file)
-                self.config = jsondata
+            self.config = config_cache.load(self.path)
         except Exception as e:
             print(e)
             return
-        
+
     def get(self, key: str) -> any:
         if self.config is None:
             return None
         value = self.config.get(key)
-        return value
-    
+        return thaw(value)
+
     def dump(self):
         if self.config is None:
             return None
+        return config_cache.load_copy(self.path)
+
+    def snapshot(self):
+        return self.config
+
+    def update(self, func: Callable[[dict], None]):
+        self.config = config_cache.update(self.path, func)
         return self.config
 
 class InnerJsonConfigWebUIParse(InnerJsonConfigParse):
     def __init__(self):
         super().__init__("WebUI/configs/webuiconfig.json")
-    
+
 class InnerJsonConfigPresetTempParse(InnerJsonConfigParse):
     def __init__(self):
         super().__init__("WebUI/configs/presettemplates.json")
-    
+
 class InnerJsonConfigKnowledgeBaseParse(InnerJsonConfigParse):
     def __init__(self):
         super().__init__("WebUI/configs/kbconfig.json")
 
 class InnerJsonConfigAIGeneratorParse(InnerJsonConfigParse):
     def __init__(self):
-        super().__init__("WebUI/configs/aigeneratorconfig.json")
\ No newline at end of file
+        super().__init__("WebUI/configs/aigeneratorconfig.json")
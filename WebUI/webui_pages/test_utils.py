@@ -0,0 +1,43 @@
+import json
+import pytest
+
+pytest.importorskip("streamlit")
+
+from WebUI.webui_pages.utils import JsonStreamDecoder
+
+
+def feed_all(chunks):
+    decoder = JsonStreamDecoder()
+    return [data for chunk in chunks for data in decoder.feed(chunk)]
+
+
+MESSAGES = [{"text": "hello", "id": 1}, {"text": "{not a brace}\n \"quoted\"", "id": 2}, [1, 2]]
+
+
+@pytest.mark.parametrize("framing", ["ndjson", "sse", "concatenated"])
+def test_frames_split_at_every_position(framing):
+    if framing == "ndjson":
+        stream = "".join(json.dumps(message) + "\n" for message in MESSAGES)
+    elif framing == "sse":
+        stream = "".join(f"data: {json.dumps(message)}\n\n" for message in MESSAGES)
+    else:
+        stream = "".join(json.dumps(message) for message in MESSAGES)
+    for cut in range(1, len(stream)):
+        assert feed_all([stream[:cut], stream[cut:]]) == MESSAGES
+    assert feed_all(list(stream)) == MESSAGES
+
+
+def test_merged_frames_in_one_chunk():
+    stream = json.dumps(MESSAGES[0]) + "\n" + json.dumps(MESSAGES[1]) + json.dumps(MESSAGES[2])
+    assert feed_all([stream]) == MESSAGES
+
+
+def test_incomplete_object_waits_for_the_rest():
+    decoder = JsonStreamDecoder()
+    assert decoder.feed('{"text": "hel') == []
+    assert decoder.feed('lo"}\n') == [{"text": "hello"}]
+
+
+def test_sse_fields_and_invalid_lines_are_skipped():
+    stream = ": keep-alive\nevent: message\nid: 7\nnot json\n{broken\n" + f"data: {json.dumps(MESSAGES[0])}\n\n"
+    assert feed_all([stream]) == [MESSAGES[0]]
@@ -20,6 +20,54 @@ def api_address() -> str:
     port = API_SERVER["port"]
     return f"http://{host}:{port}"
 
+class JsonStreamDecoder:
+    '''
+    Incremental decoder for json chat streams. Network chunks do not follow message boundaries,
+    so partial objects stay buffered until the rest arrives. Accepts NDJSON lines, SSE "data:" lines
+    and back-to-back objects from older servers.
+    '''
+    def __init__(self):
+        self._buffer = ""
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk: str) -> List:
+        self._buffer += chunk
+        results = []
+        pos = 0
+        size = len(self._buffer)
+        while pos < size:
+            while pos < size and self._buffer[pos].isspace():
+                pos += 1
+            if pos >= size:
+                break
+            if self._buffer[pos] not in "{[":
+                end = self._buffer.find("\n", pos)
+                if end < 0:
+                    break
+                line = self._buffer[pos:end]
+                if line.startswith("data:"):
+                    # strip the sse prefix and decode the payload in place
+                    pos += len("data:")
+                    continue
+                # sse "event:", "id:", ": comment" or garbage, skip the whole line
+                if not line.startswith(("event:", "id:", ":", "retry:")):
+                    print(f"json stream: skip invalid line '{line}'")
+                pos = end + 1
+                continue
+            try:
+                data, end = self._decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError:
+                end = self._buffer.find("\n", pos)
+                if end < 0:
+                    break # incomplete object, wait for more data
+                print(f"json stream: skip invalid line '{self._buffer[pos:end]}'")
+                pos = end + 1
+                continue
+            results.append(data)
+            pos = end
+        self._buffer = self._buffer[pos:]
+        return results
+
 class ApiRequest:
     def __init__(self, base_url, timeout: float):
         self.base_url = base_url
@@ -351,19 +399,15 @@ class ApiRequest:
         as_json: bool = False,
     ):
         async def ret_async(response, as_json):
+            decoder = JsonStreamDecoder()
             try:
                 async with response as r:
                     async for chunk in r.aiter_text(None):
                         if not chunk: # fastchat api yield empty bytes on start and end
                             continue
                         if as_json:
-                            try:
-                                data = json.loads(chunk)
-                                pprint(data, depth=1)
+                            for data in decoder.feed(chunk):
                                 yield data
-                            except Exception as e:
-                                msg = f"json failed: '{chunk}'. error: {e}."
-                                print(f'{e.__class__.__name__}: {msg}')
                         else:
                             yield chunk
             except httpx.ConnectError as e:
@@ -380,19 +424,15 @@ class ApiRequest:
                 yield {"code": 500, "msg": msg}
 
         def ret_sync(response, as_json):
+            decoder = JsonStreamDecoder()
             try:
                 with response as r:
                     for chunk in r.iter_text(None):
                         if not chunk: # fastchat api yield empty bytes on start and end
                             continue
                         if as_json:
-                            try:
-                                data = json.loads(chunk)
-                                pprint(data, depth=1)
+                            for data in decoder.feed(chunk):
                                 yield data
-                            except Exception as e:
-                                msg = f"json failed: '{chunk}'. error: {e}."
-                                print(f'{e.__class__.__name__}: {msg}')
                         else:
                             yield chunk
             except httpx.ConnectError as e:
@@ -755,6 +795,31 @@ class ApiRequest:
             json=data,
         )
         return self._get_response_value(response, as_json=True, value_func=lambda r:r.get("data", ""))
+
+    def get_vtot_stream(self,
+        session_id: str,
+        voice_data: bytes = b"",
+        voice_format: str = "",
+        sample_rate: int = 16000,
+        final: bool = False,
+        controller_address: str = None
+    ):
+        '''
+        send one audio chunk of a streaming session, returns {"text", "committed", "final"}.
+        '''
+        data = {
+            "session_id": session_id,
+            "voice_data": base64.b64encode(voice_data).decode('utf-8') if voice_data else "",
+            "voice_format": voice_format,
+            "sample_rate": sample_rate,
+            "final": final,
+            "controller_address": controller_address,
+        }
+        response = self.post(
+            "/voice_model/get_vtot_stream",
+            json=data,
+        )
+        return self._get_response_value(response, as_json=True, value_func=lambda r:r.get("data", {}))
     
     def get_ttov_model(self, controller_address: str = None):
         data = {
@@ -1338,6 +1403,25 @@ class ApiRequest:
         )
         return self._get_response_value(response, as_json=True)
 
+    def search_kb_docs_batch(
+        self,
+        knowledge_base_name: str,
+        queries: List[str],
+        top_k: int = 3,
+        score_threshold: float = SCORE_THRESHOLD,
+    ) -> List[List]:
+        data = {
+            "queries": queries,
+            "knowledge_base_name": knowledge_base_name,
+            "top_k": top_k,
+            "score_threshold": score_threshold,
+        }
+        response = self.post(
+            "/knowledge_base/search_docs_batch",
+            json=data,
+        )
+        return self._get_response_value(response, as_json=True)
+
     def update_docs_by_id(
         self,
         knowledge_base_name: str,
@@ -3,6 +3,7 @@ import sys
 import time
 import json
 import signal
+import base64
 import argparse
 import asyncio
 import platform
@@ -12,7 +13,7 @@ import multiprocessing as mp
 from datetime import datetime
 from multiprocessing import Process
 from WebUI.Server.llm_api_stale import (LOG_PATH)
-from WebUI.Server.utils import (set_httpx_config, get_model_worker_config, get_httpx_client, 
+from WebUI.Server.utils import (set_httpx_config, get_model_worker_config, get_httpx_client, proxy_stream, close_proxy_clients, ndjson_stream, NDJSON_MEDIA_TYPE,
                                 FastAPI, MakeFastAPIOffline, fschat_controller_address,
                                 fschat_model_worker_address, get_vtot_worker_config, get_speech_worker_config,
                                 get_image_recognition_worker_config, get_image_generation_worker_config,
@@ -23,11 +24,12 @@ from WebUI.Server.knowledge_base.utils import SCORE_THRESHOLD
 from WebUI.configs.serverconfig import (FSCHAT_MODEL_WORKERS, FSCHAT_CONTROLLER, HTTPX_LOAD_TIMEOUT, HTTPX_RELEASE_TIMEOUT,
                                         HTTPX_LOAD_VOICE_TIMEOUT, HTTPX_RELEASE_VOICE_TIMEOUT, FSCHAT_OPENAI_API, API_SERVER)
 from fastchat.protocol.openai_api_protocol import ChatCompletionRequest
-from WebUI.configs.voicemodels import (init_voice_models, translate_voice_data, cloud_voice_data, init_speech_models, translate_speech_data)
+from WebUI.configs.voicemodels import (init_voice_models, VoiceRecognizer, translate_voice_data, cloud_voice_data, init_speech_models, translate_speech_data)
 from WebUI.configs.imagemodels import (init_image_recognition_models, translate_image_recognition_data, init_image_generation_models, translate_image_generation_data)
 from WebUI.configs.musicmodels import (init_music_generation_models, translate_music_generation_data)
 from WebUI.configs.webuiconfig import InnerJsonConfigWebUIParse
-from WebUI.configs.basicconfig import (ModelType, ModelSize, ModelSubType, GetModelInfoByName, SaveCurrentRunningCfg, load_env)
+from WebUI.configs.basicconfig import (ModelType, ModelSize, ModelSubType, GetModelInfoByName, SaveCurrentRunningCfg, load_env,
+                                       GetVoiceRecognizerConfig)
 from WebUI.configs.specialmodels import (init_cloud_models, init_multimodal_models, init_special_models, model_chat, model_search_engine_chat, model_knowledge_base_chat)
 from WebUI.configs.codemodels import init_code_models
 from typing import (Union, Optional, AsyncIterable, List, Dict)
@@ -135,6 +137,10 @@ def run_controller(started_event: mp.Event = None, q: mp.Queue = None):
     )
     _set_app_event(app, started_event)
 
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        await close_proxy_clients()
+
     # add interface to release and load model worker
     @app.post("/release_worker")
     def release_worker(
@@ -262,30 +268,21 @@ def run_controller(started_event: mp.Event = None, q: mp.Queue = None):
         workerconfig = get_model_worker_config(model_name)
         worker_address = "http://" + workerconfig["host"] + ":" + str(workerconfig["port"])
         async def fake_json_streamer() -> AsyncIterable[str]:
-            with get_httpx_client() as client:
-                response = client.stream("POST", 
-                    url=worker_address + "/text_chat",
-                    json={
-                        "query": query,
-                        "imagesdata": imagesdata,
-                        "audiosdata": audiosdata,
-                        "videosdata": videosdata,
-                        "imagesprompt": imagesprompt,
-                        "history": history,
-                        "stream": stream,
-                        "speechmodel": speechmodel,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens,
-                        "prompt_name": prompt_name,
-                        },
-                    )
-                with response as r:
-                    for chunk in r.iter_text(None):
-                        if not chunk:
-                            continue
-                        yield chunk
-                        await asyncio.sleep(0.1)
-        return StreamingResponse(fake_json_streamer(), media_type="text/event-stream")
+            async for chunk in proxy_stream(worker_address, "/text_chat", json={
+                    "query": query,
+                    "imagesdata": imagesdata,
+                    "audiosdata": audiosdata,
+                    "videosdata": videosdata,
+                    "imagesprompt": imagesprompt,
+                    "history": history,
+                    "stream": stream,
+                    "speechmodel": speechmodel,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "prompt_name": prompt_name,
+                    }):
+                yield chunk
+        return StreamingResponse(fake_json_streamer(), media_type=NDJSON_MEDIA_TYPE)
     
     @app.post("/knowledge_base_chat")
     def knowledge_base_chat(
@@ -312,30 +309,21 @@ def run_controller(started_event: mp.Event = None, q: mp.Queue = None):
         workerconfig = get_model_worker_config(model_name)
         worker_address = "http://" + workerconfig["host"] + ":" + str(workerconfig["port"])
         async def fake_json_streamer() -> AsyncIterable[str]:
-            with get_httpx_client() as client:
-                response = client.stream("POST", 
-                    url=worker_address + "/knowledge_base_chat",
-                    json={
-                        "query": query,
-                        "knowledge_base_name": knowledge_base_name,
-                        "top_k": top_k,
-                        "score_threshold": score_threshold,
-                        "history": history,
-                        "stream": stream,
-                        "imagesdata": imagesdata,
-                        "speechmodel": speechmodel,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens,
-                        "prompt_name": prompt_name,
-                        },
-                    )
-                with response as r:
-                    for chunk in r.iter_text(None):
-                        if not chunk:
-                            continue
-                        yield chunk
-                        await asyncio.sleep(0.1)
-        return StreamingResponse(fake_json_streamer(), media_type="text/event-stream")
+            async for chunk in proxy_stream(worker_address, "/knowledge_base_chat", json={
+                    "query": query,
+                    "knowledge_base_name": knowledge_base_name,
+                    "top_k": top_k,
+                    "score_threshold": score_threshold,
+                    "history": history,
+                    "stream": stream,
+                    "imagesdata": imagesdata,
+                    "speechmodel": speechmodel,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "prompt_name": prompt_name,
+                    }):
+                yield chunk
+        return StreamingResponse(fake_json_streamer(), media_type=NDJSON_MEDIA_TYPE)
     
     @app.post("/llm_search_engine_chat")
     def llm_search_engine_chat(
@@ -356,26 +344,17 @@ def run_controller(started_event: mp.Event = None, q: mp.Queue = None):
         workerconfig = get_model_worker_config(model_name)
         worker_address = "http://" + workerconfig["host"] + ":" + str(workerconfig["port"])
         async def fake_json_streamer() -> AsyncIterable[str]:
-            with get_httpx_client() as client:
-                response = client.stream("POST", 
-                    url=worker_address + "/llm_search_engine_chat",
-                    json={
-                        "query": query,
-                        "search_engine_name": search_engine_name,
-                        "history": history,
-                        "stream": stream,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens,
-                        "prompt_name": prompt_name,
-                        },
-                    )
-                with response as r:
-                    for chunk in r.iter_text(None):
-                        if not chunk:
-                            continue
-                        yield chunk
-                        await asyncio.sleep(0.1)
-        return StreamingResponse(fake_json_streamer(), media_type="text/event-stream")
+            async for chunk in proxy_stream(worker_address, "/llm_search_engine_chat", json={
+                    "query": query,
+                    "search_engine_name": search_engine_name,
+                    "history": history,
+                    "stream": stream,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "prompt_name": prompt_name,
+                    }):
+                yield chunk
+        return StreamingResponse(fake_json_streamer(), media_type=NDJSON_MEDIA_TYPE)
 
     @app.post("/get_vtot_model")
     def get_vtot_model(
@@ -455,6 +434,26 @@ def run_controller(started_event: mp.Event = None, q: mp.Queue = None):
                 return {"code": 200, "text": data}
             except Exception:
                 return {"code": 500, "text": ""}
+
+    @app.post("/get_vtot_stream")
+    def get_vtot_stream(
+        session_id: str = Body(..., description="streaming session id"),
+        voice_data: str = Body("", description="base64 audio chunk"),
+        voice_format: str = Body("", description="audio format of the chunk"),
+        sample_rate: int = Body(16000, description="sample rate of pcm16 chunks"),
+        final: bool = Body(False, description="last chunk of the session"),
+    ) -> Dict:
+        workerconfig = get_vtot_worker_config()
+        worker_address = "http://" + workerconfig["host"] + ":" + str(workerconfig["port"])
+        with get_httpx_client() as client:
+            try:
+                r = client.post(worker_address + "/get_vtot_stream",
+                    json={"session_id": session_id, "voice_data": voice_data, "voice_format": voice_format,
+                          "sample_rate": sample_rate, "final": final},
+                    )
+                return r.json()
+            except Exception:
+                return {"code": 500, "text": ""}
             
     @app.post("/get_speech_model")
     def get_speech_model(
@@ -798,7 +797,7 @@ def run_controller(started_event: mp.Event = None, q: mp.Queue = None):
                 if not thread.is_alive():
                     print("async_callback exit!")
                     break
-        return StreamingResponse(fake_json_streamer(), media_type="text/event-stream")
+        return StreamingResponse(ndjson_stream(fake_json_streamer()), media_type=NDJSON_MEDIA_TYPE)
 
     host = FSCHAT_CONTROLLER["host"]
     port = FSCHAT_CONTROLLER["port"]
@@ -1023,9 +1022,17 @@ def run_voice_worker(
             voice_model = init_voice_models(config)
             if voice_model is None:
                     return None
+            recognizer_config = GetVoiceRecognizerConfig(InnerJsonConfigWebUIParse().dump())
+            recognizer = VoiceRecognizer(voice_model, config,
+                                         max_batch_size=recognizer_config.get("max_batch_size", 8),
+                                         max_wait_ms=recognizer_config.get("max_wait_ms", 20),
+                                         stream_window_s=recognizer_config.get("stream_window_s", 15),
+                                         session_timeout_s=recognizer_config.get("session_timeout_s", 120),
+                                         timeout_s=recognizer_config.get("timeout_s", 120))
         elif kwargs["model_type"] == "cloud":
             model_type = "cloud"
             voice_model = None
+            recognizer = None
     except Exception as e:
         print(e)
         return None
@@ -1048,13 +1055,31 @@ def run_voice_worker(
             return {"code": 500, "text": ""}
         text_data = ""
         if model_type == "local":
-            text_data = translate_voice_data(voice_model, config, voice_data)
+            text_data = translate_voice_data(recognizer, voice_data)
         elif model_type == "cloud":
             configinst = InnerJsonConfigWebUIParse()
             webui_config = configinst.dump()
             text_data = cloud_voice_data(webui_config.get("ModelConfig").get("VtoTModel").get(model_name), voice_data)
         return {"code": 200, "text": text_data}
 
+    @app.post("/get_vtot_stream")
+    def get_vtot_stream(
+        session_id: str = Body(..., description="streaming session id"),
+        voice_data: str = Body("", description="base64 audio chunk"),
+        voice_format: str = Body("", description="pcm16 for raw 16-bit mono audio, empty for an encoded file"),
+        sample_rate: int = Body(16000, description="sample rate of pcm16 chunks"),
+        final: bool = Body(False, description="last chunk of the session"),
+    ) -> dict:
+        if recognizer is None:
+            return {"code": 500, "text": "", "msg": f"voice model {model_name} does not support streaming"}
+        try:
+            result = recognizer.stream(session_id, base64.b64decode(voice_data) if voice_data else b"",
+                                       voice_format=voice_format, sample_rate=sample_rate, final=final)
+            return {"code": 200, **result}
+        except Exception as e:
+            print(f"streaming transcription failed: {e}")
+            return {"code": 500, "text": "", "msg": str(e)}
+
     uvicorn.run(app, host=host, port=port)
 
 def run_speech_worker(